@@ -3,6 +3,12 @@ from sequence import *
 import classutil
 import UserDict
 import weakref
+import pickle
+import operator
+import array
+import struct
+import sys
+from mapping import get_many
 
 
 def getAnnotationAttr(self, attr):
@@ -10,6 +16,70 @@ def getAnnotationAttr(self, attr):
     return self.db.getSliceAttr(self.db.sliceDB[self.id], attr)
 
 
+def normalize_seq_id(seq_id):
+    'convert a sliceInfo sequence ID to the key used for seqDB lookup'
+    # IGB fix: In case seq_id is a float or int
+    # For some reason, even the chr12 values are either unicode or some other type
+    try:
+        return int(seq_id)
+    except:
+        try:
+            return float(seq_id)
+        except:
+            return str(seq_id)
+
+
+def slice_getter(sliceAttrDict, attrs):
+    '''compile a function returning the tuple of attrs from a sliceInfo,
+    applying sliceAttrDict aliases; integer aliases are tuple indices'''
+    names = [sliceAttrDict.get(attr, attr) for attr in attrs]
+    isIndex = [isinstance(k, int) for k in names]
+    if False not in isIndex:
+        return operator.itemgetter(*names)
+    elif True not in isIndex:
+        return operator.attrgetter(*names)
+    getters = []
+    for k in names:
+        if isinstance(k, int):
+            getters.append(operator.itemgetter(k))
+        else:
+            getters.append(operator.attrgetter(k))
+    return lambda sliceInfo: tuple([f(sliceInfo) for f in getters])
+
+
+class SeqIDResolver(object):
+    """memoize normalize_seq_id() and seqDB lookup of sliceInfo sequence IDs.
+    Normalized IDs beyond maxCache are evicted least recently used first;
+    sequences are only weakly referenced, so we never keep them alive."""
+    maxCache = 10000 # number of normalized sequence IDs to remember
+
+    def __init__(self, seqDB):
+        self.seqDB = seqDB
+        self.keys = classutil.LRUDictionary(self.maxCache)
+        self.seqs = weakref.WeakValueDictionary()
+
+    def key(self, seq_id):
+        'get the normalized seqDB key for seq_id'
+        try:
+            return self.keys[seq_id]
+        except KeyError:
+            k = self.keys[seq_id] = normalize_seq_id(seq_id)
+            return k
+
+    def __getitem__(self, k):
+        'get the sequence object for normalized key k'
+        try:
+            return self.seqs[k]
+        except KeyError:
+            pass
+        seq = self.seqDB[k]
+        try:
+            self.seqs[k] = seq
+        except TypeError: # seq cannot be weakly referenced
+            pass
+        return seq
+
+
 def annotation_repr(self):
     if self.annotationType is not None:
         title = self.annotationType
@@ -138,6 +208,180 @@ class TranslationAnnotSlice(AnnotationSlice):
     frame = TranslationAnnotFrameDescr()
 
 
+class AnnotationIntervalIndex(object):
+    """nested list interval index of an AnnotationDB, with a short stack
+    of IntervalDB levels per sequence ID.  If filestem is given, the
+    index is stored as binary files filestem.N.LEVEL.* plus a
+    filestem.catalog pickle, and reopened from them if they already
+    exist and still match annoDB.sliceDB (mode='r')."""
+    maxPending = 1000 # merge new annotations into nested list beyond this
+    maxCoord = 2147483647 # largest coordinate an IntervalDB can hold
+
+    def __init__(self, annoDB, filestem=None, mode='r'):
+        self.annoDB = annoDB
+        self.filestem = filestem
+        self._nlists = {}
+        if filestem is not None and mode == 'r':
+            try:
+                self.open()
+                return
+            except IOError: # no saved index, so build it
+                pass
+        self.build()
+
+    def get_interval(self, k, sliceInfo):
+        'get seq_id, start, stop in forward orientation for sliceInfo'
+        seq_id, start, stop = self.annoDB.get_slice_interval(k, sliceInfo)
+        if start < 0:
+            return seq_id, -stop, -start
+        return seq_id, start, stop
+
+    def build(self):
+        'build the index by scanning every sliceInfo in annoDB.sliceDB'
+        self.close()
+        self.annotIDs = [] # maps IntervalDB target_id to annotation ID
+        self.seqIDs = {} # maps seq_id to its binary file number
+        self._sizes = {} # number of intervals in each level, per seq_id
+        self._pending = {}
+        self._latest = {} # current target_id of each annotation ID
+        d = {}
+        for k, sliceInfo in self.annoDB.sliceDB.iteritems():
+            try:
+                seq_id, start, stop = self.get_interval(k, sliceInfo)
+            except IndexError: # not a valid annotation, so skip it
+                continue
+            d.setdefault(seq_id, []).append((start, stop,
+                                             len(self.annotIDs), 0, 0))
+            self._latest[k] = len(self.annotIDs)
+            self.annotIDs.append(k)
+        for seq_id, l in d.iteritems():
+            self._save_intervals(seq_id, l)
+        self.save_catalog()
+
+    def _save_intervals(self, seq_id, l):
+        'push a new nested list level for seq_id from interval tuples l'
+        from cnestedlist import IntervalDB, IntervalFileDB
+        try:
+            n = self.seqIDs[seq_id]
+        except KeyError:
+            n = self.seqIDs[seq_id] = len(self.seqIDs)
+        levels = self._nlists.setdefault(seq_id, [])
+        db = IntervalDB()
+        db.save_tuples(l)
+        if self.filestem is not None: # save to disk and search from there
+            filestem = '%s.%d.%d' % (self.filestem, n, len(levels))
+            db.write_binaries(filestem)
+            db.close()
+            db = IntervalFileDB(filestem)
+        levels.append(db)
+        self._sizes.setdefault(seq_id, []).append(len(l))
+        self._dirty = True
+
+    def open(self):
+        """open a saved index; raise IOError if it does not exist, or
+        is out of date: annoDB.sliceDB has a different number of items,
+        or lacks the last annotation ID indexed"""
+        from cnestedlist import IntervalFileDB
+        ifile = file(self.filestem + '.catalog', 'rb')
+        try:
+            d = pickle.load(ifile)
+        finally:
+            ifile.close()
+        self.annotIDs = d['annotIDs']
+        if d.get('nslices') != len(self.annoDB.sliceDB):
+            raise IOError('index is out of date: %s' % self.filestem)
+        for k in self.annotIDs[::-1]: # check the last annotation indexed
+            if k is not None:
+                if k not in self.annoDB.sliceDB:
+                    raise IOError('index is out of date: %s' % self.filestem)
+                break
+        self.seqIDs = d['seqIDs']
+        self._sizes = d['sizes']
+        self._pending = d['pending']
+        self._latest = dict([(k, i) for (i, k) in enumerate(self.annotIDs)
+                             if k is not None]) # LAST ENTRY FOR k WINS
+        for seq_id, n in self.seqIDs.iteritems():
+            self._nlists[seq_id] = [IntervalFileDB('%s.%d.%d'
+                                                   % (self.filestem, n, i))
+                                    for i in range(len(self._sizes[seq_id]))]
+        self._dirty = False
+
+    def save_catalog(self):
+        'save the annotation IDs and pending intervals of a disk index'
+        if self.filestem is None or not self._dirty:
+            return
+        ifile = file(self.filestem + '.catalog', 'wb')
+        try:
+            pickle.dump(dict(annotIDs=self.annotIDs, seqIDs=self.seqIDs,
+                             sizes=self._sizes, pending=self._pending,
+                             nslices=len(self.annoDB.sliceDB)), ifile, 2)
+        finally:
+            ifile.close()
+        self._dirty = False
+
+    def add(self, k, sliceInfo):
+        '''add a new annotation to the index; if k was already indexed,
+        its old interval is no longer returned by find()'''
+        try:
+            seq_id, start, stop = self.get_interval(k, sliceInfo)
+        except IndexError: # not a valid annotation, so skip it
+            if k in self._latest: # hide its old interval
+                self.annotIDs[self._latest.pop(k)] = None
+                self._dirty = True
+            return
+        l = self._pending.setdefault(seq_id, [])
+        l.append((start, stop, len(self.annotIDs), 0, 0))
+        if k in self._latest: # hide its old interval
+            self.annotIDs[self._latest[k]] = None
+        self._latest[k] = len(self.annotIDs)
+        self.annotIDs.append(k)
+        self._dirty = True
+        if len(l) > self.maxPending:
+            self.merge(seq_id)
+
+    def merge(self, seq_id):
+        """save the pending intervals of seq_id as a new nested list
+        level, first merging in any top levels no bigger than it.  Like
+        a binary counter, this keeps O(log n) levels and rebuilds each
+        interval O(log n) times, instead of rebuilding everything"""
+        l = self._pending.pop(seq_id)
+        levels = self._nlists.get(seq_id, [])
+        sizes = self._sizes.get(seq_id, [])
+        while sizes and sizes[-1] <= len(l):
+            sizes.pop()
+            db = levels.pop()
+            l = db.find_overlap_list(0, self.maxCoord) + l
+            db.close()
+        self._save_intervals(seq_id, l)
+
+    def find(self, seq_id, start, stop):
+        'list IDs of annotations overlapping seq_id[start:stop], by start'
+        if start < 0: # use forward orientation
+            start, stop = -stop, -start
+        seq_id = normalize_seq_id(seq_id)
+        l = []
+        for db in self._nlists.get(seq_id, ()):
+            l += db.find_overlap_list(start, stop)
+        for t in self._pending.get(seq_id, ()):
+            if t[0] < stop and start < t[1]:
+                l.append(t)
+        l.sort()
+        annotIDs = self.annotIDs
+        return [annotIDs[t[2]] for t in l
+                if annotIDs[t[2]] is not None] # SKIP REPLACED INTERVALS
+
+    def close(self):
+        'save catalog if needed and close the nested list files'
+        try:
+            self.save_catalog()
+        except AttributeError: # nothing built or opened yet
+            pass
+        for levels in self._nlists.itervalues():
+            for db in levels:
+                db.close()
+        self._nlists = {}
+
+
 class AnnotationDB(object, UserDict.DictMixin):
     'container of annotations as specific slices of db sequences'
 
@@ -146,14 +390,16 @@ class AnnotationDB(object, UserDict.DictMixin):
                  itemSliceClass=AnnotationSlice,
                  itemAttrDict=None, # GET RID OF THIS BACKWARDS-COMPATIBILITY KLUGE!!
                  sliceAttrDict=None, maxCache=None, autoGC=True,
-                 checkFirstID=True, **kwargs):
+                 checkFirstID=True, indexPath=None, **kwargs):
         '''sliceDB must map identifier to a sliceInfo object;
         sliceInfo must have attributes: id, start, stop, orientation;
         seqDB must map sequence ID to a sliceable sequence object;
         sliceAttrDict gives optional dict of item attributes that
         should be mapped to sliceDB item attributes.
         maxCache specfies the maximum number of annotation objects
-        to keep in the cache.'''
+        to keep in the cache.
+        indexPath gives an optional filestem for storing the interval
+        index used by find() and overlapping().'''
         if autoGC: # automatically garbage collect unused objects
             self._weakValueDict = classutil.RecentValueDictionary(autoGC)
         else:
@@ -172,6 +418,8 @@ class AnnotationDB(object, UserDict.DictMixin):
         self.sliceAttrDict = sliceAttrDict # USER-PROVIDED ALIASES
         if maxCache is not None:
             self.maxCache = maxCache
+        if indexPath is not None:
+            self.indexPath = indexPath
         if checkFirstID:
             try: # don't cache anything now; schema may change itemClass!
                 k = iter(self).next() # get the first ID if any
@@ -187,7 +435,8 @@ cannot create annotation object %s; sequence database %s may not be correct'''
     __setstate__ = classutil.standard_setstate
     _pickleAttrs = dict(sliceDB=0, seqDB=0, annotationType=0, autoGC=0,
                         itemClass=0, itemSliceClass=0, sliceAttrDict=0,
-                        maxCache=0)
+                        maxCache=0, indexPath=0)
+    indexPath = None
 
     def __hash__(self):                 # @CTB unnecessary??
         'ALLOW THIS OBJECT TO BE USED AS A KEY IN DICTS...'
@@ -218,45 +467,76 @@ cannot create annotation object %s; sequence database %s may not be correct'''
         except TypeError: # TREAT AS int INDEX INTO A TUPLE
             return sliceInfo[k]
 
-    def get_annot_obj(self, k, sliceInfo):
-        'create an annotation object based on the input sliceInfo'
-        start = int(self.getSliceAttr(sliceInfo, 'start'))
-        stop = int(self.getSliceAttr(sliceInfo, 'stop'))
-
+    def get_slice_getters(self):
+        '''get (getter with orientation, getter without) compiled from
+        sliceAttrDict, or None if a subclass overrides getSliceAttr()'''
+        if self.__class__.getSliceAttr.im_func \
+               is not AnnotationDB.getSliceAttr.im_func:
+            return None
         try:
-            orientation = self.getSliceAttr(sliceInfo, 'orientation')
-            orientation = int(orientation)
-            if orientation < 0 and start >= 0:
-                start, stop = (-stop, -start) # Negative-orientation coords
-        except (AttributeError, IndexError):
-            pass                        # ok if no orientation is specified.
+            d, getters = self._sliceGetters
+            if d == self.sliceAttrDict: # still up to date
+                return getters
+        except AttributeError:
+            pass
+        getters = (slice_getter(self.sliceAttrDict,
+                                ('id', 'start', 'stop', 'orientation')),
+                   slice_getter(self.sliceAttrDict, ('id', 'start', 'stop')))
+        self._sliceGetters = (self.sliceAttrDict.copy(), getters)
+        return getters
+
+    def get_seq_resolver(self):
+        'get memoizing SeqIDResolver for our seqDB'
+        try:
+            if self._seqResolver.seqDB is self.seqDB:
+                return self._seqResolver
+        except AttributeError:
+            pass
+        self._seqResolver = SeqIDResolver(self.seqDB)
+        return self._seqResolver
+
+    def get_slice_interval(self, k, sliceInfo, getters=None, resolver=None):
+        'get seq_id, start, stop for the input sliceInfo'
+        if getters is None:
+            getters = self.get_slice_getters()
+        if getters is None: # use subclass getSliceAttr()
+            seq_id = self.getSliceAttr(sliceInfo, 'id')
+            start = self.getSliceAttr(sliceInfo, 'start')
+            stop = self.getSliceAttr(sliceInfo, 'stop')
+            try:
+                orientation = self.getSliceAttr(sliceInfo, 'orientation')
+            except (AttributeError, IndexError):
+                orientation = None
+        else:
+            try:
+                seq_id, start, stop, orientation = getters[0](sliceInfo)
+            except (AttributeError, IndexError): # no orientation specified
+                seq_id, start, stop = getters[1](sliceInfo)
+                orientation = None
+        start = int(start)
+        stop = int(stop)
+        if orientation is not None and int(orientation) < 0 and start >= 0:
+            start, stop = (-stop, -start) # Negative-orientation coords
 
         if start >= stop:
             raise IndexError('annotation %s has zero or negative length \
                              [%s:%s]!' % (k, start, stop))
-        seq_id = self.getSliceAttr(sliceInfo, 'id')
+        if resolver is None:
+            resolver = self.get_seq_resolver()
+        return resolver.key(seq_id), start, stop
+
+    def get_annot_obj(self, k, sliceInfo, getters=None, resolver=None):
+        'create an annotation object based on the input sliceInfo'
+        if resolver is None:
+            resolver = self.get_seq_resolver()
+        seq_id, start, stop = self.get_slice_interval(k, sliceInfo, getters,
+                                                      resolver)
 
-        # IGB fix: In case seq_id is a float or int
-        # For some reason, even the chr12 values are either unicode or some other type
-        is_int = False
-        is_float = False
-        is_string = False
-        
-        try:
-            seq_id = int(seq_id)
-            is_int = True
-        except:
-            try:
-                seq_id = float(seq_id)
-                is_float = True
-            except:
-                seq_id = str(seq_id)
-            
         # IGB fix: KeyError raised during Possum search
         # when a chromosome doesn't exist. This error is relevant to
         # 
         try:
-            seq = self.seqDB[seq_id]
+            seq = resolver[seq_id]
         except KeyError:
             raise IndexError('get_annot_obj::annotation does not have seq_id: %s (keys=%s)' % (seq_id, self.seqDB.keys()))
         
@@ -271,18 +551,47 @@ cannot create annotation object %s; sequence database %s may not be correct'''
         except IndexError:
             a = None
             pass
-        
-        try: # APPLY CACHE SIZE LIMIT IF ANY
-            if limitCache and self.maxCache < len(self._weakValueDict):
-                self._weakValueDict.clear()
-        except AttributeError:
-            pass
 
         # IGB fix: Return a None
-        if a != None:
+        if a is not None:
             self._weakValueDict[k] = a # CACHE THIS IN OUR DICT
+            if limitCache:
+                self.limit_cache()
         return a
 
+    def limit_cache(self):
+        'apply maxCache limit to cache size, evicting least recently used'
+        try:
+            classutil.limit_cache(self._weakValueDict, self.maxCache)
+        except AttributeError: # no maxCache
+            pass
+
+    def get_many(self, keys):
+        '''get list of annotation objects for a list of keys, retrieving
+        uncached sliceInfo with sliceDB.get_many() if available, and
+        building the annotations in a single pass'''
+        cache = self._weakValueDict
+        found = {}
+        missing = []
+        for k in keys:
+            try:
+                found[k] = cache[k]
+            except KeyError:
+                if k not in found:
+                    found[k] = None
+                    missing.append(k)
+        getters = self.get_slice_getters()
+        resolver = self.get_seq_resolver()
+        get_annot_obj = self.get_annot_obj
+        for k, sliceInfo in zip(missing, get_many(self.sliceDB, missing)):
+            try:
+                a = get_annot_obj(k, sliceInfo, getters, resolver)
+            except IndexError: # same as sliceAnnotation()
+                continue
+            cache[k] = found[k] = a
+        self.limit_cache()
+        return [found[k] for k in keys]
+
     def new_annotation(self, k, sliceInfo):
         'save sliceInfo to the annotation database \
                 and return annotation object'
@@ -299,8 +608,152 @@ cannot create annotation object %s; sequence database %s may not be correct'''
                 pass
             raise
         self._wroteSliceDB = True
+        try: # keep the interval index up to date
+            self._intervalIndex.add(k, sliceInfo)
+        except AttributeError:
+            pass
         return a
 
+    def bulk_load(self, items, skipInvalid=False, buildIndex=False,
+                  bufferSize=10000):
+        """save many (k, sliceInfo) pairs to sliceDB, validating them but
+        without creating or caching annotation objects.  An SQL sliceDB
+        is written with one bulk_writer() transaction, and its slice
+        columns found via sliceAttrDict (ValueError if it does not map
+        id, start, stop to column names); other sliceDBs
+        in batches of bufferSize, in key order.  Invalid sliceInfo
+        (zero length or unknown sequence) is skipped if skipInvalid,
+        otherwise saved as by new_annotation().  The interval index,
+        if built (or buildIndex), is rebuilt once at the end.
+        Returns the number of items saved."""
+        getters = self.get_slice_getters()
+        resolver = self.get_seq_resolver()
+        get_slice_interval = self.get_slice_interval
+        cache = self._weakValueDict
+        try:
+            writer = self.sliceDB.bulk_writer(bufferSize)
+        except AttributeError: # not SQL
+            writer = None
+        n = 0
+        buf = []
+        try:
+            for k, sliceInfo in items:
+                try:
+                    seq_id = get_slice_interval(k, sliceInfo, getters,
+                                                resolver)[0]
+                    resolver[seq_id]
+                except (IndexError, KeyError):
+                    if skipInvalid:
+                        continue
+                try: # don't leave an old annotation object in cache
+                    del cache[k]
+                except KeyError:
+                    pass
+                buf.append((k, sliceInfo))
+                if len(buf) >= bufferSize:
+                    self._bulk_write(buf, writer)
+                    n += len(buf)
+                    buf = []
+            self._bulk_write(buf, writer)
+            n += len(buf)
+        except:
+            if writer is not None:
+                writer.abort()
+            raise
+        if writer is not None:
+            writer.close() # commit
+        self._wroteSliceDB = True
+        if buildIndex or hasattr(self, '_intervalIndex'):
+            self.build_interval_index('w')
+        return n
+
+    def _bulk_write(self, buf, writer):
+        'save list of (k, sliceInfo) to sliceDB'
+        sliceDB = self.sliceDB
+        if writer is not None: # SQL: row values from sliceInfo attributes
+            ikey = sliceDB.data[sliceDB.primary_key]
+            icols = self._slice_columns()
+            for k, sliceInfo in buf:
+                row = sliceDB.tuple_from_obj(sliceInfo)
+                for icol, v in zip(icols, self._slice_values(k, sliceInfo)):
+                    if icol is not None:
+                        row[icol] = v
+                row[ikey] = k
+                sliceDB._insert(row)
+            return
+        if not isinstance(sliceDB, dict): # shelve btree: write in key order
+            buf.sort(key=lambda t: t[0])
+        for k, sliceInfo in buf:
+            sliceDB[k] = sliceInfo
+
+    def _slice_columns(self):
+        '''get SQL sliceDB column indices for id, start, stop, orientation
+        (None if it has no orientation column), via sliceAttrDict'''
+        icols = []
+        for attr in ('id', 'start', 'stop', 'orientation'):
+            col = self.sliceAttrDict.get(attr, attr)
+            try:
+                icols.append(self.sliceDB.data[col])
+            except KeyError:
+                if attr == 'orientation':
+                    icols.append(None)
+                else:
+                    raise ValueError('sliceAttrDict maps %s to %r, not a \
+column of %s' % (attr, col, self.sliceDB.name))
+        return icols
+
+    def _slice_values(self, k, sliceInfo):
+        'get id, start, stop, orientation (None if absent) of sliceInfo'
+        getters = self.get_slice_getters()
+        try:
+            if getters is None: # use subclass getSliceAttr()
+                values = [self.getSliceAttr(sliceInfo, attr)
+                          for attr in ('id', 'start', 'stop')]
+            else:
+                values = list(getters[1](sliceInfo))
+        except (AttributeError, IndexError, KeyError, TypeError):
+            raise ValueError('annotation %s: cannot read id, start, stop \
+from sliceInfo %r' % (k, sliceInfo))
+        try:
+            if getters is None:
+                values.append(self.getSliceAttr(sliceInfo, 'orientation'))
+            else:
+                values.append(getters[0](sliceInfo)[3])
+        except (AttributeError, IndexError, KeyError, TypeError):
+            values.append(None)
+        return values
+
+    def build_interval_index(self, mode='r'):
+        '''get interval index of our annotations, building it if needed;
+        mode='w' forces it to be rebuilt from sliceDB'''
+        try:
+            if mode == 'r':
+                return self._intervalIndex
+            self._intervalIndex.close()
+        except AttributeError:
+            pass
+        self._intervalIndex = AnnotationIntervalIndex(self, self.indexPath,
+                                                      mode)
+        return self._intervalIndex
+
+    def find(self, seq_id, start, stop):
+        'list annotations overlapping interval start:stop of seq_id'
+        l = []
+        for k in self.build_interval_index().find(seq_id, start, stop):
+            a = self[k]
+            if a is not None:
+                l.append(a)
+        return l
+
+    def overlapping(self, region):
+        'list annotations overlapping the sequence interval region'
+        start, stop = region._abs_interval
+        try: # get the seqDB key, e.g. prefix.id in a PrefixUnionDict
+            seq_id = (~self.seqDB)[region.pathForward]
+        except TypeError: # plain dict seqDB has no inverse mapping
+            seq_id = region.pathForward.id
+        return self.find(seq_id, start, stop)
+
     def foreignKey(self, attr, k):
         'iterate over items matching specified foreign key'
         for t in self.sliceDB.foreignKey(attr, k):
@@ -386,6 +839,11 @@ cannot create annotation object %s; sequence database %s may not be correct'''
 
     def close(self):
         'if sliceDB needs to be closed, do it and return True, otherwise False'
+        try:
+            self._intervalIndex.close()
+            del self._intervalIndex
+        except AttributeError:
+            pass
         try:
             if self._wroteSliceDB:
                 self.sliceDB.close()
@@ -408,6 +866,14 @@ for you, when the AnnotationDB was deleted.'''
     def clear_cache(self):
         'empty the cache'
         self._weakValueDict.clear()
+        try:
+            del self._seqResolver
+        except AttributeError:
+            pass
+
+    def cache_stats(self):
+        'dict of annotation cache size, hits, misses and evictions'
+        return classutil.cache_stats(self._weakValueDict)
 
     # not clear what this should do for AnnotationDB
 
@@ -432,11 +898,248 @@ for you, when the AnnotationDB was deleted.'''
         raise NotImplementedError("no deletions allowed")
 
 
+class ArraySliceInfo(object):
+    '''sliceInfo for one row of an ArrayAnnotationDB; its sliceAttrDict
+    aliases and tuple indices also work, like the sliceInfo saved'''
+    __slots__ = ('id', 'start', 'stop', 'orientation', '_db', '_row')
+
+    def __init__(self, db, row, id, start, stop, orientation):
+        self._db = db
+        self._row = row
+        self.id = id
+        self.start = start
+        self.stop = stop
+        self.orientation = orientation
+
+    def __getattr__(self, attr):
+        'get extra attribute from its column in the string table'
+        try:
+            return self._db._attrs[attr][self._row]
+        except KeyError:
+            pass
+        try:
+            return getattr(self, self._db._aliases[attr])
+        except KeyError:
+            raise AttributeError('no attribute ' + attr)
+
+    def __getitem__(self, i):
+        try:
+            return getattr(self, self._db._aliases[i])
+        except KeyError:
+            raise IndexError('no attribute index %s' % i)
+
+    def __repr__(self):
+        return '<ArraySliceInfo %s[%d:%d] %d>' % (self.id, self.start,
+                                                  self.stop, self.orientation)
+
+
+class ArrayAnnotationDB(object, UserDict.DictMixin):
+    '''compact sliceDB storage for AnnotationDB: seq_id index, start, stop
+    and orientation in fixed-width binary columns (filestem.arr, read via
+    mmap), with annotation IDs, sequence IDs and any extra attrs in a
+    string table (filestem.strings).  mode='w' creates a new database,
+    saved by close(); sliceAttrDict says how to read the sliceInfo
+    objects saved to it.'''
+    _magic = 'PYGRARR1'
+    _columns = (('seqIndex', 'i'), ('start', 'i'), ('stop', 'i'),
+                ('orientation', 'b'))
+
+    def __init__(self, filestem, mode='r', attrs=(), sliceAttrDict=None,
+                 chunkSize=65536, **kwargs):
+        self.filestem = filestem
+        self.chunkSize = chunkSize
+        if mode == 'r':
+            self._open()
+            return
+        elif mode != 'w':
+            raise ValueError('mode must be r or w')
+        self._keys = []
+        self._seqIDs = [] # the string table of sequence IDs
+        self._seqIndex = {}
+        self._attrNames = list(attrs) # same order as _attrGetters
+        self._attrs = dict([(attr, []) for attr in attrs])
+        self._index = {}
+        self._rows = [] # (seqIndex, start, stop, orientation) not yet saved
+        if sliceAttrDict is None:
+            sliceAttrDict = {}
+        self._set_aliases(sliceAttrDict)
+        self._getters = (slice_getter(sliceAttrDict, ('id', 'start', 'stop',
+                                                      'orientation')),
+                         slice_getter(sliceAttrDict, ('id', 'start', 'stop')))
+        self._attrGetters = [slice_getter(sliceAttrDict, (attr, ))
+                             for attr in attrs]
+        self._mmap = None
+        self._writeable = True
+    __getstate__ = classutil.standard_getstate
+    __setstate__ = classutil.standard_setstate
+    _pickleAttrs = dict(filestem=0, chunkSize=0)
+
+    def _set_aliases(self, sliceAttrDict):
+        'map sliceAttrDict aliases and indices to our attribute names'
+        self.sliceAttrDict = sliceAttrDict
+        self._aliases = dict([(v, k) for (k, v) in sliceAttrDict.items()])
+
+    def _open(self):
+        'open the string table, and mmap the binary columns'
+        import mmap
+        ifile = file(self.filestem + '.strings', 'rb')
+        try:
+            d = pickle.load(ifile)
+        finally:
+            ifile.close()
+        self._keys = d['keys']
+        self._seqIDs = d['seqIDs']
+        self._attrs = d['attrs']
+        self._attrNames = d['attrNames']
+        self._set_aliases(d['sliceAttrDict'])
+        self._byteswap = d['byteorder'] != sys.byteorder
+        self._index = dict([(k, i) for (i, k) in enumerate(self._keys)])
+        n = len(self._keys)
+        ifile = file(self.filestem + '.arr', 'rb')
+        try:
+            self._mmap = mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            ifile.close()
+        if self._mmap[:len(self._magic)] != self._magic:
+            raise IOError('%s.arr is not an ArrayAnnotationDB file'
+                          % self.filestem)
+        if d['byteorder'] == 'little':
+            byteorder = '<'
+        else:
+            byteorder = '>'
+        offset = len(self._magic)
+        self._offsets = []
+        self._structs = []
+        for name, typecode in self._columns: # columns follow the header
+            self._offsets.append(offset)
+            self._structs.append(struct.Struct(byteorder + typecode))
+            offset += n * array.array(typecode).itemsize
+        self._rows = None
+        self._writeable = False
+
+    def _read_row(self, i):
+        'get (seqIndex, start, stop, orientation) of row i'
+        if self._rows is not None:
+            return self._rows[i]
+        m = self._mmap
+        return [st.unpack_from(m, offset + i * st.size)[0]
+                for (st, offset) in zip(self._structs, self._offsets)]
+
+    def __getitem__(self, k):
+        i = self._index[k] # KeyError if not found
+        seqIndex, start, stop, orientation = self._read_row(i)
+        return ArraySliceInfo(self, i, self._seqIDs[seqIndex], start, stop,
+                              orientation)
+
+    def __setitem__(self, k, sliceInfo):
+        if not self._writeable:
+            raise ValueError('ArrayAnnotationDB opened read-only')
+        try:
+            seq_id, start, stop, orientation = self._getters[0](sliceInfo)
+        except (AttributeError, IndexError): # default orientation
+            seq_id, start, stop = self._getters[1](sliceInfo)
+            orientation = 1
+        try:
+            seqIndex = self._seqIndex[seq_id]
+        except KeyError:
+            seqIndex = self._seqIndex[seq_id] = len(self._seqIDs)
+            self._seqIDs.append(seq_id)
+        row = (seqIndex, int(start), int(stop), int(orientation))
+        values = [f(sliceInfo) for f in self._attrGetters]
+        try:
+            i = self._index[k]
+        except KeyError: # append a new row
+            self._index[k] = len(self._keys)
+            self._keys.append(k)
+            self._rows.append(row)
+            for attr, v in zip(self._attrNames, values):
+                self._attrs[attr].append(v)
+        else: # replace existing row
+            self._rows[i] = row
+            for attr, v in zip(self._attrNames, values):
+                self._attrs[attr][i] = v
+
+    def iter_arrays(self):
+        '''generate chunks of up to chunkSize rows as lists of columns:
+        keys, seqIDs, starts, stops, orientations'''
+        n = len(self._keys)
+        for i in xrange(0, n, self.chunkSize):
+            end = min(i + self.chunkSize, n)
+            if self._rows is not None:
+                columns = zip(*self._rows[i:end])
+            else:
+                columns = []
+                for offset, (name, typecode) in zip(self._offsets,
+                                                    self._columns):
+                    a = array.array(typecode)
+                    a.fromstring(self._mmap[offset + i * a.itemsize:
+                                            offset + end * a.itemsize])
+                    if self._byteswap:
+                        a.byteswap()
+                    columns.append(a)
+            seqIDs = self._seqIDs
+            yield [self._keys[i:end], [seqIDs[j] for j in columns[0]]] \
+                  + list(columns[1:])
+
+    def iteritems(self):
+        i = 0
+        for chunk in self.iter_arrays():
+            for k, seq_id, start, stop, ori in zip(*chunk):
+                yield k, ArraySliceInfo(self, i, seq_id, start, stop, ori)
+                i += 1
+
+    def itervalues(self):
+        for k, v in self.iteritems():
+            yield v
+
+    def keys(self):
+        return list(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, k):
+        return k in self._index
+
+    def close(self):
+        'save a new database to disk, or close the mmap of an opened one'
+        if self._writeable:
+            self._save()
+            self._writeable = False # rows are still available in memory
+        elif self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _save(self):
+        'write binary columns and string table'
+        ifile = file(self.filestem + '.arr', 'wb')
+        try:
+            ifile.write(self._magic)
+            for j, (name, typecode) in enumerate(self._columns):
+                a = array.array(typecode, [row[j] for row in self._rows])
+                a.tofile(ifile)
+        finally:
+            ifile.close()
+        ifile = file(self.filestem + '.strings', 'wb')
+        try:
+            pickle.dump(dict(keys=self._keys, seqIDs=self._seqIDs,
+                             attrs=self._attrs, attrNames=self._attrNames,
+                             byteorder=sys.byteorder,
+                             sliceAttrDict=self.sliceAttrDict),
+                        ifile, 2)
+        finally:
+            ifile.close()
+
+
 class AnnotationServer(AnnotationDB):
     'XMLRPC-ready server for AnnotationDB'
     xmlrpc_methods={'get_slice_tuple': 0, 'get_slice_items': 0,
                     'get_annotation_attr': 0, 'keys': 0,
-                    '__len__': 0, '__contains__': 0}
+                    '__len__': 0, '__contains__': 0, 'get_slice_tuples': 0,
+                    'get_annotation_attrs': 0, 'iter_slice_items': 0}
 
     def get_slice_tuple(self, k):
         'get (seqID,start,stop) for a given key'
@@ -454,13 +1157,60 @@ class AnnotationServer(AnnotationDB):
             pass
         return (self.getSliceAttr(sliceInfo, 'id'), start, stop)
 
+    def get_slice_tuples(self, keys):
+        'get list of (seqID,start,stop) for a list of keys'
+        return [self.get_slice_tuple(k) for k in keys]
+
     def get_slice_items(self):
         'get all (key,tuple) pairs in one query'
+        return list(self.iter_slice_tuples())
+
+    def iter_slice_items(self, offset, limit):
+        '''get one page of at most limit (key,tuple) pairs, starting at
+        offset; reading successive pages continues a single scan'''
+        try:
+            nextOffset, it = self._pageIter
+            if nextOffset != offset:
+                raise AttributeError
+        except AttributeError: # start a new scan, skipping to offset
+            it = self.iter_slice_tuples()
+            for i in xrange(offset):
+                try:
+                    it.next()
+                except StopIteration:
+                    break
         l = []
-        for k in self.sliceDB:
-            l.append((k, self.get_slice_tuple(k)))
+        for t in it:
+            l.append(t)
+            if len(l) >= limit:
+                break
+        self._pageIter = (offset + len(l), it)
         return l
 
+    def iter_slice_tuples(self):
+        '''generate (key,(seqID,start,stop)) for all annotations, reading
+        them by columns in a single query if sliceDB supports iter_columns()'''
+        names = ['id']
+        for attr in ('id', 'start', 'stop', 'orientation'):
+            names.append(self.sliceAttrDict.get(attr, attr))
+        try:
+            try:
+                chunks = self.sliceDB.iter_columns(names)
+            except AttributeError: # maybe no orientation column
+                chunks = self.sliceDB.iter_columns(names[:4])
+        except (AttributeError, TypeError): # not SQL, or tuple index aliases
+            for k in self.sliceDB:
+                yield k, self.get_slice_tuple(k)
+            return
+        for chunk in chunks:
+            if len(chunk) == 4: # no orientations
+                chunk = chunk + [(1,) * len(chunk[0])]
+            for k, seqID, start, stop, ori in zip(*chunk):
+                start, stop = int(start), int(stop)
+                if ori is not None and int(ori) < 0 and start >= 0:
+                    start, stop = (-stop, -start) # Negative-orientation
+                yield k, (seqID, start, stop)
+
     def get_annotation_attr(self, k, attr):
         'get the requested attribute of the requested key'
         try:
@@ -472,51 +1222,122 @@ class AnnotationServer(AnnotationDB):
         except AttributeError:
             return ''
 
+    def get_annotation_attrs(self, keys, attrs):
+        'get list of [value for each attr] for a list of keys'
+        return [[self.get_annotation_attr(k, attr) for attr in attrs]
+                for k in keys]
+
 
 class AnnotationClientSliceDB(dict):
-    'proxy just queries the server'
+    '''proxy queries the server, coalescing misses into batches of
+    batchSize keys.  Stores (seqID,start,stop,key) tuples.'''
 
-    def __init__(self, db):
+    def __init__(self, db, batchSize=1000):
         self.db = db
+        self.batchSize = batchSize
         dict.__init__(self)
 
+    def _batches(self, l):
+        'split list l into lists of at most batchSize items'
+        for i in xrange(0, len(l), self.batchSize):
+            yield l[i:i + self.batchSize]
+
+    def prefetch_keys(self, k):
+        '''list k plus the following keys (in server keys() order) up to
+        batchSize, for coalescing a miss on k with upcoming requests'''
+        try:
+            i = self._keyIndex[k]
+        except (AttributeError, KeyError): # don't know the key order
+            return [k]
+        return self._keys[i:i + self.batchSize]
+
+    def prefetch(self, keys):
+        'load sliceInfo for keys not already cached, in batches'
+        keys = [k for k in keys if not dict.__contains__(self, k)]
+        try:
+            get_slice_tuples = self.db.server.get_slice_tuples
+        except AttributeError: # older server; get one at a time
+            get_slice_tuples = lambda l: [self.db.server.get_slice_tuple(k)
+                                          for k in l]
+        for batch in self._batches(keys):
+            for k, t in zip(batch, get_slice_tuples(batch)):
+                if t != '':
+                    dict.__setitem__(self, k, tuple(t) + (k, ))
+
     def __getitem__(self, k):
         try:
             return dict.__getitem__(self, k)
         except KeyError:
-            t = self.db.server.get_slice_tuple(k)
-            if t == '':
+            self.prefetch(self.prefetch_keys(k))
+            try:
+                return dict.__getitem__(self, k)
+            except KeyError:
                 raise KeyError('no such annotation: ' + str(k))
-            dict.__setitem__(self, k, t)
-            return t
 
     def __setitem__(self, k, v):
         raise ValueError('XMLRPC client is read-only')
 
     def keys(self):
-        return self.db.server.keys()
+        try:
+            return list(self._keys)
+        except AttributeError:
+            pass
+        self._keys = self.db.server.keys()
+        self._keyIndex = dict([(k, i) for (i, k) in enumerate(self._keys)])
+        return list(self._keys)
 
     def __iter__(self):
         return iter(self.keys())
 
     def items(self):
-        return self.db.server.get_slice_items()
+        return list(self.iteritems())
 
     def iteritems(self):
-        return iter(self.items())
+        'get all items from the server in pages of batchSize'
+        try:
+            iter_slice_items = self.db.server.iter_slice_items
+        except AttributeError: # older server; get them in one call
+            l = self.db.server.get_slice_items()
+            pages = [l]
+        else:
+            pages = None
+        offset = 0
+        while True:
+            if pages is None:
+                l = iter_slice_items(offset, self.batchSize)
+            elif not pages:
+                break
+            else:
+                l = pages.pop()
+            for k, t in l:
+                t = tuple(t) + (k, )
+                dict.__setitem__(self, k, t)
+                yield k, t
+            if pages is None and len(l) < self.batchSize:
+                break
+            offset += len(l)
 
     def __len__(self):
-        return self.db.server.__len__()
+        try:
+            return len(self._keys)
+        except AttributeError:
+            return self.db.server.__len__()
 
     def __contains__(self, k):
-        return self.db.server.__contains__(k)
+        if dict.__contains__(self, k):
+            return True
+        try:
+            return k in self._keyIndex
+        except AttributeError:
+            return self.db.server.__contains__(k)
 
 
 class AnnotationClient(AnnotationDB):
     'XMLRPC AnnotationDB client'
 
     def __init__(self, url, name, seqDB, itemClass=AnnotationSeq,
-                 itemSliceClass=AnnotationSlice, autoGC=True, **kwargs):
+                 itemSliceClass=AnnotationSlice, autoGC=True,
+                 batchSize=1000, **kwargs):
         if autoGC: # automatically garbage collect unused objects
             self._weakValueDict = classutil.RecentValueDictionary(autoGC)
         else:
@@ -527,7 +1348,8 @@ class AnnotationClient(AnnotationDB):
         self.url = url
         self.name = name
         self.seqDB = seqDB
-        self.sliceDB = AnnotationClientSliceDB(self)
+        self.sliceDB = AnnotationClientSliceDB(self, batchSize)
+        self._attrCache = {} # {(key, attr): value} from the server
         self.itemClass = itemClass
         self.itemSliceClass = itemSliceClass
 
@@ -544,8 +1366,41 @@ class AnnotationClient(AnnotationDB):
             return sliceInfo[2]
         elif attr=='orientation':
             raise AttributeError('ori not saved')
-        else:
-            v = self.server.get_annotation_attr(sliceInfo[0], attr)
-            if v=='':
-                raise AttributeError('this annotation has no attr: ' + attr)
-            return v
+        k = sliceInfo[3]
+        try:
+            v = self._attrCache[(k, attr)]
+        except KeyError: # get attr for upcoming keys too
+            self.prefetch_attrs(self.sliceDB.prefetch_keys(k), [attr])
+            v = self._attrCache[(k, attr)]
+        if v=='':
+            raise AttributeError('this annotation has no attr: ' + attr)
+        return v
+
+    def prefetch_attrs(self, keys, attrs):
+        'load the attrs of keys not already cached, in batches'
+        attrs = list(attrs)
+        keys = [k for k in keys
+                if [attr for attr in attrs if (k, attr) not in self._attrCache]]
+        try:
+            get_annotation_attrs = self.server.get_annotation_attrs
+        except AttributeError: # older server; get one at a time
+            get_annotation_attrs = lambda l, attrs: \
+                [[self.server.get_annotation_attr(k, attr) for attr in attrs]
+                 for k in l]
+        for batch in self.sliceDB._batches(keys):
+            for k, values in zip(batch, get_annotation_attrs(batch, attrs)):
+                for attr, v in zip(attrs, values):
+                    self._attrCache[(k, attr)] = v
+
+    def prefetch(self, keys, attrs=()):
+        'load sliceInfo and optionally attrs for keys, in batches'
+        keys = list(keys)
+        self.sliceDB.prefetch(keys)
+        if attrs:
+            self.prefetch_attrs(keys, attrs)
+
+    def clear_cache(self):
+        'empty the annotation, sliceInfo and attribute caches'
+        AnnotationDB.clear_cache(self)
+        dict.clear(self.sliceDB)
+        self._attrCache.clear()
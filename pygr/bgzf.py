@@ -0,0 +1,224 @@
+"""
+Random access to BGZF (blocked gzip) compressed files.
+
+BGZF is the gzip variant written by bgzip / samtools: a series of
+independent gzip members, each holding at most 64 KB of uncompressed
+data, whose compressed size is stored in a 'BC' extra subfield of the
+gzip header.  Because every block can be inflated on its own, a slice of
+the uncompressed stream can be read by decompressing only the blocks that
+overlap it.  A .gzi index (as written by 'bgzip -i') maps the start of
+each block in the compressed file to its offset in the uncompressed
+stream.
+"""
+
+import bisect
+import os
+import struct
+import zlib
+
+# gzip ID1, ID2, CM=deflate, FLG=FEXTRA
+_BGZF_MAGIC = '\x1f\x8b\x08\x04'
+_HEADER_SIZE = 12 # gzip header up to and including XLEN
+_MAX_BLOCK_DATA = 65280 # uncompressed bytes per block, same as bgzip
+# empty block that bgzip appends to mark the end of the file
+_BGZF_EOF = '\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00' \
+            '\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+
+class BGZFFormatError(IOError):
+    'file is not in BGZF block-compressed format'
+    pass
+
+
+def read_block_size(ifile):
+    '''read the header of the BGZF block at the current file position;
+    return total size of the compressed block, or None at end of file'''
+    header = ifile.read(_HEADER_SIZE)
+    if not header:
+        return None
+    if len(header) < _HEADER_SIZE or header[:4] != _BGZF_MAGIC:
+        raise BGZFFormatError('not a BGZF block header')
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = ifile.read(xlen)
+    i = 0
+    while i + 4 <= len(extra): # search subfields for BC
+        slen = struct.unpack('<H', extra[i + 2:i + 4])[0]
+        if extra[i:i + 2] == 'BC' and slen == 2:
+            return struct.unpack('<H', extra[i + 4:i + 6])[0] + 1
+        i += 4 + slen
+    raise BGZFFormatError('gzip member lacks BGZF block size field')
+
+
+def scan_blocks(filename):
+    '''return list of (compressed offset, uncompressed offset) for every
+    data block in the file, reading only block headers and trailers'''
+    ifile = file(filename, 'rb')
+    try:
+        blocks = []
+        coffset = uoffset = 0
+        while True:
+            ifile.seek(coffset)
+            blockSize = read_block_size(ifile)
+            if blockSize is None:
+                break
+            ifile.seek(coffset + blockSize - 4)
+            isize = struct.unpack('<I', ifile.read(4))[0]
+            if isize: # skip empty blocks e.g. EOF marker
+                blocks.append((coffset, uoffset))
+            coffset += blockSize
+            uoffset += isize
+        return blocks
+    finally:
+        ifile.close()
+
+
+def read_gzi(filename):
+    'read a bgzip .gzi index, return list of (coffset, uoffset) block starts'
+    ifile = file(filename, 'rb')
+    try:
+        n = struct.unpack('<Q', ifile.read(8))[0]
+        data = struct.unpack('<%dQ' % (2 * n), ifile.read(16 * n))
+    finally:
+        ifile.close()
+    blocks = [(0, 0)] # first block is implicit in the .gzi format
+    for i in xrange(0, 2 * n, 2):
+        blocks.append((data[i], data[i + 1]))
+    return blocks
+
+
+def write_gzi(filename, blocks):
+    'save list of (coffset, uoffset) block starts in bgzip .gzi format'
+    blocks = [t for t in blocks if t != (0, 0)]
+    ofile = file(filename, 'wb')
+    try:
+        ofile.write(struct.pack('<Q', len(blocks)))
+        for coffset, uoffset in blocks:
+            ofile.write(struct.pack('<QQ', coffset, uoffset))
+    finally:
+        ofile.close()
+
+
+def get_block_index(filename, indexpath=None):
+    '''get block offsets from filename.gzi, or build it by scanning
+    the file's block headers and save it there'''
+    if indexpath is None:
+        indexpath = filename + '.gzi'
+    if os.path.exists(indexpath):
+        return read_gzi(indexpath)
+    blocks = scan_blocks(filename)
+    write_gzi(indexpath, blocks)
+    return blocks
+
+
+def compress_block(data, level=6):
+    'return one BGZF block containing the string data'
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = c.compress(data) + c.flush()
+    header = _BGZF_MAGIC + struct.pack('<IBBH2sHH', 0, 0, 0xff, 6, 'BC', 2,
+                                       len(cdata) + 25)
+    crc = zlib.crc32(data) & 0xffffffffL
+    return header + cdata + struct.pack('<II', crc, len(data))
+
+
+def bgzip_file(inpath, outpath, level=6, saveIndex=True):
+    '''compress inpath to outpath in BGZF format, like bgzip -i.
+    Returns list of (coffset, uoffset) block starts.'''
+    ifile = file(inpath, 'rb')
+    ofile = file(outpath, 'wb')
+    try:
+        blocks = []
+        coffset = uoffset = 0
+        while True:
+            data = ifile.read(_MAX_BLOCK_DATA)
+            if not data:
+                break
+            block = compress_block(data, level)
+            ofile.write(block)
+            blocks.append((coffset, uoffset))
+            coffset += len(block)
+            uoffset += len(data)
+        ofile.write(_BGZF_EOF)
+    finally:
+        ifile.close()
+        ofile.close()
+    if saveIndex:
+        write_gzi(outpath + '.gzi', blocks)
+    return blocks
+
+
+class BGZFReader(object):
+    '''random access reader for the uncompressed contents of a BGZF file.
+    Keeps the cacheSize most recently used decompressed blocks in memory.'''
+
+    def __init__(self, filename, blocks=None, cacheSize=16):
+        self.filename = filename
+        if blocks is None:
+            blocks = get_block_index(filename)
+        self._coffsets = [t[0] for t in blocks]
+        self._uoffsets = [t[1] for t in blocks]
+        self.cacheSize = cacheSize
+        self._blockCache = {}
+        self._blockQueue = [] # block indexes, least recently used first
+        self._ifile = file(filename, 'rb')
+
+    def _read_block(self, i):
+        'decompress block i from disk'
+        ifile = self._ifile
+        ifile.seek(self._coffsets[i])
+        blockSize = read_block_size(ifile)
+        ifile.seek(self._coffsets[i])
+        block = ifile.read(blockSize)
+        xlen = struct.unpack('<H', block[10:12])[0]
+        return zlib.decompress(block[_HEADER_SIZE + xlen:-8], -15)
+
+    def get_block(self, i):
+        'get uncompressed data of block i, using our block cache'
+        try:
+            data = self._blockCache[i]
+        except KeyError:
+            data = self._read_block(i)
+            self._blockCache[i] = data
+            self._blockQueue.append(i)
+            if len(self._blockQueue) > self.cacheSize: # drop oldest block
+                del self._blockCache[self._blockQueue.pop(0)]
+        else:
+            if self._blockQueue[-1] != i: # mark as most recently used
+                self._blockQueue.remove(i)
+                self._blockQueue.append(i)
+        return data
+
+    def iter_blocks(self):
+        'generate uncompressed data of each block in order, without caching'
+        for i in xrange(len(self._coffsets)):
+            yield self._read_block(i)
+
+    def iter_lines(self):
+        'generate lines of the uncompressed stream, including line endings'
+        tail = ''
+        for data in self.iter_blocks():
+            lines = (tail + data).split('\n')
+            tail = lines.pop() # incomplete line; finish it with next block
+            for line in lines:
+                yield line + '\n'
+        if tail: # last line had no line ending
+            yield tail
+
+    def read(self, start, stop):
+        'return bytes [start:stop] of the uncompressed stream'
+        if stop <= start:
+            return ''
+        i = bisect.bisect_right(self._uoffsets, start) - 1
+        l = []
+        pos = start
+        while pos < stop and i < len(self._uoffsets):
+            blockStart = self._uoffsets[i]
+            data = self.get_block(i)
+            l.append(data[pos - blockStart:stop - blockStart])
+            pos = blockStart + len(data)
+            i += 1
+        return ''.join(l)
+
+    def close(self):
+        self._ifile.close()
+        self._blockCache.clear()
+        self._blockQueue = []
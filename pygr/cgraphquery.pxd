@@ -0,0 +1,57 @@
+cdef extern from "stdlib.h":
+  ctypedef int size_t
+  void free(void *)
+  void *calloc(size_t,size_t)
+
+cdef extern from "Python.h":
+  ctypedef void *const_void_ptr "const void *"
+  int PyObject_AsReadBuffer(object obj, const_void_ptr *buffer,
+                            Py_ssize_t *buffer_len) except -1
+
+cdef extern from "graphmatch.h":
+  ctypedef struct GraphMatchCSR:
+    int n
+    int *out_start
+    int *out_target
+    int *in_start
+    int *in_source
+
+  ctypedef struct GraphMatchQuery:
+    int n
+    int n_edges
+    int *edge_from
+    int *edge_to
+    char *edge_filter
+    int *order
+
+  ctypedef struct GraphMatchState:
+    int *node_map
+    int *edge_map
+    int (*filter)(void *ctx, int iedge, GraphMatchState *s)
+    void *filter_ctx
+    int root_start
+    int root_end
+
+  int graphmatch_edge(GraphMatchCSR *g, int source, int target)
+  GraphMatchQuery *graphmatch_query_alloc(int n, int n_edges)
+  int graphmatch_query_free(GraphMatchQuery *q)
+  int graphmatch_plan(GraphMatchQuery *q, int *order)
+  GraphMatchState *graphmatch_state_alloc(GraphMatchCSR *g,
+                                          GraphMatchQuery *q)
+  int graphmatch_state_free(GraphMatchState *s)
+  int graphmatch_next(GraphMatchState *s, int *results, int maxhits)
+
+
+cdef class GraphMatcher:
+  cdef GraphMatchCSR g
+  cdef GraphMatchQuery *q
+  cdef GraphMatchState *s
+  cdef int *results
+  cdef int maxhits
+  cdef int nhit
+  cdef int ihit
+  cdef readonly object snapshot
+  cdef object buffers
+  cdef object __weakref__
+  cdef object filterFunc
+  cdef object error
@@ -0,0 +1,140 @@
+import sys
+
+
+cdef int *int_buffer(object a, int n) except NULL:
+  'get pointer to the data of array a, which must hold at least n ints'
+  cdef const_void_ptr p
+  cdef Py_ssize_t nbytes
+  PyObject_AsReadBuffer(a, &p, &nbytes)
+  if nbytes < n * sizeof(int):
+    raise ValueError('graph snapshot array too short: %d bytes' % nbytes)
+  return <int *>p
+
+
+cdef int graphmatch_filter(void *ctx, int iedge, GraphMatchState *s):
+  'C callback: ask the Python filterFunc to accept or reject an edge match'
+  cdef GraphMatcher self
+  cdef int i
+  self = <GraphMatcher>ctx
+  try:
+    nodeMap = []
+    for i from 0 <= i < self.q.n:
+      nodeMap.append(s.node_map[i])
+    edgeMap = []
+    for i from 0 <= i < self.q.n_edges:
+      edgeMap.append(s.edge_map[i])
+    if self.filterFunc(iedge, nodeMap, edgeMap):
+      return 1
+    return 0
+  except:
+    self.error = sys.exc_info() # RE-RAISED BY __next__
+    return -1
+
+
+cdef class GraphMatcher:
+  '''VF2-style subgraph matcher over a mapping.CSRGraph snapshot,
+  whose csr_buffers() provide its arrays of integer node ids.
+  Iterates over matches of the query graph with nodes 0..nNodes-1
+  and edges list of (from, to), as tuples (nodeIDs, edgeIDs).
+  filterFunc(iedge, nodeMap, edgeMap) is called for each edge whose
+  index is in filterEdges, to accept or reject it.  If roots is a
+  (start, end) pair, the first query node in order is only matched
+  to data nodes start..end-1'''
+
+  def __new__(self, snapshot, int nNodes, edges, filterFunc=None,
+              filterEdges=(), order=None, int maxhits=1000, roots=None):
+    cdef int i, n
+    cdef int *p_order
+    self.snapshot = snapshot
+    self.filterFunc = filterFunc
+    n = len(snapshot)
+    self.buffers = snapshot.csr_buffers(self) # KEEP OUR POINTERS VALID
+    outStart, outTarget, inStart, inSource = self.buffers
+    self.g.n = n
+    self.g.out_start = int_buffer(outStart, n + 1)
+    self.g.out_target = int_buffer(outTarget, self.g.out_start[n])
+    self.g.in_start = int_buffer(inStart, n + 1)
+    self.g.in_source = int_buffer(inSource, self.g.in_start[n])
+    self.q = graphmatch_query_alloc(nNodes, len(edges))
+    if self.q == NULL:
+      raise MemoryError('unable to allocate GraphMatchQuery')
+    i = 0
+    for source, target in edges:
+      if source < 0 or source >= nNodes or target < 0 or target >= nNodes:
+        raise ValueError('query edge (%s, %s) out of range' % (source, target))
+      self.q.edge_from[i] = source
+      self.q.edge_to[i] = target
+      i = i + 1
+    for iedge in filterEdges:
+      if iedge < 0 or iedge >= self.q.n_edges:
+        raise ValueError('filter edge %s out of range' % iedge)
+      self.q.edge_filter[iedge] = 1
+    p_order = NULL
+    if order is not None:
+      if len(order) != nNodes:
+        raise ValueError('order must list all %d query nodes' % nNodes)
+      p_order = self.q.order # plan() REWRITES IT IN PLACE
+      i = 0
+      for node in order:
+        p_order[i] = node
+        i = i + 1
+    if graphmatch_plan(self.q, p_order) < 0:
+      raise ValueError('bad query node order: %s' % (order,))
+    self.s = graphmatch_state_alloc(&(self.g), self.q)
+    if self.s == NULL:
+      raise MemoryError('unable to allocate GraphMatchState')
+    self.s.filter = graphmatch_filter
+    self.s.filter_ctx = <void *>self
+    if roots is not None:
+      start, end = roots
+      self.s.root_start = max(start, 0)
+      self.s.root_end = min(end, n)
+    self.maxhits = maxhits
+    self.results = <int *>calloc(maxhits * (nNodes + len(edges)),
+                                 sizeof(int))
+    if self.results == NULL:
+      raise MemoryError('unable to allocate results buffer')
+
+  property order:
+    'query nodes in the order they are matched'
+    def __get__(self):
+      cdef int i
+      l = []
+      for i from 0 <= i < self.q.n:
+        l.append(self.q.order[i])
+      return l
+
+  def __iter__(self):
+    return self
+
+  def __next__(self): # PYREX USES THIS NON-STANDARD NAME INSTEAD OF next()!!!
+    cdef int i, j, *p
+    if self.ihit >= self.nhit: # GET THE NEXT BUFFER CHUNK OF MATCHES
+      self.nhit = graphmatch_next(self.s, self.results, self.maxhits)
+      self.ihit = 0
+      if self.nhit < 0:
+        self.nhit = 0
+        error = self.error
+        self.error = None
+        raise error[0], error[1], error[2]
+      if self.nhit == 0:
+        raise StopIteration
+    p = self.results + self.ihit * (self.q.n + self.q.n_edges)
+    self.ihit = self.ihit + 1
+    nodeIDs = []
+    for i from 0 <= i < self.q.n:
+      nodeIDs.append(p[i])
+    p = p + self.q.n
+    edgeIDs = []
+    for j from 0 <= j < self.q.n_edges:
+      edgeIDs.append(p[j])
+    return tuple(nodeIDs), tuple(edgeIDs)
+
+  def __dealloc__(self):
+    'remember: dealloc cannot call other methods!'
+    if self.s:
+      graphmatch_state_free(self.s)
+    if self.q:
+      graphmatch_query_free(self.q)
+    if self.results:
+      free(self.results)
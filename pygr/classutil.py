@@ -1,6 +1,8 @@
 import os
 import sys
 import tempfile
+import threading
+import itertools
 from weakref import WeakValueDictionary
 import dbfile
 import logger
@@ -543,7 +545,14 @@ class RecentValueDictionary(WeakValueDictionary):
     until it is bumped by more recent requests.
 
     n: the maximum number of objects to keep in the Most Recent queue,
-       default value 50.'''
+       default value 50.  Updates to the queue are thread-safe.
+
+    limit(maxSize) bounds the total number of entries (held by the
+    queue or by the user) by evicting the least recently used keys,
+    a fraction evictFraction of maxSize beyond the excess at a time,
+    so the rest of the working set stays cached.  stats() reports
+    hit, miss and eviction counts.'''
+    evictFraction = 0.125
 
     def __init__(self, n=None):
         WeakValueDictionary.__init__(self)
@@ -556,9 +565,19 @@ class RecentValueDictionary(WeakValueDictionary):
             self.n = int(n) # size limit
         self._head = self._tail = None
         self._keepDict = {} # most recent queue
+        self._lock = threading.RLock()
+        self._clock = itertools.count()
+        self._lastUse = {} # {key: clock value of its last use}
+        self.hits = self.misses = self.evictions = 0
 
     def __getitem__(self, k):
-        v = WeakValueDictionary.__getitem__(self, k) # KeyError if not found
+        try:
+            v = WeakValueDictionary.__getitem__(self, k)
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self._lastUse[k] = self._clock.next()
         self.keep_this(v)
         return v
 
@@ -578,26 +597,87 @@ class RecentValueDictionary(WeakValueDictionary):
         """
         if v is self._head:
             return # already at head of queue, so nothing to do
-        try: # check if already in _keepDict
-            previous, after = self._keepDict[v]
-        except KeyError:
-            self._keepDict[v] = [None, None]
-        else: # remove from current position
-            self._splice(previous, after)
-            self._keepDict[v][0] = None
-        self._splice(v, self._head) # place at head of queue
-        if len(self._keepDict) > self.n: # delete oldest entry
-            vdel = self._tail # get current tail
-            self._splice(self._keepDict[vdel][0], None) # set new tail
-            del self._keepDict[vdel]
+        self._lock.acquire()
+        try:
+            try: # check if already in _keepDict
+                previous, after = self._keepDict[v]
+            except KeyError:
+                self._keepDict[v] = [None, None]
+            else: # remove from current position
+                self._splice(previous, after)
+                self._keepDict[v][0] = None
+            self._splice(v, self._head) # place at head of queue
+            if len(self._keepDict) > self.n: # delete oldest entry
+                vdel = self._tail # get current tail
+                self._splice(self._keepDict[vdel][0], None) # set new tail
+                del self._keepDict[vdel]
+        finally:
+            self._lock.release()
 
     def __setitem__(self, k, v):
         WeakValueDictionary.__setitem__(self, k, v)
+        self._lastUse[k] = self._clock.next()
+        if len(self._lastUse) > 2 * len(self.data) + self.n:
+            self._prune_last_use() # forget keys garbage collected
         self.keep_this(v)
 
+    def _prune_last_use(self):
+        'drop _lastUse entries for keys no longer in the dictionary'
+        data = self.data
+        self._lastUse = dict([(k, t) for (k, t) in self._lastUse.items()
+                              if k in data])
+
+    def _unkeep(self, v):
+        'remove v from the Most Recent queue, if present'
+        try:
+            previous, after = self._keepDict.pop(v)
+        except KeyError:
+            return
+        if previous is None:
+            self._head = after
+        else:
+            self._keepDict[previous][1] = after
+        if after is None:
+            self._tail = previous
+        else:
+            self._keepDict[after][0] = previous
+
+    def limit(self, maxSize):
+        'evict least recently used keys until at most maxSize remain'
+        if len(self.data) <= maxSize:
+            return
+        self._lock.acquire()
+        try:
+            data = self.data
+            l = [(t, k) for (k, t) in self._lastUse.items() if k in data]
+            l.sort()
+            nEvict = len(data) - maxSize + int(maxSize * self.evictFraction)
+            for t, k in l[:nEvict]:
+                try:
+                    v = data.pop(k)()
+                except KeyError: # garbage collected meanwhile
+                    continue
+                if v is not None:
+                    self._unkeep(v)
+                self.evictions += 1
+            self._lastUse = dict([(k, t) for (t, k) in l[nEvict:]])
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        'dict of cache size, Most Recent queue size, hits, misses, evictions'
+        return dict(size=len(self), recent=len(self._keepDict),
+                    hits=self.hits, misses=self.misses,
+                    evictions=self.evictions)
+
     def clear(self):
-        self._head = self._tail = None
-        self._keepDict.clear()
+        self._lock.acquire()
+        try:
+            self._head = self._tail = None
+            self._keepDict.clear()
+            self._lastUse = {}
+        finally:
+            self._lock.release()
         WeakValueDictionary.clear(self)
 
     def __repr__(self):
@@ -605,6 +685,137 @@ class RecentValueDictionary(WeakValueDictionary):
                (len(self._keepDict), self.n)
 
 
+class LRUDictionary(object):
+    """dictionary holding strong references to at most maxSize values
+    (or any number, if maxSize is None), evicting the least recently
+    used key when full.  Keys are kept in a doubly-linked list in order
+    of use, so each lookup or eviction takes constant time.  Updates are
+    thread-safe.  stats() reports hit, miss and eviction counts."""
+
+    def __init__(self, maxSize=None):
+        self.maxSize = maxSize
+        self._links = {} # {key: [previous, next, key, value]}
+        self._root = root = [] # list head: root[1] is the oldest link
+        root[:] = [root, root, None, None]
+        self._lock = threading.Lock() # much faster than RLock
+        self.hits = self.misses = self.evictions = 0
+
+    def __getitem__(self, k):
+        self._lock.acquire()
+        try:
+            try:
+                link = self._links[k]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.hits += 1
+            root = self._root
+            if link is not root[0]: # move it to the most recent end
+                link[0][1] = link[1]
+                link[1][0] = link[0]
+                link[0] = root[0]
+                link[1] = root
+                root[0][1] = root[0] = link
+            return link[3]
+        finally:
+            self._lock.release()
+
+    def get(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            return default
+
+    def __setitem__(self, k, v):
+        self._lock.acquire()
+        try:
+            try:
+                link = self._links.pop(k)
+            except KeyError:
+                pass
+            else: # unlink it, to add it again as the most recent
+                link[0][1] = link[1]
+                link[1][0] = link[0]
+            root = self._root
+            link = root[0][1] = root[0] = self._links[k] = [root[0], root,
+                                                             k, v]
+            if self.maxSize is not None:
+                while len(self._links) > self.maxSize:
+                    self._pop_oldest()
+                    self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def __delitem__(self, k):
+        self._lock.acquire()
+        try:
+            link = self._links.pop(k)
+            link[0][1] = link[1]
+            link[1][0] = link[0]
+        finally:
+            self._lock.release()
+
+    def _pop_oldest(self):
+        'remove the least recently used link; caller must hold our lock'
+        link = self._root[1]
+        if link is self._root:
+            raise KeyError('LRUDictionary is empty')
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+        del self._links[link[2]]
+        return link
+
+    def pop_oldest(self):
+        'remove the least recently used key; return (key, value)'
+        self._lock.acquire()
+        try:
+            link = self._pop_oldest()
+            return link[2], link[3]
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, k):
+        'check membership without counting it as a use'
+        return k in self._links
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._links.clear()
+            self._root[:] = [self._root, self._root, None, None]
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        'dict of cache size, hits, misses, evictions'
+        return dict(size=len(self._links), hits=self.hits,
+                    misses=self.misses, evictions=self.evictions)
+
+
+def limit_cache(cache, maxSize):
+    '''bound an object cache to maxSize entries: evict least recently used
+    entries of a RecentValueDictionary, or empty any other dict'''
+    if maxSize is None or len(cache) <= maxSize:
+        return
+    try:
+        limit = cache.limit
+    except AttributeError: # plain dict or WeakValueDictionary
+        cache.clear()
+    else:
+        limit(maxSize)
+
+
+def cache_stats(cache):
+    'get stats() of a RecentValueDictionary, or just the size of a dict'
+    try:
+        return cache.stats()
+    except AttributeError:
+        return dict(size=len(cache))
+
+
 def make_attribute_interface(d):
     """
     If 'd' contains int values, use them to index tuples.
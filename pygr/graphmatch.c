@@ -0,0 +1,333 @@
+
+#include "graphmatch.h"
+
+
+int graphmatch_edge(GraphMatchCSR *g, int source, int target)
+{ /* BINARY SEARCH FOR EDGE source -> target, RETURN ITS ID OR -1 */
+  int l,mid,r;
+  int *p=g->out_target;
+
+  l=g->out_start[source];
+  r=g->out_start[source+1];
+  while (l<r) {
+    mid=(l+r)/2;
+    if (p[mid]==target)
+      return mid;
+    else if (p[mid]<target)
+      l=mid+1;
+    else
+      r=mid;
+  }
+  return -1; /* NOT FOUND */
+}
+
+
+GraphMatchQuery *graphmatch_query_alloc(int n, int n_edges)
+{
+  GraphMatchQuery *q=0;
+
+  q=calloc(1,sizeof(GraphMatchQuery));
+  if (q==0) /* calloc FAILED!! */
+    return 0;
+  q->n=n;
+  q->n_edges=n_edges;
+  q->edge_from=calloc(n_edges+1,sizeof(int));
+  q->edge_to=calloc(n_edges+1,sizeof(int));
+  q->edge_filter=calloc(n_edges+1,sizeof(char));
+  q->order=calloc(n+1,sizeof(int));
+  q->parent_edge=calloc(n+1,sizeof(int));
+  q->check_start=calloc(n+1,sizeof(int));
+  q->check_edge=calloc(n_edges+1,sizeof(int));
+  q->out_degree=calloc(n+1,sizeof(int));
+  q->in_degree=calloc(n+1,sizeof(int));
+  if (q->edge_from==0 || q->edge_to==0 || q->edge_filter==0 || q->order==0
+      || q->parent_edge==0 || q->check_start==0 || q->check_edge==0
+      || q->out_degree==0 || q->in_degree==0) {
+    graphmatch_query_free(q); /* DUMP PARTIAL ALLOCATION */
+    return 0;
+  }
+  return q;
+}
+
+
+int graphmatch_query_free(GraphMatchQuery *q)
+{
+  free(q->edge_from);
+  free(q->edge_to);
+  free(q->edge_filter);
+  free(q->order);
+  free(q->parent_edge);
+  free(q->check_start);
+  free(q->check_edge);
+  free(q->out_degree);
+  free(q->in_degree);
+  free(q);
+  return 0;
+}
+
+
+int graphmatch_plan(GraphMatchQuery *q, int *order)
+{ /* SET MATCHING ORDER (FROM order, OR CHOSEN BY DEGREE IF order IS NULL)
+     AND THE EDGES TO GENERATE / CHECK AT EACH DEPTH.
+     RETURNS -1 IF order IS NOT A PERMUTATION OR MEMORY RUNS OUT */
+  int i,e,u,v,best,best_links,best_degree,links,nchecked=0;
+  int *pos=0,*degree=0;
+
+  pos=calloc(q->n+1,sizeof(int));
+  degree=calloc(q->n+1,sizeof(int));
+  if (pos==0 || degree==0) {
+    free(pos);
+    free(degree);
+    return -1;
+  }
+  for (i=0;i<q->n;i++) {
+    pos[i]= -1; /* NOT YET PLACED */
+    q->out_degree[i]=q->in_degree[i]=0;
+  }
+  for (e=0;e<q->n_edges;e++) {
+    q->out_degree[q->edge_from[e]]++;
+    q->in_degree[q->edge_to[e]]++;
+  }
+  for (i=0;i<q->n;i++)
+    degree[i]=q->out_degree[i]+q->in_degree[i];
+
+  for (i=0;i<q->n;i++) {
+    if (order) { /* USE THE CALLER'S ORDER */
+      best=order[i];
+      if (best<0 || best>=q->n || pos[best]>=0)
+        goto bad_order;
+    }
+    else { /* MOST LINKS TO PLACED NODES, THEN HIGHEST DEGREE FIRST */
+      best= -1;
+      best_links=best_degree= -1;
+      for (u=0;u<q->n;u++) {
+        if (pos[u]>=0)
+          continue;
+        links=0;
+        for (e=0;e<q->n_edges;e++)
+          if ((q->edge_from[e]==u && q->edge_to[e]!=u
+               && pos[q->edge_to[e]]>=0)
+              || (q->edge_to[e]==u && q->edge_from[e]!=u
+                  && pos[q->edge_from[e]]>=0))
+            links++;
+        if (links>best_links
+            || (links==best_links && degree[u]>best_degree)) {
+          best=u;
+          best_links=links;
+          best_degree=degree[u];
+        }
+      }
+    }
+    q->order[i]=best;
+    pos[best]=i;
+  }
+
+  for (i=0;i<q->n;i++) { /* EDGES CLOSED BY ASSIGNING EACH NODE */
+    u=q->order[i];
+    q->check_start[i]=nchecked;
+    q->parent_edge[i]= -1;
+    for (e=0;e<q->n_edges;e++) {
+      if (q->edge_from[e]==u)
+        v=q->edge_to[e];
+      else if (q->edge_to[e]==u)
+        v=q->edge_from[e];
+      else
+        continue;
+      if (pos[v]>i)
+        continue; /* CHECKED WHEN v IS ASSIGNED */
+      q->check_edge[nchecked++]=e;
+      if (v!=u && q->parent_edge[i]<0)
+        q->parent_edge[i]=e; /* GENERATE CANDIDATES FROM THIS EDGE */
+    }
+  }
+  q->check_start[q->n]=nchecked;
+  free(pos);
+  free(degree);
+  return 0;
+ bad_order:
+  free(pos);
+  free(degree);
+  return -1;
+}
+
+
+GraphMatchState *graphmatch_state_alloc(GraphMatchCSR *g, GraphMatchQuery *q)
+{
+  int i;
+  GraphMatchState *s=0;
+
+  s=calloc(1,sizeof(GraphMatchState));
+  if (s==0) /* calloc FAILED!! */
+    return 0;
+  s->g=g;
+  s->q=q;
+  s->cand_pos=calloc(q->n+1,sizeof(int));
+  s->cand_end=calloc(q->n+1,sizeof(int));
+  s->cand_list=calloc(q->n+1,sizeof(int *));
+  s->node_map=calloc(q->n+1,sizeof(int));
+  s->edge_map=calloc(q->n_edges+1,sizeof(int));
+  s->used=calloc(g->n+1,sizeof(char));
+  if (s->cand_pos==0 || s->cand_end==0 || s->cand_list==0 || s->node_map==0
+      || s->edge_map==0 || s->used==0) {
+    graphmatch_state_free(s); /* DUMP PARTIAL ALLOCATION */
+    return 0;
+  }
+  for (i=0;i<q->n;i++)
+    s->node_map[i]= -1;
+  for (i=0;i<q->n_edges;i++)
+    s->edge_map[i]= -1;
+  s->root_start=0;
+  s->root_end=g->n;
+  return s;
+}
+
+
+int graphmatch_state_free(GraphMatchState *s)
+{
+  free(s->cand_pos);
+  free(s->cand_end);
+  free(s->cand_list);
+  free(s->node_map);
+  free(s->edge_map);
+  free(s->used);
+  free(s);
+  return 0;
+}
+
+
+static void graphmatch_candidates(GraphMatchState *s, int depth)
+{ /* START ITERATING CANDIDATE DATA NODES FOR THIS DEPTH */
+  int e,v;
+  GraphMatchQuery *q=s->q;
+  GraphMatchCSR *g=s->g;
+
+  e=q->parent_edge[depth];
+  if (e<0 && depth==0) { /* ROOT: TRY DATA NODES IN ROOT RANGE */
+    s->cand_list[depth]=0;
+    s->cand_pos[depth]=s->root_start;
+    s->cand_end[depth]=s->root_end;
+  }
+  else if (e<0) { /* NOT LINKED TO ANY ASSIGNED NODE: TRY ALL DATA NODES */
+    s->cand_list[depth]=0;
+    s->cand_pos[depth]=0;
+    s->cand_end[depth]=g->n;
+  }
+  else if (q->edge_to[e]==q->order[depth]) { /* TARGETS OF ASSIGNED NODE */
+    v=s->node_map[q->edge_from[e]];
+    s->cand_list[depth]=g->out_target;
+    s->cand_pos[depth]=g->out_start[v];
+    s->cand_end[depth]=g->out_start[v+1];
+  }
+  else { /* SOURCES OF EDGES TO ASSIGNED NODE */
+    v=s->node_map[q->edge_to[e]];
+    s->cand_list[depth]=g->in_source;
+    s->cand_pos[depth]=g->in_start[v];
+    s->cand_end[depth]=g->in_start[v+1];
+  }
+}
+
+
+static void graphmatch_unassign(GraphMatchState *s, int depth)
+{
+  int i,u;
+  GraphMatchQuery *q=s->q;
+
+  u=q->order[depth];
+  s->used[s->node_map[u]]=0;
+  s->node_map[u]= -1;
+  for (i=q->check_start[depth];i<q->check_start[depth+1];i++)
+    s->edge_map[q->check_edge[i]]= -1;
+}
+
+
+static int graphmatch_advance(GraphMatchState *s, int depth)
+{ /* ASSIGN THE NEXT FEASIBLE CANDIDATE AT THIS DEPTH.
+     RETURNS 1 IF ASSIGNED, 0 IF NO MORE CANDIDATES, -1 ON FILTER ERROR */
+  int c,e,i,eid,ok;
+  GraphMatchQuery *q=s->q;
+  GraphMatchCSR *g=s->g;
+  int u=q->order[depth];
+
+  while (s->cand_pos[depth]<s->cand_end[depth]) {
+    if (s->cand_list[depth])
+      c=s->cand_list[depth][s->cand_pos[depth]];
+    else
+      c=s->cand_pos[depth];
+    s->cand_pos[depth]++;
+    if (s->used[c] /* EACH DATA NODE MATCHES AT MOST ONE QUERY NODE */
+        || g->out_start[c+1]-g->out_start[c]<q->out_degree[u]
+        || g->in_start[c+1]-g->in_start[c]<q->in_degree[u])
+      continue;
+    s->node_map[u]=c;
+    ok=1;
+    for (i=q->check_start[depth];i<q->check_start[depth+1];i++) {
+      e=q->check_edge[i];
+      eid=graphmatch_edge(g,s->node_map[q->edge_from[e]],
+                          s->node_map[q->edge_to[e]]);
+      if (eid<0) {
+        ok=0;
+        break;
+      }
+      s->edge_map[e]=eid;
+    }
+    for (i=q->check_start[depth];ok && i<q->check_start[depth+1];i++) {
+      e=q->check_edge[i];
+      if (q->edge_filter[e]) { /* LET CALLER ACCEPT OR REJECT THIS EDGE */
+        ok=s->filter(s->filter_ctx,e,s);
+        if (ok<0)
+          return -1;
+      }
+    }
+    if (ok) {
+      s->used[c]=1;
+      return 1;
+    }
+    s->node_map[u]= -1;
+    for (i=q->check_start[depth];i<q->check_start[depth+1];i++)
+      s->edge_map[q->check_edge[i]]= -1;
+  }
+  return 0;
+}
+
+
+int graphmatch_next(GraphMatchState *s, int *results, int maxhits)
+{ /* SAVE UP TO maxhits MATCHES TO results, EACH AS q->n DATA NODE IDS
+     FOLLOWED BY q->n_edges DATA EDGE IDS.  RETURNS THE NUMBER SAVED
+     (0 WHEN FINISHED), OR -1 IF A FILTER REPORTED AN ERROR.
+     CALL AGAIN TO RESUME THE SEARCH WHERE IT LEFT OFF */
+  int i,r,nhit=0;
+  GraphMatchQuery *q=s->q;
+
+  if (s->done || maxhits<=0)
+    return 0;
+  if (!s->started) {
+    s->started=1;
+    s->depth=0;
+    graphmatch_candidates(s,0);
+  }
+  while (s->depth>=0) {
+    r=graphmatch_advance(s,s->depth);
+    if (r<0) { /* ABANDON THE SEARCH */
+      s->done=1;
+      return -1;
+    }
+    if (r) {
+      if (s->depth+1<q->n) { /* GO DEEPER */
+        s->depth++;
+        graphmatch_candidates(s,s->depth);
+        continue;
+      }
+      for (i=0;i<q->n;i++) /* COMPLETE MATCH: SAVE IT */
+        *results++ =s->node_map[i];
+      for (i=0;i<q->n_edges;i++)
+        *results++ =s->edge_map[i];
+      graphmatch_unassign(s,s->depth);
+      if (++nhit>=maxhits)
+        return nhit;
+    }
+    else if (--s->depth>=0) /* BACKTRACK */
+      graphmatch_unassign(s,s->depth);
+  }
+  s->done=1;
+  return nhit;
+}
@@ -0,0 +1,59 @@
+#include <stdlib.h>
+
+/* DATA GRAPH IN COMPRESSED SPARSE ROW FORM: NODES ARE 0..n-1,
+   out_target[out_start[i]..out_start[i+1]] ARE THE SORTED TARGETS OF i,
+   AND EDGE ID IS THE INDEX OF AN ENTRY IN out_target.
+   in_source[in_start[i]..in_start[i+1]] ARE THE SOURCES OF EDGES TO i */
+typedef struct {
+  int n;
+  int *out_start;
+  int *out_target;
+  int *in_start;
+  int *in_source;
+} GraphMatchCSR;
+
+/* QUERY GRAPH: NODES ARE 0..n-1, EDGES 0..n_edges-1 */
+typedef struct {
+  int n;
+  int n_edges;
+  int *edge_from;
+  int *edge_to;
+  char *edge_filter;  /* NON-ZERO IF EDGE HAS A FILTER CALLBACK */
+  int *order;  /* QUERY NODES IN MATCHING ORDER */
+  int *parent_edge;  /* PER DEPTH: EDGE TO AN EARLIER NODE, OR -1 */
+  int *check_start;  /* PER DEPTH: EDGES TO CHECK WHEN NODE IS ASSIGNED */
+  int *check_edge;
+  int *out_degree;  /* NUMBER OF DISTINCT OUT-NEIGHBORS OF EACH NODE */
+  int *in_degree;
+} GraphMatchQuery;
+
+struct GraphMatchState_S;
+typedef int (*GraphMatchFilter)(void *ctx, int iedge,
+                                struct GraphMatchState_S *s);
+
+typedef struct GraphMatchState_S {
+  GraphMatchCSR *g;
+  GraphMatchQuery *q;
+  int depth;
+  int started;
+  int done;
+  int *cand_pos;  /* PER DEPTH: CANDIDATE ITERATOR */
+  int *cand_end;
+  int **cand_list;  /* NULL MEANS A RANGE OF DATA NODE IDS */
+  int *node_map;  /* QUERY NODE -> DATA NODE, OR -1 */
+  int *edge_map;  /* QUERY EDGE -> DATA EDGE ID, OR -1 */
+  char *used;  /* DATA NODES ALREADY ASSIGNED */
+  int root_start;  /* DATA NODES TRIED AT DEPTH 0 */
+  int root_end;
+  GraphMatchFilter filter;
+  void *filter_ctx;
+} GraphMatchState;
+
+extern int graphmatch_edge(GraphMatchCSR *g, int source, int target);
+extern GraphMatchQuery *graphmatch_query_alloc(int n, int n_edges);
+extern int graphmatch_query_free(GraphMatchQuery *q);
+extern int graphmatch_plan(GraphMatchQuery *q, int *order);
+extern GraphMatchState *graphmatch_state_alloc(GraphMatchCSR *g,
+                                               GraphMatchQuery *q);
+extern int graphmatch_state_free(GraphMatchState *s);
+extern int graphmatch_next(GraphMatchState *s, int *results, int maxhits);
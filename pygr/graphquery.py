@@ -1,6 +1,7 @@
 
 
 from __future__ import generators
+import classutil
 from mapping import *
 
 
@@ -54,6 +55,20 @@ class QueryMatcher(object):
                                for k, v in self.iteritems()]) + '}'
 
 
+class CompiledQueryCache(classutil.LRUDictionary):
+    '''least recently used cache of compiled query functions, keyed by
+    (compiler language, generated source code), so compiling a query
+    with the same structure as a recent one reuses its function.
+    stats() reports hit, miss and eviction counts.'''
+
+    def __init__(self, maxSize=100):
+        classutil.LRUDictionary.__init__(self, maxSize)
+
+
+# SHARED BY GraphQueryCompiler AND GraphQueryPyrex
+compiledQueries = CompiledQueryCache()
+
+
 class GraphQueryCompiler(object):
     'compile a series of GraphQueryIterators into python code, run them'
     #queryMatch = QueryMatchDescriptor()
@@ -73,6 +88,7 @@ class GraphQueryCompiler(object):
             self._compiled = {}
         else:
             self._compiled = globalDict
+        self._userGlobals = globalDict is not None
         self.queryMatch = QueryMatcher(self)
 
     def __getitem__(self, key):
@@ -222,8 +238,27 @@ def %(name)s(self, dataGraph, dataMatch=None, queryMatch=None):
             return self._compiled[self.name](self, dataGraph, *args, **kwargs)
 
     def compile(self):
-        'compile using Python exec statement'
-        exec str(self) in self._compiled # COMPILE OUR FUNCTION
+        '''compile our function, reusing one compiled from the same source
+        by any compiler of this class.  If the user supplied globalDict,
+        the code must run in it, so always compile it there.'''
+        if self._userGlobals:
+            self._compiled[self.name] = self.compile_code()
+            return
+        source = str(self)
+        key = (self._lang, source)
+        try:
+            self._compiled[self.name] = compiledQueries[key]
+        except KeyError:
+            f = self.compile_code(source)
+            compiledQueries[key] = f
+            self._compiled[self.name] = f
+
+    def compile_code(self, source=None):
+        'compile using Python exec statement, return our function'
+        if source is None:
+            source = str(self)
+        exec source in self._compiled # COMPILE OUR FUNCTION
+        return self._compiled[self.name]
 
 
 def find_distutils_lib(path='build'):
@@ -365,9 +400,11 @@ def %(name)s(self, g, int maxhit=1000, cdict.IntTupleArray ita=None, qml=None):
 \t\treturn cdict.QueryMatchList(self, ita, g, %(name)s)
 """
 
-    def compile(self):
+    def compile_code(self, source=None):
         'compile using Pyrex, Distutils, and finally import!'
         import os
+        if source is None:
+            source = str(self)
         try:
             # We need access to Pygr source code to access cgraph functions
             # in this module.
@@ -390,7 +427,7 @@ def %(name)s(self, g, int maxhit=1000, cdict.IntTupleArray ita=None, qml=None):
         # Construct a unique name for the module.
         modulename = self.name + str(id(self))
         myfile = file(modulename + '.pyx', 'w') # GENERATE PYREX CODE
-        myfile.write(str(self)) # WRITE CODE
+        myfile.write(source) # WRITE CODE
         myfile.close()
         exit_status = os.system('pyrexc %s.pyx' % (modulename))
         if exit_status != 0:  # RUN THE PYREX COMPILER TO PRODUCE C
@@ -417,9 +454,107 @@ pyrexc missing or not in your PATH?'))
         modulefile, path, desc = imp.find_module(modulename, [modulepath])
         # Load and bind the module.
         self._module = imp.load_module(modulename, modulefile, path, desc)
-        # Bind our query function.
-        self._compiled[self.name] = getattr(self._module, self.name)
         modulefile.close()
+        return getattr(self._module, self.name) # OUR QUERY FUNCTION
+
+
+GraphSnapshot = CSRGraph # FORMER NAME, BEFORE CSRGraph COULD BE SAVED
+
+
+class GraphQueryVF2(object):
+    """run a query with the compiled VF2-style matcher in pygr.cgraphquery,
+    on a CSRGraph of the data graph.  Only plain edge traversal and
+    filter functions are supported; attr, f, subqueries or dataGraph
+    edges raise ValueError.  Matches are generated in a different order
+    than GraphQuery, as new queryMatch dictionaries."""
+
+    def __init__(self, name='graphquery', globalDict=None, order=None,
+                 batchSize=1000):
+        self.name = name
+        self.gqi = []
+        self.queryNodes = []
+        self.queryIndex = {}
+        self.edges = [] # (fromNode, queryNode) PAIRS
+        self.filterGQI = {} # EDGE INDEX: gqi WITH A filter
+        self.order = order
+        self.batchSize = batchSize
+
+    def query_node_id(self, node):
+        try:
+            return self.queryIndex[node]
+        except KeyError:
+            self.queryIndex[node] = len(self.queryNodes)
+            self.queryNodes.append(node)
+            return self.queryIndex[node]
+
+    def __iadd__(self, gqi):
+        'add a GraphQueryIterator to be compiled into this query'
+        if gqi.__class__ not in (GraphQueryIterator, ContainerGQI) \
+               or hasattr(gqi, 'filtercode'):
+            raise ValueError('%s not supported by GraphQueryVF2'
+                             % gqi.__class__.__name__)
+        if gqi.fromNode is not None:
+            try: # CHECK IF QUERY EDGE USES A NON-DEFAULT DATA GRAPH
+                gqi.queryGraph[gqi.fromNode][gqi.queryNode]['dataGraph']
+                raise ValueError('dataGraph edges not supported by '
+                                 'GraphQueryVF2')
+            except (TypeError, KeyError):
+                pass
+            self.query_node_id(gqi.fromNode)
+            if hasattr(gqi, 'filter'):
+                self.filterGQI[len(self.edges)] = gqi
+            self.edges.append((gqi.fromNode, gqi.queryNode))
+        self.query_node_id(gqi.queryNode)
+        self.gqi.append(gqi)
+        return self # iadd MUST RETURN self!!
+
+    def match_dict(self, snapshot, nodeIDs, edgeIDs):
+        'build queryMatch dict from matched data node and edge IDs'
+        nodes = snapshot.nodes
+        queryMatch = {}
+        for i in range(len(nodeIDs)):
+            if nodeIDs[i] >= 0:
+                queryMatch[self.queryNodes[i]] = nodes[nodeIDs[i]]
+        for i in range(len(edgeIDs)):
+            if edgeIDs[i] >= 0:
+                edge = snapshot.edge_value(edgeIDs[i])
+                if edge is not None:
+                    queryMatch[self.edges[i]] = edge
+        return queryMatch
+
+    def matcher(self, snapshot, roots=None):
+        """get a cgraphquery.GraphMatcher for this query on snapshot,
+        optionally matching its first node only to data node IDs in
+        the range roots=(start, end)"""
+        from pygr import cgraphquery
+
+        def filter_func(iedge, nodeIDs, edgeIDs):
+            gqi = self.filterGQI[iedge]
+            source, target = self.edges[iedge]
+            nodes = snapshot.nodes
+            return gqi.filter(toNode=nodes[nodeIDs[self.queryIndex[target]]],
+                              fromNode=nodes[nodeIDs[self.queryIndex[source]]],
+                              edge=snapshot.edge_value(edgeIDs[iedge]),
+                              queryMatch=self.match_dict(snapshot, nodeIDs,
+                                                         edgeIDs),
+                              gqi=gqi)
+        edges = [(self.queryIndex[source], self.queryIndex[target])
+                 for source, target in self.edges]
+        if self.order is not None:
+            order = [self.queryIndex[node] for node in self.order]
+        else:
+            order = None
+        return cgraphquery.GraphMatcher(snapshot, len(self.queryNodes), edges,
+                                        filter_func, self.filterGQI.keys(),
+                                        order, self.batchSize, roots)
+
+    def run(self, dataGraph, roots=None):
+        '''generate queryMatch for each match in dataGraph, which can
+        be a CSRGraph to avoid copying the graph on every run'''
+        if not isinstance(dataGraph, CSRGraph):
+            dataGraph = CSRGraph(dataGraph)
+        for nodeIDs, edgeIDs in self.matcher(dataGraph, roots):
+            yield self.match_dict(dataGraph, nodeIDs, edgeIDs)
 
 
 class GraphQueryIterator(object):
@@ -590,10 +725,16 @@ if p_temp != NULL:
 
 
 class ContainerGQI(GraphQueryIterator):
-    "Iterate over all nodes in self.dataGraph"
+    """Iterate over all nodes in self.dataGraph, or only those in
+    self.candidates if set"""
+    candidates = None
 
     def generate(self):
-        for i in self.dataGraph:
+        if self.candidates is not None:
+            nodes = self.candidates
+        else:
+            nodes = self.dataGraph
+        for i in nodes:
             yield i, None
 
     _generator_code = """
@@ -682,6 +823,46 @@ class SubqueryGQI(GraphQueryIterator):
             gq.cleanup()
 
 
+def send_message(fd, msg, persistent_id=None):
+    'pickle msg to file descriptor fd, preceded by its length'
+    import cPickle
+    import cStringIO
+    import struct
+    import os
+    ifile = cStringIO.StringIO()
+    pickler = cPickle.Pickler(ifile, 2)
+    if persistent_id is not None:
+        pickler.persistent_id = persistent_id
+    pickler.dump(msg)
+    data = ifile.getvalue()
+    data = struct.pack('!i', len(data)) + data
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def read_message(fd, persistent_load=None):
+    'read a message sent by send_message(); raise EOFError at end of file'
+    import cPickle
+    import cStringIO
+    import struct
+    import os
+
+    def read_bytes(n):
+        l = []
+        while n > 0:
+            s = os.read(fd, n)
+            if not s:
+                raise EOFError('message truncated')
+            l.append(s)
+            n -= len(s)
+        return ''.join(l)
+    n = struct.unpack('!i', read_bytes(4))[0]
+    unpickler = cPickle.Unpickler(cStringIO.StringIO(read_bytes(n)))
+    if persistent_load is not None:
+        unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+
 def newGQI(self, oclass, fromNode, toNode, dataGraph, queryGraph,
            dataMatch, queryMatch, gqiDict):
     """figure out a default GQI class to use, based on an attribute dictionary,
@@ -706,6 +887,47 @@ def newGQI(self, oclass, fromNode, toNode, dataGraph, queryGraph,
                   queryMatch, kwargs)
 
 
+class GraphStats(object):
+    '''statistics of a data graph, for planning queries: number of
+    nodes, average out-degree and a sample of sampleSize nodes' edges,
+    used to estimate what fraction of edges a filter accepts'''
+    defaultSelectivity = 0.5 # FOR FILTERS THAT FAIL ON SAMPLE EDGES
+
+    def __init__(self, graph, sampleSize=100):
+        sample = []
+        for node in graph:
+            if len(sample) >= sampleSize:
+                break
+            try:
+                sample.append((node, graph[node].items()))
+            except KeyError:
+                pass
+        self.sample = sample
+        try:
+            self.nodeCount = len(graph)
+        except TypeError:
+            self.nodeCount = len(sample)
+        nEdges = 0
+        for node, edges in sample:
+            nEdges += len(edges)
+        self.avgDegree = nEdges / float(max(len(sample), 1))
+
+    def selectivity(self, gqi):
+        '''estimate fraction of edges accepted by gqi.filter, by calling
+        it (with an empty queryMatch) on our sample edges'''
+        accepted = total = 0
+        for node, edges in self.sample:
+            for target, edge in edges:
+                total += 1
+                try:
+                    if gqi.filter(toNode=target, fromNode=node, edge=edge,
+                                  queryMatch={}, gqi=gqi):
+                        accepted += 1
+                except Exception: # FILTER NEEDS A REAL queryMatch
+                    return self.defaultSelectivity
+        return (accepted + 1.) / (total + 2.)
+
+
 class GraphQuery(object):
     "represents a single query or subquery"
     # DEFAULT MAPPING OF ATTRIBUTE NAMES TO GQI CLASSES TO USE WITH THEM
@@ -716,9 +938,11 @@ class GraphQuery(object):
                'subqueries': SubqueryGQI}
     newGQI = newGQI # USE THIS METHOD TO CHOOSE GQI CLASS FOR EACH ITERATOR
 
-    def __init__(self, dataGraph, queryGraph, dataMatch=None, queryMatch=None):
+    def __init__(self, dataGraph, queryGraph, dataMatch=None, queryMatch=None,
+                 stats=None):
         """Enumerate nodes in queryGraph in BFS order,
-        constructing iterator stack"""
+        constructing iterator stack.  If stats is a GraphStats for
+        dataGraph (or True to compute one), reorder it with plan()"""
         self.dataGraph = dataGraph
         self.queryGraph = queryGraph
         if dataMatch is None:
@@ -769,6 +993,64 @@ class GraphQuery(object):
                                          self.gqiDict))
                     n += 1
             i += 1
+        if stats:
+            self.plan(stats)
+
+    def plan(self, stats=True):
+        '''reorder the iterator stack to minimize the estimated number of
+        partial matches, using GraphStats for the data graph(s).
+        Each step greedily takes the cheapest iterator whose fromNode
+        is already matched: closures (edges between matched nodes)
+        first, then edges with the smallest expected fan-out (average
+        degree times filter selectivity).  Returns estimated cost.'''
+        statsDict = {}
+        selectivity = {}
+        if isinstance(stats, GraphStats):
+            statsDict[id(self.dataGraph)] = stats
+
+        def get_stats(graph):
+            try:
+                return statsDict[id(graph)]
+            except KeyError:
+                statsDict[id(graph)] = GraphStats(graph)
+                return statsDict[id(graph)]
+
+        def fanout(gqi):
+            st = get_stats(gqi.dataGraph)
+            if gqi.fromNode is None: # CONTAINER: EVERY NODE
+                return float(max(st.nodeCount, 1))
+            if gqi.__class__ in (GraphQueryIterator, ContainerGQI):
+                f = st.avgDegree # SEARCH dataGraph[fromNode]
+            else: # attr, f, subqueries ETC: NO ESTIMATE, ASSUME AVERAGE
+                f = max(st.avgDegree, 1.)
+            if gqi.queryNode in bound: # CLOSURE: CHANCE THE EDGE EXISTS
+                f = min(1., f / max(st.nodeCount, 1))
+            if hasattr(gqi, 'filter'):
+                try:
+                    f *= selectivity[id(gqi)]
+                except KeyError:
+                    selectivity[id(gqi)] = st.selectivity(gqi)
+                    f *= selectivity[id(gqi)]
+            return f
+        remaining = list(self.q)
+        q = []
+        bound = {}
+        cost = 0.
+        partials = 1. # EXPECTED PARTIAL MATCHES AT CURRENT LEVEL
+        while remaining:
+            l = [(fanout(gqi), i, gqi) for (i, gqi) in enumerate(remaining)
+                 if gqi.fromNode is None or gqi.fromNode in bound]
+            if not l: # SHOULD NOT HAPPEN: KEEP THE REST IN BFS ORDER
+                q += remaining
+                break
+            f, i, gqi = min(l)
+            del remaining[i]
+            q.append(gqi)
+            bound[gqi.queryNode] = True
+            partials *= f
+            cost += partials
+        self.q = q
+        return cost
 
     def __iter__(self):
         "generates all subgraphs of dataGraph matching queryGraph"
@@ -788,6 +1070,115 @@ class GraphQuery(object):
             else: # NO MORE ACCEPTABLE NODES AT THIS LEVEL, SO BACKTRACK
                 i -= 1
 
+    def run_parallel(self, workers=2, batchSize=100, compiled=False):
+        """generate all matches (as new dicts, in no particular order)
+        using workers forked processes, each searching its share of the
+        candidates for the first (container) query node, and sending
+        back its matches in batches of batchSize.  If compiled, workers
+        run GraphQueryVF2 on a CSRGraph shared from before the
+        fork, returning IDs, so matches contain the data graph's own node
+        objects.  Otherwise they run the GraphQuery iterator, and
+        values other than the container nodes are pickled copies."""
+        import os
+        import select
+        import signal
+        container = self.q[0]
+        if not isinstance(container, ContainerGQI):
+            raise ValueError('first query node must be a ContainerGQI')
+        if compiled:
+            compiler = self.compile(compilerClass=GraphQueryVF2)
+            snapshot = CSRGraph(container.dataGraph)
+            nodeCount = len(snapshot)
+            # SMALL CHUNKS, DEALT IN TURN TO WORKERS, BALANCE THEIR LOAD
+            chunk = max(nodeCount / (8 * workers), 1)
+            persistent_id = persistent_load = None
+        else:
+            candidates = list(container.dataGraph)
+            nodeIndex = dict([(id(node), i)
+                              for (i, node) in enumerate(candidates)])
+            persistent_id = lambda obj: nodeIndex.get(id(obj))
+            persistent_load = candidates.__getitem__
+        if workers < 2 or not hasattr(os, 'fork'): # JUST RUN IT HERE
+            if compiled:
+                for m in compiler.run(snapshot):
+                    yield m
+            else:
+                for m in self:
+                    yield m.copy()
+            return
+
+        pids = {} # {READ FD: WORKER PID}
+        try:
+            for k in range(workers):
+                r, w = os.pipe()
+                pid = os.fork()
+                if pid: # PARENT
+                    os.close(w)
+                    pids[r] = pid
+                    continue
+                try: # WORKER: SEND (kind, data) MESSAGES, THEN EXIT
+                    try:
+                        os.close(r)
+                        for fd in pids: # PIPES TO OTHER WORKERS
+                            os.close(fd)
+                        if compiled:
+                            def matches():
+                                for start in range(k * chunk, nodeCount,
+                                                   workers * chunk):
+                                    for t in compiler.matcher(snapshot,
+                                                (start, start + chunk)):
+                                        yield t
+                        else:
+                            container.candidates = candidates[k::workers]
+
+                            def matches():
+                                for m in self:
+                                    yield m.copy()
+                        batch = []
+                        for m in matches():
+                            batch.append(m)
+                            if len(batch) >= batchSize:
+                                send_message(w, ('matches', batch),
+                                             persistent_id)
+                                batch = []
+                        send_message(w, ('matches', batch), persistent_id)
+                        send_message(w, ('done', None))
+                    except Exception, e:
+                        try:
+                            send_message(w, ('error', e))
+                        except Exception:
+                            send_message(w, ('error', '%s: %s'
+                                             % (e.__class__.__name__, e)))
+                finally:
+                    os._exit(0)
+            while pids:
+                for fd in select.select(pids.keys(), [], [])[0]:
+                    try:
+                        kind, data = read_message(fd, persistent_load)
+                    except EOFError:
+                        kind, data = 'error', 'worker %d exited early' \
+                                     % pids[fd]
+                    if kind == 'matches':
+                        for m in data:
+                            if compiled:
+                                m = compiler.match_dict(snapshot, *m)
+                            yield m
+                    elif kind == 'done':
+                        os.close(fd)
+                        os.waitpid(pids.pop(fd), 0)
+                    elif isinstance(data, Exception):
+                        raise data
+                    else:
+                        raise RuntimeError('worker failed: %s' % data)
+        finally: # STOP ANY REMAINING WORKERS
+            for fd, pid in pids.items():
+                os.close(fd)
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+                os.waitpid(pid, 0)
+
     def cleanup(self):
         "erase any query:data node matching associated with this subquery"
         for q in self.q:
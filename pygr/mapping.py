@@ -1,6 +1,12 @@
 
 
 from __future__ import generators
+import array
+import bisect
+import pickle
+import struct
+import sys
+import weakref
 from schema import *
 import classutil
 
@@ -491,6 +497,33 @@ def unpack_edge(self, objID):
         raise
 
 
+def get_many(db, ids):
+    '''get list of db[k] for each k in ids, using db.get_many() to
+    retrieve them all at once if db provides it'''
+    try:
+        m = db.get_many
+    except AttributeError:
+        return [db[k] for k in ids]
+    return m(ids)
+
+
+## BULK UNPACKING: GET LIST OF OBJECTS FOR A LIST OF IDs
+def unpack_sources(self, objIDs):
+    return get_many(self.sourceDB, objIDs)
+
+
+def unpack_targets(self, objIDs):
+    return get_many(self.targetDB, objIDs)
+
+
+def unpack_edges(self, objIDs):
+    if 'unpack_edge' in self.__dict__: # instance has its own unpack method
+        return [self.unpack_edge(objID) for objID in objIDs]
+    l = [objID for objID in objIDs if objID is not None]
+    d = dict(zip(l, get_many(self.edgeDB, l)))
+    return [d.get(objID) for objID in objIDs] # None for a None edge ID
+
+
 def add_standard_packing_methods(localDict):
     localDict['pack_source'] = pack_id
     localDict['pack_target'] = pack_id
@@ -498,12 +531,17 @@ def add_standard_packing_methods(localDict):
     localDict['unpack_source'] = unpack_source
     localDict['unpack_target'] = unpack_target
     localDict['unpack_edge'] = unpack_edge
+    localDict['unpack_sources'] = unpack_sources
+    localDict['unpack_targets'] = unpack_targets
+    localDict['unpack_edges'] = unpack_edges
 
 
 def add_trivial_packing_methods(localDict):
     for name in ('pack_source', 'pack_target', 'pack_edge',
                  'unpack_source', 'unpack_target', 'unpack_edge'):
         localDict[name] = lambda self, obj: obj
+    for name in ('unpack_sources', 'unpack_targets', 'unpack_edges'):
+        localDict[name] = lambda self, objIDs: list(objIDs)
 
 
 def pack_pickle(self, obj):
@@ -995,6 +1033,422 @@ class IDGraph(Graph):
 Graph._IDGraphClass = IDGraph
 
 
+class MappedArray(object):
+    '''read-only sequence of n values of array typecode, stored at
+    offset in mmap m (in this machine's byte order)'''
+
+    def __init__(self, m, offset, typecode, n):
+        self.m = m
+        self.offset = offset
+        self.typecode = typecode
+        self.n = n
+        self.itemsize = array.array(typecode).itemsize
+        self._struct = struct.Struct(typecode)
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.n)
+            a = array.array(self.typecode)
+            if stop > start:
+                a.fromstring(self.m[self.offset + start * self.itemsize:
+                                    self.offset + stop * self.itemsize])
+            if step != 1:
+                a = a[::step]
+            return a
+        if i < 0:
+            i += self.n
+        if i < 0 or i >= self.n:
+            raise IndexError('MappedArray index out of range')
+        return self._struct.unpack_from(self.m,
+                                        self.offset + i * self.itemsize)[0]
+
+    def __iter__(self):
+        for i in xrange(0, self.n, 65536): # READ IN CHUNKS
+            for v in self[i:i + 65536]:
+                yield v
+
+    def buffer(self):
+        'buffer object for passing our data to C code'
+        return buffer(self.m, self.offset, self.n * self.itemsize)
+
+
+class CSRNodeDict(object):
+    'read-only 2nd layer graph interface for CSRGraph'
+
+    def __init__(self, graph, i):
+        self.graph = graph
+        self.i = i
+        self.start, self.stop = graph.outStart[i:i + 2] # ITS EDGE IDS
+
+    def __getitem__(self, target):
+        g = self.graph
+        try:
+            j = g._find_edge(self.start, self.stop, g.nodeIndex[target])
+        except KeyError:
+            raise KeyError('No edge from node to target')
+        return g.edge_value(j)
+
+    def __contains__(self, target):
+        g = self.graph
+        try:
+            g._find_edge(self.start, self.stop, g.nodeIndex[target])
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        nodes = self.graph.nodes
+        for j in self.graph.outTarget[self.start:self.stop]:
+            yield nodes[j]
+
+    def keys(self):
+        return [k for k in self]
+
+    def itervalues(self):
+        return iter(self.graph.edge_values(self.start, self.stop))
+
+    def values(self):
+        return list(self.graph.edge_values(self.start, self.stop))
+
+    def iteritems(self):
+        nodes = self.graph.nodes
+        return iter([(nodes[j], v) for (j, v) in
+                     zip(self.graph.outTarget[self.start:self.stop],
+                         self.graph.edge_values(self.start, self.stop))])
+
+    def items(self):
+        return list(self.iteritems())
+
+    def edges(self):
+        "Return iterator for accessing edges from fromNode"
+        source = self.graph.nodes[self.i]
+        for target, edgeInfo in self.iteritems():
+            yield source, target, edgeInfo
+
+    __cmp__ = graph_cmp
+
+
+class CSRGraph(object):
+    '''frozen graph in compressed sparse row form: integer node IDs
+    (nodes lists the node objects, nodeIndex maps them back), with
+    sorted targets of each node in one int array (outTarget, divided
+    by outStart) and its sources likewise (inSource, inStart; inEdge
+    gives the edge ID of each).  Edge values are stored as an int array
+    if all ints, a float array if all floats, else a list, or dropped
+    if all None or edgeValues=False.  Built from any graph providing
+    iteritems() or iter(graph) and graph[node].items(); save() writes
+    it to filestem.csr (arrays, read via mmap) and filestem.nodes.'''
+    _magic = 'PYGRCSR1'
+
+    def __init__(self, graph=None, filestem=None, edgeValues=True, **kwargs):
+        self.filestem = filestem
+        self._mmap = None
+        self._users = weakref.WeakKeyDictionary() # C CODE USING OUR ARRAYS
+        self.edgeIDs = None # MAP EDGE ID TO edgeValues INDEX, IF NOT SAME
+        if graph is not None:
+            self._build(graph, edgeValues)
+        elif filestem is not None:
+            self._open()
+        else:
+            raise ValueError('you must provide a graph or filestem')
+
+    def __getstate__(self):
+        if self.filestem is None:
+            raise ValueError('save() CSRGraph to a file before pickling')
+        return classutil.standard_getstate(self)
+    __setstate__ = classutil.standard_setstate
+    _pickleAttrs = dict(filestem=0)
+
+    def _build(self, graph, edgeValues):
+        'copy nodes and edges of graph'
+        nodes = []
+        nodeIndex = {}
+        adjacency = []
+
+        def node_id(node):
+            try:
+                return nodeIndex[node]
+            except KeyError:
+                nodeIndex[node] = len(nodes)
+                nodes.append(node)
+                adjacency.append(())
+                return nodeIndex[node]
+        try:
+            it = graph.iteritems()
+        except AttributeError:
+            it = [(node, graph[node]) for node in graph]
+        for node, d in it:
+            i = node_id(node)
+            l = [(node_id(target), edge) for target, edge in d.items()]
+            l.sort() # TARGETS IN ORDER, FOR BINARY SEARCH
+            adjacency[i] = l
+        n = len(nodes)
+        outStart = array.array('i', [0] * (n + 1))
+        outTarget = array.array('i')
+        values = []
+        inDegree = [0] * n
+        for i in xrange(n):
+            for target, edge in adjacency[i]:
+                outTarget.append(target)
+                values.append(edge)
+                inDegree[target] += 1
+            outStart[i + 1] = len(outTarget)
+            adjacency[i] = None # FREE AS WE GO
+        inStart = array.array('i', [0] * (n + 1))
+        for i in xrange(n):
+            inStart[i + 1] = inStart[i] + inDegree[i]
+        inSource = array.array('i', [0] * len(outTarget))
+        inEdge = array.array('i', [0] * len(outTarget))
+        inPos = inStart[:n]
+        for i in xrange(n): # SOURCES ALSO COME OUT IN ORDER
+            for j in xrange(outStart[i], outStart[i + 1]):
+                target = outTarget[j]
+                inSource[inPos[target]] = i
+                inEdge[inPos[target]] = j
+                inPos[target] += 1
+        self.nodes = nodes
+        self.nodeIndex = nodeIndex
+        self.outStart = outStart
+        self.outTarget = outTarget
+        self.inStart = inStart
+        self.inSource = inSource
+        self.inEdge = inEdge
+        self.edgeValues = None
+        if edgeValues:
+            self.edgeValues = self._pack_values(values)
+
+    def _pack_values(self, values):
+        '''store values as an int array if all ints, or a float array if
+        all floats, otherwise as a list; None if all None'''
+        for typecodes, valueType in ((('i', 'l'), int), (('d', ), float)):
+            for v in values:
+                if type(v) is not valueType:
+                    break
+            else:
+                for typecode in typecodes:
+                    try:
+                        return array.array(typecode, values)
+                    except OverflowError: # TOO BIG, TRY NEXT TYPE
+                        pass
+        for v in values:
+            if v is not None:
+                return values
+        return None
+
+    def _open(self):
+        'read filestem.nodes, and mmap the arrays in filestem.csr'
+        import mmap
+        ifile = file(self.filestem + '.nodes', 'rb')
+        try:
+            d = pickle.load(ifile)
+        finally:
+            ifile.close()
+        self.nodes = d['nodes']
+        self.nodeIndex = dict([(node, i) for (i, node) in
+                               enumerate(self.nodes)])
+        ifile = file(self.filestem + '.csr', 'rb')
+        try:
+            m = mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            ifile.close()
+        if m[:len(self._magic)] != self._magic:
+            m.close()
+            raise IOError('%s.csr is not a CSRGraph file' % self.filestem)
+        self._mmap = m
+        n = len(self.nodes)
+        nEdges = d['nEdges']
+        offset = len(self._magic)
+        columns = [('outStart', 'i', n + 1), ('outTarget', 'i', nEdges),
+                   ('inStart', 'i', n + 1), ('inSource', 'i', nEdges),
+                   ('inEdge', 'i', nEdges)]
+        if d['edgeTypecode'] is not None:
+            columns.append(('edgeValues', d['edgeTypecode'], nEdges))
+        else:
+            self.edgeValues = d['edgeValues'] # LIST OR None
+        for attr, typecode, size in columns:
+            a = MappedArray(m, offset, typecode, size)
+            if d['byteorder'] != sys.byteorder: # CAN'T USE THE MMAP
+                a = a[:]
+                a.byteswap()
+            setattr(self, attr, a)
+            offset += size * a.itemsize
+
+    def save(self, filestem):
+        '''save to filestem.csr and filestem.nodes; reopen from them.
+        Raises ValueError while csr_buffers() users are alive'''
+        if self.edgeIDs is not None: # INVERSE VIEW: REPACK IT FIRST
+            g = self.__class__(self)
+            g.save(filestem)
+            return
+        self._check_users('save')
+        import os
+        ifile = file(filestem + '.csr.tmp', 'wb')
+        try:
+            ifile.write(self._magic)
+            arrays = [self.outStart, self.outTarget, self.inStart,
+                      self.inSource, self.inEdge]
+            edgeTypecode = getattr(self.edgeValues, 'typecode', None)
+            if edgeTypecode is not None:
+                arrays.append(self.edgeValues)
+            for a in arrays:
+                for i in xrange(0, len(a), 65536): # WRITE IN CHUNKS
+                    a[i:i + 65536].tofile(ifile)
+        finally:
+            ifile.close()
+        # RENAME, SO AN OPEN MMAP OF THE OLD FILE STAYS VALID UNTIL close()
+        os.rename(filestem + '.csr.tmp', filestem + '.csr')
+        d = dict(nodes=self.nodes, nEdges=len(self.outTarget),
+                 edgeTypecode=edgeTypecode, byteorder=sys.byteorder,
+                 edgeValues=None)
+        if edgeTypecode is None:
+            d['edgeValues'] = self.edgeValues
+        ifile = file(filestem + '.nodes', 'wb')
+        try:
+            pickle.dump(d, ifile, 2)
+        finally:
+            ifile.close()
+        self.close()
+        self.filestem = filestem
+        self._open()
+
+    def close(self):
+        'close our mmap, if open; raises ValueError while it is in use'
+        if self._mmap is not None:
+            self._check_users('close')
+            self._mmap.close()
+            self._mmap = None
+
+    def _check_users(self, action):
+        'raise ValueError if C code still holds pointers to our arrays'
+        if len(self._users) > 0:
+            raise ValueError('cannot %s CSRGraph: %d matchers still use its \
+arrays' % (action, len(self._users)))
+
+    def csr_buffers(self, user=None):
+        '''(outStart, outTarget, inStart, inSource) as objects providing
+        the buffer interface, for C code such as cgraphquery, which
+        must keep them referenced while it uses them.  close() and save()
+        raise ValueError until user (if given) is garbage-collected'''
+        if user is not None:
+            self._users[user] = None
+        l = []
+        for a in (self.outStart, self.outTarget, self.inStart, self.inSource):
+            if isinstance(a, MappedArray):
+                a = a.buffer()
+            l.append(a)
+        return tuple(l)
+
+    def edge_id(self, i, j):
+        'ID of edge from node ID i to node ID j; KeyError if none'
+        start, stop = self.outStart[i:i + 2]
+        return self._find_edge(start, stop, j)
+
+    def _find_edge(self, start, stop, j):
+        'ID of edge to node ID j among edge IDs start..stop-1'
+        if stop - start < 256: # CHEAPER TO SEARCH A COPY OF THE TARGETS
+            targets = self.outTarget[start:stop]
+            k = bisect.bisect_left(targets, j)
+            if k < len(targets) and targets[k] == j:
+                return start + k
+        else:
+            k = bisect.bisect_left(self.outTarget, j, start, stop)
+            if k < stop and self.outTarget[k] == j:
+                return k
+        raise KeyError('no edge to %d' % j)
+
+    def edge_value(self, k):
+        'value of edge with ID k'
+        if self.edgeValues is None:
+            return None
+        if self.edgeIDs is not None:
+            k = self.edgeIDs[k]
+        return self.edgeValues[k]
+
+    def edge_values(self, start, stop):
+        'list of values of edges with IDs start..stop-1'
+        if self.edgeValues is None:
+            return [None] * (stop - start)
+        if self.edgeIDs is None:
+            return self.edgeValues[start:stop]
+        values = self.edgeValues
+        return [values[k] for k in self.edgeIDs[start:stop]]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def keys(self):
+        return list(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodeIndex
+
+    def __getitem__(self, node):
+        return CSRNodeDict(self, self.nodeIndex[node])
+
+    def itervalues(self):
+        for i in xrange(len(self.nodes)):
+            yield CSRNodeDict(self, i)
+
+    def values(self):
+        return list(self.itervalues())
+
+    def iteritems(self):
+        for i in xrange(len(self.nodes)):
+            yield self.nodes[i], CSRNodeDict(self, i)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def edges(self):
+        "Return iterator of (source, target, edgeInfo) for all edges"
+        nodes = self.nodes
+        starts = iter(self.outStart) # READ IN CHUNKS, NOT NODE BY NODE
+        start = starts.next()
+        for i, stop in enumerate(starts):
+            source = nodes[i]
+            for j, v in zip(self.outTarget[start:stop],
+                            self.edge_values(start, stop)):
+                yield source, nodes[j], v
+            start = stop
+
+    def __invert__(self):
+        'get the inverse graph, sharing our arrays'
+        try:
+            return self._inverse
+        except AttributeError:
+            pass
+        inv = self.__class__.__new__(self.__class__)
+        inv.filestem = None
+        inv._mmap = None # WE OWN IT
+        inv._users = self._users # USERS OF EITHER KEEP OUR MMAP OPEN
+        inv.nodes = self.nodes
+        inv.nodeIndex = self.nodeIndex
+        inv.outStart = self.inStart
+        inv.outTarget = self.inSource
+        inv.inStart = self.outStart
+        inv.inSource = self.outTarget
+        inv.inEdge = None # ONLY NEEDED FOR ITS INVERSE, i.e. US
+        inv.edgeValues = self.edgeValues
+        inv.edgeIDs = self.inEdge
+        inv._inverse = self
+        self._inverse = inv
+        return inv
+
+    __cmp__ = graph_cmp
+
+    def __hash__(self): # SO SCHEMA CAN INDEX ON GRAPHS...
+        return id(self)
+
+
 class KeepUniqueDict(dict):
     'dict that blocks attempts to overwrite an existing key'
 
@@ -252,6 +252,10 @@ class NLMSASeqDict(object, DictMixin):
         'Clear the cache of saved sequences.'
         self._cache.clear()
 
+    def cache_stats(self):
+        'dict of sequence cache size, hits, misses and evictions'
+        return classutil.cache_stats(self._cache)
+
 
 def splitLPOintervals(lpoList, ival, targetIval=None):
     'return list of intervals split to different LPOs'
@@ -12,6 +12,7 @@ Extensions:
 
   - SeqPrefixUnionDict - extends PrefixUnionDict to automatically add seqs
   - BlastDB            - implements NCBI-style name munging for lookups
+  - BGZFSequenceFileDB - reads bgzip-compressed FASTA via a .fai index
 
 Associated sequence classes:
 
@@ -142,6 +143,7 @@ Some long term issues:
 from __future__ import generators
 import sys
 import os
+import bisect
 import UserDict
 import weakref
 
@@ -152,6 +154,7 @@ from annotation import AnnotationDB, AnnotationSeq, AnnotationSlice, \
      AnnotationServer, AnnotationClient
 import logger
 import seqfmt
+import bgzf
 
 from dbfile import NoSuchFileError
 
@@ -177,6 +180,173 @@ class _SequenceDBInverse(object):
             return False
 
 
+class SeqRangeCache(object):
+    """Cache of sequence string intervals, keyed by sequence ID.
+
+    Stores the cache hints given to SequenceDB.cacheHint(), indexed by
+    sequence ID, and the sequence strings read for them.  Overlapping
+    hints for a sequence are merged into a single range that is read from
+    storage in one strslice() call, and cached ranges that overlap are
+    merged so that bases already in the cache are not read again.  When
+    the total length of cached strings exceeds maxBytes, the least
+    recently used ranges are dropped.
+
+    hits, misses, bytesRead and evictions count cache activity.
+    """
+
+    def __init__(self, maxBytes=10000000):
+        self.maxBytes = maxBytes
+        self.nbytes = 0 # total length of cached strings
+        self.hits = self.misses = self.bytesRead = self.evictions = 0
+        self._starts = {} # sorted start of each cached range, by seqID
+        self._ranges = {} # [start, stop, s] ranges, by seqID
+        self._lru = classutil.LRUDictionary() # {(seqID, start): range}
+        self._hints = {} # (start, stop, ownerRef) hints, by seqID
+        self._ownerIDs = {} # id(ownerRef): (ownerRef, hinted seqIDs)
+
+    def add_hints(self, ivalDict, owner):
+        'index {id: (start, stop)} hints, until owner is garbage-collected'
+        ownerRef = weakref.ref(owner, self._drop_owner)
+        self._ownerIDs[id(ownerRef)] = (ownerRef, ivalDict.keys())
+        for seqID, ival in ivalDict.items():
+            self._hints.setdefault(seqID, []).append((ival[0], ival[1],
+                                                      ownerRef))
+
+    def _drop_owner(self, ownerRef):
+        'weakref callback: remove hints of an owner that has been deleted'
+        try:
+            ownerRef, seqIDs = self._ownerIDs.pop(id(ownerRef))
+        except KeyError:
+            return
+        for seqID in seqIDs:
+            try:
+                hints = self._hints[seqID]
+            except KeyError:
+                continue
+            hints = [t for t in hints if t[2] is not ownerRef]
+            if hints:
+                self._hints[seqID] = hints
+            else:
+                del self._hints[seqID]
+
+    def get_hint(self, seqID, start, stop):
+        """Get the range to read for [start, stop) based on cache hints.
+
+        Returns (start, stop, owners) for the union of the hints that
+        overlap a hint containing [start, stop), and the owners of those
+        hints.  Raises IndexError if no hint contains [start, stop).
+        """
+        hints = []
+        container = None
+        for t in self._hints.get(seqID, ()):
+            owner = t[2]()
+            if owner is None: # owner deleted, but callback still pending
+                continue
+            hints.append((t[0], t[1], owner))
+            if container is None and t[0] <= start and stop <= t[1]:
+                container = hints[-1]
+        if container is None:
+            raise IndexError('interval not found in cache')
+        hints.sort(key=lambda t: t[:2])
+        ival_start, ival_stop, owners = hints[0][0], hints[0][1], []
+        for hint_start, hint_stop, owner in hints: # merge overlapping hints
+            if hint_start > ival_stop: # gap: start a new merged range
+                if ival_start <= container[0] and container[1] <= ival_stop:
+                    break # already found the range containing container
+                ival_start, ival_stop, owners = hint_start, hint_stop, []
+            ival_stop = max(ival_stop, hint_stop)
+            owners.append(owner)
+        if ival_stop - ival_start > self.maxBytes: # too big, just use hint
+            return container[0], container[1], [container[2]]
+        return ival_start, ival_stop, owners
+
+    def get(self, seqID, start, stop):
+        'get cached string for [start, stop), or raise KeyError'
+        try:
+            i = bisect.bisect_right(self._starts[seqID], start) - 1
+            if i < 0:
+                raise KeyError('interval not in cache')
+            r = self._ranges[seqID][i]
+            if stop > r[1]:
+                raise KeyError('interval not in cache')
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self._lru[(seqID, r[0])] # mark as most recently used
+        return r[2][start - r[0]:stop - r[0]]
+
+    def fetch(self, seq, start, stop):
+        """Read [start, stop) of seq into the cache and return its string.
+
+        Cached ranges that overlap or abut it are merged into one range;
+        only the gaps between them are read using seq.strslice().
+        """
+        mergedStart, s = self._merge(seq.id, start, stop,
+                                     lambda i, j: seq.strslice(i, j,
+                                                               useCache=False))
+        return s[start - mergedStart:stop - mergedStart]
+
+    def put(self, seqID, start, stop, s):
+        'save string s for [start, stop) of sequence seqID in the cache'
+        self._merge(seqID, start, stop, lambda i, j: s[i - start:j - start])
+
+    def _merge(self, seqID, start, stop, read):
+        """Cache [start, stop), merged with any cached ranges that overlap
+        or abut it.  read(i, j) must return the string for [i, j), and is
+        only called for gaps between cached ranges.  Returns the merged
+        range's start, and its string."""
+        starts = self._starts.setdefault(seqID, [])
+        ranges = self._ranges.setdefault(seqID, [])
+        i = bisect.bisect_right(starts, start) - 1
+        if i < 0 or ranges[i][1] < start: # doesn't overlap previous range
+            i += 1
+        j = i
+        while j < len(ranges) and ranges[j][0] <= stop:
+            j += 1
+        merged = ranges[i:j]
+        if merged:
+            start = min(start, merged[0][0])
+            stop = max(stop, merged[-1][1])
+        l = []
+        pos = start
+        for r in merged + [(stop, stop, '')]: # read gaps between ranges
+            if r[0] > pos:
+                l.append(read(pos, r[0]))
+                self.bytesRead += r[0] - pos
+            l.append(r[2])
+            pos = r[1]
+            self.nbytes -= len(r[2])
+        for r in merged:
+            del self._lru[(seqID, r[0])]
+        s = ''.join(l)
+        r = [start, stop, s]
+        ranges[i:j] = [r]
+        starts[i:j] = [start]
+        self._lru[(seqID, start)] = r
+        self.nbytes += len(s)
+        self._evict()
+        return start, s
+
+    def _evict(self):
+        'drop least recently used ranges until we are within maxBytes'
+        while self.nbytes > self.maxBytes and len(self._lru) > 1:
+            (seqID, start), r = self._lru.pop_oldest() # not the one just added
+            starts = self._starts[seqID]
+            i = bisect.bisect_left(starts, start)
+            self.nbytes -= len(r[2])
+            del self._ranges[seqID][i]
+            del starts[i]
+            self.evictions += 1
+
+    def clear(self):
+        'drop all cached strings (but not the cache hints)'
+        self._starts.clear()
+        self._ranges.clear()
+        self._lru.clear()
+        self.nbytes = 0
+
+
 class SequenceDB(object, UserDict.DictMixin):
     """Base class for sequence databases.
 
@@ -248,11 +418,15 @@ class SequenceDB(object, UserDict.DictMixin):
             break # only process the 1st sequence!!!
 
     _cache_max=10000                    # @CTB move? make settable?
+    _cache_max_bytes = 10000000 # size limit for cached sequence strings
 
     def cacheHint(self, ivalDict, owner):
         """Save a cache hint dict: {id: (start, stop)}.
 
-        @CTB document!
+        The hints stay in effect until owner is garbage-collected.
+        Sequence strings are fetched from storage on the first request
+        that falls within a hint; all hints for the same sequence that
+        overlap it are merged and read at once.  See SeqRangeCache.
         """
         d={}
         # @CTB refactor, test
@@ -262,39 +436,36 @@ class SequenceDB(object, UserDict.DictMixin):
                 ival=(-ival[1], -ival[0])        # @CTB untested
             if ival[1]-ival[0] > self._cache_max: # TRUNCATE EXCESSIVE LENGTH
                 ival=(ival[0], ival[0] + self._cache_max) # @CTB untested
-            d[id]=[ival[0], ival[1]]
+            d[id]=(ival[0], ival[1])
         try:
-            self._cache[owner] = d # ADD TO EXISTING CACHE
+            rangeCache = self._rangeCache
         except AttributeError:
-            self._cache = weakref.WeakKeyDictionary()  # AUTOMATICALLY REMOVE
-            self._cache[owner] = d # FROM CACHE IF owner GOES OUT OF SCOPE
+            rangeCache = self._rangeCache = \
+                         SeqRangeCache(self._cache_max_bytes)
+        rangeCache.add_hints(d, owner) # REMOVED IF owner GOES OUT OF SCOPE
 
     def strsliceCache(self, seq, start, stop):
         """Get strslice using cache hints, if any available."""
         try:
-            cacheDict=self._cache
+            rangeCache = self._rangeCache
         except AttributeError:
             raise IndexError('no cache present')
-        for owner, d in cacheDict.items():
-            try:
-                ival = d[seq.id]
-            except KeyError:
-                continue # NOT IN THIS CACHE, SO SKIP  @CTB untested
-            ival_start, ival_stop = ival[:2]
-            if start >= ival_start and stop <= ival_stop: # CONTAINED IN ival
-                try:
-                    s = ival[2] # get seq string from our cache
-                except IndexError: # use strslice() to retrieve from storage
-                    s = seq.strslice(ival_start, ival_stop, useCache=False)
-                    ival.append(s)
-                    try: # does owner want to reference this cached seq?
-                        save_f = owner.cache_reference
-                    except AttributeError:
-                        pass # no, so nothing to do
-                    else: # let owner control caching in our _weakValueDict
-                        save_f(seq)     # # @CTB untested
-                return s[start - ival_start:stop - ival_start]
-        raise IndexError('interval not found in cache') # @CTB untested
+        try: # already cached?
+            return rangeCache.get(seq.id, start, stop)
+        except KeyError:
+            pass
+        # IndexError if no cache hint covers this interval
+        ival_start, ival_stop, owners = rangeCache.get_hint(seq.id, start,
+                                                            stop)
+        s = rangeCache.fetch(seq, ival_start, ival_stop)
+        for owner in owners:
+            try: # does owner want to reference this cached seq?
+                save_f = owner.cache_reference
+            except AttributeError:
+                pass # no, so nothing to do
+            else: # let owner control caching in our _weakValueDict
+                save_f(seq)
+        return s[start - ival_start:stop - ival_start]
 
     # these methods should all be implemented on all SequenceDBs.
     def close(self):
@@ -337,6 +508,10 @@ class SequenceDB(object, UserDict.DictMixin):
         """Empty the cache."""
         self._weakValueDict.clear()
 
+    def cache_stats(self):
+        """Get dict of sequence object cache size, hits, misses, evictions."""
+        return classutil.cache_stats(self._weakValueDict)
+
     # these methods should not be implemented for read-only database.
     clear = setdefault = pop = popitem = copy = update = \
             classutil.read_only_error
@@ -607,6 +782,143 @@ def _store_seqlen_dict(d, filename, reader=None, mode='rU'):
         ifile.close()
 
 
+####
+#
+# BGZFSequenceFileDB: FASTA access from a bgzip-compressed file.
+#
+
+def read_fai_index(filename):
+    """Read a samtools-style .fai index file.
+
+    Returns (seqLenDict, lineDict): seqLenDict maps each sequence ID to
+    (length, offset), where offset is the position of the sequence's
+    first base in the uncompressed FASTA; lineDict maps each ID to
+    (linebases, linewidth).
+
+    """
+    seqLenDict = {}
+    lineDict = {}
+    ifile = file(filename, 'rU')
+    try:
+        for line in ifile:
+            t = line.rstrip('\r\n').split('\t')
+            if len(t) < 5:
+                continue
+            seqLenDict[t[0]] = int(t[1]), int(t[2])
+            lineDict[t[0]] = int(t[3]), int(t[4])
+    finally:
+        ifile.close()
+    return seqLenDict, lineDict
+
+
+def write_fai_index(filename, seqList):
+    """Save a .fai index from a list of
+    (id, length, offset, linebases, linewidth) tuples."""
+    ofile = file(filename, 'w')
+    try:
+        for t in seqList:
+            print >>ofile, '%s\t%d\t%d\t%d\t%d' % t
+    finally:
+        ofile.close()
+
+
+def build_fai_index(reader):
+    """Scan the uncompressed FASTA text from a bgzf.BGZFReader.
+
+    Returns a list of (id, length, offset, linebases, linewidth) tuples,
+    one per sequence.  As with samtools faidx, all lines of a given
+    sequence except the last must have the same length, so that base
+    positions can be computed from the offset; ValueError is raised
+    if this is not the case.
+
+    """
+    seqList = []
+    seqID = None
+    pos = 0 # offset in the uncompressed stream
+    for line in reader.iter_lines():
+        width = len(line) # includes the line ending
+        bases = len(line.rstrip('\r\n'))
+        if line.startswith('>'):
+            if seqID is not None:
+                seqList.append((seqID, length, offset, lineBases, lineWidth))
+            seqID = line[1:].split()[0]
+            offset = pos + width
+            length = lineBases = lineWidth = 0
+            lastLine = False
+        elif bases:
+            if seqID is None:
+                raise ValueError('FASTA sequence data before any header')
+            if lastLine or (lineBases and bases > lineBases):
+                raise ValueError('sequence %s has unequal line lengths'
+                                 % seqID)
+            if not lineBases:
+                lineBases, lineWidth = bases, width
+            elif bases < lineBases or width != lineWidth:
+                lastLine = True # only the last line may be short
+            length += bases
+        elif lineBases:
+            lastLine = True # blank line must end the sequence
+        pos += width
+    if seqID is not None:
+        seqList.append((seqID, length, offset, lineBases, lineWidth))
+    return seqList
+
+
+class BGZFSequenceFileDB(SequenceFileDB):
+    """Sequence database read directly from a bgzip-compressed FASTA file.
+
+    Unlike SequenceFileDB, no uncompressed '.pureseq' copy of the
+    sequences is made.  Instead a samtools-style '.fai' index gives the
+    position of each sequence in the uncompressed FASTA text, and a
+    '.gzi' index maps uncompressed positions to compressed BGZF blocks,
+    so strslice() only decompresses the blocks it needs.  The most
+    recently used blockCacheSize blocks (up to 64 KB each) are kept in
+    memory.  Both index files are created next to filepath if they do
+    not already exist, and are compatible with samtools faidx.
+
+    """
+    # copy _pickleAttrs and add 'blockCacheSize'
+    _pickleAttrs = SequenceFileDB._pickleAttrs.copy()
+    _pickleAttrs['blockCacheSize'] = 0
+
+    def __init__(self, filepath, blockCacheSize=16, **kwargs):
+        # make filepath a pickleable attribute.
+        self.filepath = classutil.SourceFileName(str(filepath))
+        self.blockCacheSize = blockCacheSize
+        self._reader = bgzf.BGZFReader(filepath, cacheSize=blockCacheSize)
+
+        faipath = self.filepath + '.fai'
+        if not os.path.exists(faipath):
+            logger.debug('Building FASTA index for %s...' % filepath)
+            write_fai_index(faipath, build_fai_index(self._reader))
+        self.seqLenDict, self._lineDict = read_fai_index(faipath)
+        self.seqInfoDict = _SeqLenDictWrapper(self) # standard interface
+
+        # initialize base class.
+        dbname = os.path.basename(filepath)
+        SequenceDB.__init__(self, filepath=filepath, dbname=dbname, **kwargs)
+
+    def close(self):
+        '''close our open BGZF file'''
+        self._reader.close()
+
+    def strslice(self, seqID, start, end, useCache=True):
+        """Access slice of a sequence, decompressing only needed blocks."""
+        length, offset = self.seqLenDict[seqID]
+        lineBases, lineWidth = self._lineDict[seqID]
+        end = min(end, length)
+        if end <= start:
+            return ''
+        # convert base positions to positions in the FASTA text
+        begin = offset + (start / lineBases) * lineWidth + start % lineBases
+        stop = offset + ((end - 1) / lineBases) * lineWidth \
+               + (end - 1) % lineBases + 1
+        s = self._reader.read(begin, stop)
+        if lineWidth > lineBases: # remove line endings
+            s = s.replace('\n', '').replace('\r', '')
+        return s
+
+
 ####
 #
 # class PrefixUnionDict and associated support classes.
@@ -764,6 +1076,16 @@ cannot create with prefixDict and filename both!''')
 
         self.dicts = d
         self.seqInfoDict = _PUDSeqInfoDict(self) # supply standard interface
+        self._keyTypes = {} # {prefix:int or str}, learned by get_subitem()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_keyTypes'] # relearned as keys are looked up
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._keyTypes = {}
 
     def format_id(self, prefix, seqID):
         return prefix + self.separator + seqID
@@ -771,31 +1093,38 @@ cannot create with prefixDict and filename both!''')
     def get_prefix_id(self, k):
         """Subdivide a key into a prefix and ID using the given separator."""
         try:
-            t = k.split(self.separator, 2) # split into no more than 3 fields
+            t = k.split(self.separator, 1) # assume prefix has no separator
         except AttributeError:
             raise KeyError('key should be a string! ' + repr(k))
-        l = len(t)
-        if l == 2:
-            return t
-        elif l<2:
+        if len(t) < 2:
             raise KeyError('invalid id format; no prefix: ' + k)
-        else: # id contains separator character?
-            prefix = t[0] # assume prefix doesn't contain separator @CTB untested
-            seqID = k[len(prefix) + 1:] # skip past prefix
-            return prefix, seqID
-
-    def get_subitem(self, d, seqID):
+        return t
+
+    def get_subitem(self, d, seqID, prefix=None):
+        """Get seqID from d, trying it first as an int key, then as str.
+        If prefix is given, remember which key type worked for that
+        prefix, and try that type first on later calls."""
+        if prefix is not None:
+            keyType = self._keyTypes.get(prefix)
+            if keyType is not None: # try the key type that worked before
+                try:
+                    return d[keyType(seqID)]
+                except (ValueError, KeyError, TypeError):
+                    pass # fall back to trying both key types
         # try int key first
         try:
-            return d[int(seqID)]
+            v = d[int(seqID)]
+            keyType = int
         except (ValueError, KeyError, TypeError):
-            pass
-
-        # otherwise, use default (str) key
-        try:
-            return d[seqID]
-        except KeyError:
-            raise KeyError("no key '%s' in %s" % (seqID, repr(d)))
+            # otherwise, use default (str) key
+            try:
+                v = d[seqID]
+                keyType = str
+            except KeyError:
+                raise KeyError("no key '%s' in %s" % (seqID, repr(d)))
+        if prefix is not None:
+            self._keyTypes[prefix] = keyType
+        return v
 
     def __getitem__(self, k):
         """For 'foo.bar', return 'bar' in dict associated with prefix 'foo'"""
@@ -804,7 +1133,23 @@ cannot create with prefixDict and filename both!''')
             d = self.prefixDict[prefix]
         except KeyError, e:
             raise KeyError("no key '%s' in %s" % (k, repr(self)))
-        return self.get_subitem(d, seqID)
+        return self.get_subitem(d, seqID, prefix)
+
+    def resolve_many(self, keys):
+        """Return list of the sequences for a list of 'prefix.id' keys.
+        Raises KeyError if any key is not found."""
+        prefixDict = self.prefixDict
+        keyTypes = self._keyTypes
+        separator = self.separator
+        l = []
+        for k in keys:
+            try:
+                prefix, seqID = k.split(separator, 1)
+                keyType = keyTypes[prefix]
+                l.append(prefixDict[prefix][keyType(seqID)])
+            except (AttributeError, ValueError, KeyError, TypeError):
+                l.append(self[k]) # use slow path to get it or raise KeyError
+        return l
 
     def __contains__(self, k):
         """Is the given ID in our PrefixUnionDict?"""
@@ -1036,7 +1381,7 @@ class _PUDSeqInfoDict(object, UserDict.DictMixin):
     def __getitem__(self, k):
         prefix, seqID = self.seqDB.get_prefix_id(k)
         db = self.seqDB.prefixDict[prefix]
-        return self.seqDB.get_subitem(db.seqInfoDict, seqID)
+        return self.seqDB.get_subitem(db.seqInfoDict, seqID, prefix)
 
     def has_key(self, k):
         return k in self.seqDB
@@ -1101,7 +1446,8 @@ class BlastDBXMLRPC(BlastDB):
     'XMLRPC server wrapper around a standard BlastDB'
     xmlrpc_methods = dict(getSeqLen=0, get_strslice=0, getSeqLenDict=0,
                           get_db_size=0, get_seqtype=0,
-                          strslice='get_strslice')
+                          strslice='get_strslice', get_strslices=0,
+                          getSeqLens=0, getSeqLenTable=0)
 
     def getSeqLen(self, id):
         'get sequence length, or -1 if not found'
@@ -1110,6 +1456,17 @@ class BlastDBXMLRPC(BlastDB):
         except KeyError:
             return -1  # SEQUENCE OBJECT DOES NOT EXIST
 
+    def getSeqLens(self, ids):
+        'get list of sequence lengths for list of ids, -1 if not found'
+        return [self.getSeqLen(id) for id in ids]
+
+    def getSeqLenTable(self):
+        'return {id: length} for all sequences in one call'
+        d = {}
+        for k, v in self.seqLenDict.iteritems():
+            d[k] = v[0]
+        return d
+
     def getSeqLenDict(self):
         'return seqLenDict over XMLRPC'
         d = {}
@@ -1128,6 +1485,11 @@ class BlastDBXMLRPC(BlastDB):
         else: # POSITIVE ORIENTATION
             return str(self[id][start:stop])
 
+    def get_strslices(self, slices):
+        'return list of strings for list of (id, start, stop) intervals'
+        return [self.get_strslice(id, start, stop)
+                for (id, start, stop) in slices]
+
     def get_seqtype(self):
         return self._seqtype
 
@@ -1136,7 +1498,7 @@ class XMLRPCSequence(SequenceBase):
     "Represents a sequence in a blast database, accessed via XMLRPC"
 
     def __init__(self, db, id):
-        self.length = db.server.getSeqLen(id)
+        self.length = db.get_seqlen(id)
         if self.length <= 0:
             raise KeyError('%s not in this database' % id)
         self.id = id
@@ -1149,6 +1511,13 @@ class XMLRPCSequence(SequenceBase):
                 return self.db.strsliceCache(self, start, end)
             except IndexError: # NOT FOUND IN CACHE
                 pass # JUST USE OUR REGULAR XMLRPC METHOD
+            try: # slices already retrieved by db.strslices()
+                return self.db._sliceCache.get(self.id, start, end)
+            except KeyError:
+                pass
+            s = self.db.server.get_strslice(self.id, start, end)
+            self.db._sliceCache.put(self.id, start, end, s)
+            return s
         # Get from XMLRPC.
         return self.db.server.get_strslice(self.id, start, end)
 
@@ -1177,14 +1546,86 @@ class XMLRPCSequenceDB(SequenceDB):
     itemClass = XMLRPCSequence # sequence storage interface
     seqLenDict = XMLRPCSeqLenDescr('seqLenDict') # INTERFACE TO SEQLENDICT
 
+    batchSize = 500 # maximum number of slices or lengths per server call
+
     def __init__(self, url, name, *args, **kwargs):
         import coordinator
         self.server = coordinator.get_connection(url, name)
         self.url = url
         self.name = name
         self.seqInfoDict = _SeqLenDictWrapper(self)
+        self.batchSize = kwargs.pop('batchSize', self.batchSize)
+        self._seqLens = {} # lengths already retrieved from the server
+        self._sliceCache = SeqRangeCache(self._cache_max_bytes)
         SequenceDB.__init__(self, *args, **kwargs)
 
+    def _batches(self, l):
+        'split list l into lists of at most batchSize items'
+        for i in xrange(0, len(l), self.batchSize):
+            yield l[i:i + self.batchSize]
+
+    def get_seqlen(self, id):
+        'get length of sequence id, or -1 if not found'
+        try:
+            return self._seqLens[id]
+        except KeyError:
+            length = self._seqLens[id] = self.server.getSeqLen(id)
+            return length
+
+    def load_seqlens(self, ids=None):
+        """Retrieve the lengths of the specified sequence IDs, or of all
+        sequences if ids is None, in as few server calls as possible."""
+        if ids is None:
+            try:
+                d = self.server.getSeqLenTable()
+            except AttributeError: # older server; get seqLenDict instead
+                d = dict([(k, v[0]) for (k, v) in self.seqLenDict.items()])
+            self._seqLens.update(d)
+            return
+        ids = [id for id in ids if id not in self._seqLens]
+        try:
+            getSeqLens = self.server.getSeqLens
+        except AttributeError: # older server; get one at a time
+            for id in ids:
+                self.get_seqlen(id)
+            return
+        for batch in self._batches(ids):
+            for id, length in zip(batch, getSeqLens(batch)):
+                self._seqLens[id] = length
+
+    def strslices(self, slices):
+        """Get list of strings for a list of (id, start, stop) intervals.
+
+        Intervals not already in our slice cache are retrieved from the
+        server in batches of batchSize per call, and saved in the slice
+        cache, so later strslice() requests for them (e.g. str(ival))
+        need no server call.
+        """
+        slices = [tuple(t) for t in slices]
+        result = {}
+        missing = []
+        for t in slices:
+            try:
+                result[t] = self._sliceCache.get(*t)
+            except KeyError:
+                if t not in result:
+                    result[t] = None
+                    missing.append(t)
+        try:
+            get_strslices = self.server.get_strslices
+        except AttributeError: # older server; get one at a time
+            get_strslices = lambda l: [self.server.get_strslice(*t)
+                                       for t in l]
+        for batch in self._batches(missing):
+            l = get_strslices(batch)
+            if not isinstance(l, list): # server returns False on error
+                raise KeyError('server failed to get slices: bad ID?')
+            for t, s in zip(batch, l):
+                result[t] = s
+                if t[1] >= 0: # only cache positive orientation slices
+                    self._sliceCache.put(t[0], t[1], t[2], s)
+        return [result[t] for t in slices]
+
     def __reduce__(self): # provided only for compatibility w/ 0.7 clients
         return (classutil.ClassicUnpickler, (self.__class__,
                                              self.__getstate__()))
@@ -1196,7 +1637,7 @@ class XMLRPCSequenceDB(SequenceDB):
         return self.server.get_db_size()
 
     def __contains__(self, k):
-        if self.server.getSeqLen(k)>0:
+        if self.get_seqlen(k)>0:
             return True
         else:
             return False
@@ -17,6 +17,10 @@ cdef extern from "ctype.h":
 cdef extern from "string.h":
     char *strcpy(char *, char *)
 
+cdef extern from "stdlib.h":
+    void *malloc(int)
+    void free(void *)
+
 
 def read_fasta_lengths(d, pyfile, filename):
     'read seq lengths from python file object, save into dictionary d'
@@ -57,3 +61,33 @@ def read_fasta_lengths(d, pyfile, filename):
     if id is not None and seqLength>0:
         d[id] = seqLength, offset # SAVE THIS SEQ LENGTH
     fclose(ifile2)
+
+
+def translate_codons(s, codonTable):
+    '''translate s three letters at a time, using codonTable.
+    Each letter of s must be a letter code chr(0) to chr(15), and
+    codonTable a 4096 character string giving the amino acid for codon
+    a,b,c at position 256 * a + 16 * b + c.  An incomplete last codon
+    is ignored.'''
+    cdef int i, n
+    cdef char *seq
+    cdef char *table
+    cdef char *aa
+    cdef object result
+    if len(codonTable) != 4096:
+        raise ValueError('codonTable must have 4096 characters')
+    seq = s
+    table = codonTable
+    n = len(s) / 3
+    aa = <char *>malloc(n + 1)
+    if aa == NULL:
+        raise MemoryError('unable to allocate translation buffer')
+    for i from 0 <= i < n:
+        aa[i] = table[256 * (seq[3 * i] & 15) + 16 * (seq[3 * i + 1] & 15)
+                      + (seq[3 * i + 2] & 15)]
+    aa[n] = 0
+    try:
+        result = aa # copy to python string
+    finally:
+        free(aa)
+    return result
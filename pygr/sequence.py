@@ -510,14 +510,9 @@ class SeqPath(object):
         return self == self.path
 
     ############################################ STRING SEQUENCE METHODS
-    _complement = {'a': 't', 'c': 'g', 'g': 'c', 't': 'a', 'u': 'a', 'n': 'n',
-                   'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'U': 'A', 'N': 'N'}
-
     def reverse_complement(self, s):
         'get reverse complement of a string s'
-        #return ''.join([self._complement.get(c, c) for c in s[::-1]])
-        return ''.join([self._complement.get(s[i], s[i]) for i in
-                        range(len(s) -1, -1, -1)])
+        return reverse_complement(s)
 
     def seqtype(self):
         "Get the sequence type for this sequence"
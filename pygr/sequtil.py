@@ -1,21 +1,30 @@
+import string
+import struct
+
+try:
+    from seqfmt import translate_codons
+except ImportError: # extension module not built; use pure Python version
+    translate_codons = None
 
 DNA_SEQTYPE=0
 RNA_SEQTYPE=1
 PROTEIN_SEQTYPE=2
 
+_DNA_LETTERS = 'AaTtUuGgCcNn'
+
+
+def _as_str(s):
+    'get string value of s, e.g. a buffer or sequence object'
+    if isinstance(s, str):
+        return s
+    return str(s)
+
 
 def guess_seqtype(s):
-    dna_letters='AaTtUuGgCcNn'
-    ndna=0
-    nU=0
-    nT=0
-    for l in s:
-        if l in dna_letters:
-            ndna += 1
-        if l=='U' or l=='u':
-            nU += 1
-        elif l=='T' or l=='t':
-            nT += 1
+    s = _as_str(s)
+    ndna = len(s) - len(s.translate(None, _DNA_LETTERS)) # count DNA letters
+    nU = s.count('U') + s.count('u')
+    nT = s.count('T') + s.count('t')
     ratio=ndna/float(len(s))
     if ratio>0.85:
         if nT>nU:
@@ -26,6 +35,15 @@ def guess_seqtype(s):
         return PROTEIN_SEQTYPE
 
 
+# complement of nucleotide letters; other characters are left unchanged
+_complement_table = string.maketrans('acgtunACGTUN', 'tgcaanTGCAAN')
+
+
+def reverse_complement(s):
+    'get reverse complement of nucleotide string s'
+    return _as_str(s).translate(_complement_table)[::-1]
+
+
 seq_id_counter=0
 
 
@@ -143,17 +161,76 @@ class AATranslation(object):
                 geneticCode[codon[:2]+'A'] = aa
                 geneticCode[codon[:2]+'G'] = aa
         self.geneticCode = geneticCode
+        self._init_codon_table()
+
+    def _init_codon_table(self):
+        """build tables for translating whole strings: a str.translate()
+        table that converts each letter used in geneticCode (after
+        conversion to upper case and U to T) to a letter code, and any
+        other character to chr(0); and tables giving the amino acid for
+        each codon of letter codes"""
+        letters = {}
+        for codon in self.geneticCode:
+            for c in codon:
+                letters[c] = True
+        letters = letters.keys()
+        letters.sort()
+        letters = [None] + letters # code 0: letter not in geneticCode
+        codes = dict([(c, chr(i)) for i, c in enumerate(letters)])
+        chars = []
+        for i in range(256):
+            c = chr(i).upper()
+            if c == 'U':
+                c = 'T'
+            chars.append(codes.get(c, '\0'))
+        self._letterTable = ''.join(chars)
+        codonTable = _CodonDict()
+        for a in letters[1:]:
+            for b in letters[1:]:
+                for c in letters[1:]:
+                    codonTable[codes[a] + codes[b] + codes[c]] = \
+                        self.geneticCode.get(a + b + c, 'X')
+        self._codonTable = codonTable
+        if translate_codons is not None and len(letters) <= 16:
+            l = ['X'] * 4096 # table for seqfmt.translate_codons()
+            for codon, aa in codonTable.items():
+                l[256 * ord(codon[0]) + 16 * ord(codon[1])
+                  + ord(codon[2])] = aa
+            self._codonString = ''.join(l)
+        else:
+            self._codonString = None
 
     def __call__(self, s):
         'translate nucleotide string s to amino acid string'
-        s = s.upper()
-        s = s.replace('U', 'T')
-        l = []
-        for i in range(0, len(s), 3):
-            try:
-                l.append(self.geneticCode[s[i:i+3]])
-            except KeyError:
-                l.append('X') # uninterpretable
-        return ''.join(l)
+        s = _as_str(s).translate(self._letterTable)
+        if self._codonString is not None: # use our C translation function
+            aa = translate_codons(s, self._codonString)
+        else:
+            aa = ''.join(map(self._codonTable.__getitem__, _split_codons(s)))
+        if len(s) % 3: # incomplete last codon
+            aa += 'X' # uninterpretable
+        return aa
+
+
+class _CodonDict(dict):
+    'codon dict for AATranslation; any other codon is uninterpretable'
+
+    def __missing__(self, codon):
+        return 'X'
+
+_codon_struct = struct.Struct('3s' * 1024)
+
+
+def _split_codons(s):
+    'get list of the complete codons in s'
+    chunk = _codon_struct.size
+    end = len(s) - len(s) % chunk
+    l = []
+    for i in xrange(0, end, chunk):
+        l.extend(_codon_struct.unpack_from(s, i))
+    n = (len(s) - end) / 3
+    if n:
+        l.extend(struct.unpack_from('3s' * n, s, end))
+    return l
 
 translate_orf = AATranslation() # default translation function
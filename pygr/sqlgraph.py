@@ -2,14 +2,21 @@
 
 from __future__ import generators
 from mapping import *
+import array
 from sequence import SequenceBase, DNA_SEQTYPE, RNA_SEQTYPE, PROTEIN_SEQTYPE
 import types
 from classutil import methodFactory, standard_getstate,\
      override_rich_cmp, generate_items, get_bound_subclass, standard_setstate,\
      get_valid_path, standard_invert, RecentValueDictionary, read_only_error,\
-     SourceFileName, split_kwargs
+     SourceFileName, split_kwargs, limit_cache, cache_stats
+import copy
 import os
+import pickle
 import platform
+import Queue
+import sys
+import threading
+import time
 import UserDict
 import warnings
 import logger
@@ -150,11 +157,13 @@ class TupleO(object):
 
 def insert_and_cache_id(self, l, **kwargs):
     'insert tuple into db and cache its rowID on self'
-    self.db._insert(l) # save to database
     try:
         rowID = kwargs['id']  # use the ID supplied by user
-    except KeyError:
-        rowID = self.db.get_insert_id() # get auto-inc ID value
+    except KeyError: # must insert now, to get auto-inc ID value
+        self.db._insert(l, buffered=False)
+        rowID = self.db.get_insert_id()
+    else:
+        self.db._insert(l) # save to database
     self.cache_id(rowID) # cache this ID on self
 
 
@@ -385,6 +394,12 @@ def import_sqlite():
     return sqlite
 
 
+def split_schema_name(name):
+    'split possibly qualified name db.table into ("db.", "table")'
+    i = name.rfind('.')
+    return name[:i + 1], name[i + 1:]
+
+
 def sqlite_table_schema(self, analyzeSchema=True):
     'retrieve table schema from a sqlite3 database, save on self'
     sqlite = import_sqlite()
@@ -392,7 +407,8 @@ def sqlite_table_schema(self, analyzeSchema=True):
     if not analyzeSchema:
         return
     self.clear_schema() # reset settings and dictionaries
-    self.cursor.execute('PRAGMA table_info("%s")' % self.name)
+    prefix, tableName = split_schema_name(self.name) # attached database?
+    self.cursor.execute('PRAGMA %stable_info("%s")' % (prefix, tableName))
     columns = self.cursor.fetchall()
     self.cursor.execute('select * from %s limit 1' % self.name) # descriptions
     for icol, c in enumerate(columns):
@@ -402,10 +418,11 @@ def sqlite_table_schema(self, analyzeSchema=True):
         self.columnType[field] = c[2] # SQL COLUMN TYPE
     #logger.info("column types: %s" % self.columnType)
     # Get primary key / unique indexes.
-    self.cursor.execute('select name from sqlite_master where tbl_name="%s" \
-                        and type="index" and sql is null' % self.name)
+    self.cursor.execute('select name from %ssqlite_master where tbl_name="%s" \
+                        and type="index" and sql is null' % (prefix, tableName))
     for indexname in self.cursor.fetchall(): # search indexes for primary key
-        self.cursor.execute('PRAGMA index_info("%s")' % indexname)
+        self.cursor.execute('PRAGMA %sindex_info("%s")'
+                            % (prefix, indexname[0]))
         l = self.cursor.fetchall() # get list of columns in this index
         if len(l) == 1: # assume 1st single-column unique index is primary key!
             self.primary_key = l[0][2]
@@ -413,8 +430,9 @@ def sqlite_table_schema(self, analyzeSchema=True):
     if self.primary_key is None:
         #logger.info("self.primary_key = %s" % self.primary_key)
         # Grrr, INTEGER PRIMARY KEY handled differently.
-        self.cursor.execute('select sql from sqlite_master where \
-                            tbl_name="%s" and type="table"' % self.name)
+        self.cursor.execute('select sql from %ssqlite_master where \
+                            tbl_name="%s" and type="table"'
+                            % (prefix, tableName))
         sql = self.cursor.fetchall()[0][0]
         for columnSQL in sql[sql.index('(') + 1:].split(','):
             if 'primary key' in columnSQL.lower(): # must be the primary key!
@@ -445,11 +463,16 @@ class SQLFormatDict(object):
     Then transform queries+params as follows; input should be "format" style:
     sql,params = sfd("select * from foo where id=%s and val=%s", (myID,myVal))
     cursor.execute(sql, params)
+
+    Each transformed query is memoized, so repeating a query costs only
+    a dict lookup; at most maxTemplates queries are kept.
     '''
     _paramFormats = dict(pyformat='%%(%d)s', numeric=':%d', named=':%d',
                          qmark='(ignore)', format='(ignore)')
+    maxTemplates = 1000
 
     def __init__(self, paramstyle, substitutionDict={}):
+        self._templates = {} # {sql: transformed sql}
         self.substitutionDict = substitutionDict.copy()
         self.paramstyle = paramstyle
         self.paramFormat = self._paramFormats[paramstyle]
@@ -473,9 +496,16 @@ class SQLFormatDict(object):
 
     def __call__(self, sql, paramList):
         'returns corrected sql,params for this interface'
-        self.iparam = 1 # DB-ABI param indexing begins at 1
-        sql = sql.replace('%s', '%(?)s') # convert format into pyformat
-        s = sql % self # apply all %(x)s replacements in sql
+        try:
+            s = self._templates[sql]
+        except KeyError:
+            self.iparam = 1 # DB-ABI param indexing begins at 1
+            # convert format into pyformat, then apply all %(x)s replacements
+            s = sql.replace('%s', '%(?)s') % self
+            if self.maxTemplates:
+                if len(self._templates) >= self.maxTemplates:
+                    self._templates.clear() # keep memory use bounded
+                self._templates[sql] = s
         if self.makeDict: # construct a params dict
             paramDict = {}
             for i, param in enumerate(paramList):
@@ -485,12 +515,25 @@ class SQLFormatDict(object):
         else: # just return the original params list
             return s, paramList
 
+    def format_many(self, sql, rows):
+        '''like __call__, but for a list of param lists to pass to
+        executemany(); sql is only transformed once, not once per row'''
+        s, params = self(sql, ())
+        if self.makeDict:
+            rows = [dict([(str(i + 1), param)
+                          for i, param in enumerate(row)]) for row in rows]
+        return s, rows
+
 
 def get_table_schema(self, analyzeSchema=True):
     'run the right schema function based on type of db server connection'
 
+    try: # get the real cursor behind a PooledCursor
+        cursor = self.cursor.get_cursor()
+    except AttributeError:
+        cursor = self.cursor
     try:
-        modname = self.cursor.__class__.__module__
+        modname = cursor.__class__.__module__
     except AttributeError:
         raise ValueError('no cursor object or module information!')
     try: # IGB Code
@@ -532,10 +575,156 @@ def sqlalchemy_compatible(silent_fail=False):
             return False
     return True
 
+def iter_chunks(it, n):
+    'generate lists of up to n items from iterator it'
+    l = []
+    for x in it:
+        l.append(x)
+        if len(l) >= n:
+            yield l
+            l = []
+    if l:
+        yield l
+
+
+class BulkWriter(object):
+    '''Buffers writes to an SQL table, and saves them in batches using
+    one executemany() per statement type (or multi-row INSERT ... VALUES,
+    if the server supports it), all within a single transaction that is
+    committed by close().  Obtain one from table.bulk_writer(); while it
+    is active, the table's insert operations are buffered here.
+    NB: buffered rows are not visible to queries until flush().'''
+
+    def __init__(self, db, bufferSize=10000):
+        self.db = db
+        self.bufferSize = bufferSize
+        self._buffers = {} # {sql: list of param rows}
+        self._order = [] # sql statements in order of first use
+        self._seen = {} # {sql: set of rows}, for unique=True statements
+        self.nrows = 0
+        self._began = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        if excType is None:
+            self.close()
+        else: # discard buffered writes, and don't commit partial flushes
+            self.abort()
+        return False
+
+    def write(self, sql, row, unique=False):
+        '''buffer one execution of "format" paramstyle sql with params
+        row.  If unique, repeats of the same row before the next flush()
+        are ignored.'''
+        try:
+            l = self._buffers[sql]
+        except KeyError:
+            l = self._buffers[sql] = []
+            self._order.append(sql)
+        if unique:
+            t = tuple(row)
+            seen = self._seen.setdefault(sql, set())
+            if t in seen:
+                return
+            seen.add(t)
+        l.append(row)
+        self.nrows += 1
+        if self.nrows >= self.bufferSize:
+            self.flush()
+
+    def _get_connection(self):
+        try: # both sqlite3 and MySQLdb cursors provide this
+            return self.db.cursor.connection
+        except AttributeError:
+            return getattr(self.db.serverInfo, '_connection', None)
+
+    def _begin(self):
+        'make sure our writes are inside a transaction'
+        if self._began:
+            return
+        self._began = True
+        conn = self._get_connection()
+        # sqlite3 in autocommit mode would commit every row
+        if getattr(conn, 'isolation_level', '') is None:
+            self.db.cursor.execute('BEGIN')
+
+    def _multirow_values(self):
+        'True if server accepts INSERT ... VALUES (...),(...),...'
+        try:
+            return self.db.serverInfo.multiRowValues
+        except AttributeError:
+            return False
+
+    def flush(self):
+        'save all buffered rows to the database, without committing'
+        if not self.nrows:
+            return
+        self._begin()
+        cursor = self.db.cursor
+        multirow = self._multirow_values()
+        for sql in self._order:
+            rows = self._buffers[sql]
+            if multirow and sql.lower().find(' values (') >= 0:
+                self._execute_multirow(sql, rows)
+            else:
+                sql, rows = self.db._format_query.format_many(sql, rows)
+                cursor.executemany(sql, rows)
+        self._clear()
+
+    def _execute_multirow(self, sql, rows):
+        'run insert sql for many rows at a time in one VALUES list'
+        i = sql.lower().find(' values (') + 8
+        prefix, rowSQL = sql[:i], sql[i:]
+        n = max(1, self.db._max_query_params() // len(rows[0]))
+        for chunk in iter_chunks(rows, n):
+            params = []
+            for row in chunk:
+                params.extend(row)
+            s, params = self.db._format_query(prefix + ','.join([rowSQL]
+                                                                * len(chunk)),
+                                              params)
+            self.db.cursor.execute(s, params)
+
+    def _clear(self):
+        self._buffers = {}
+        self._order = []
+        self._seen = {}
+        self.nrows = 0
+
+    def close(self):
+        'flush buffered rows, commit the transaction, and stop buffering'
+        try:
+            self.flush()
+            if self._began:
+                conn = self._get_connection()
+                if conn is not None:
+                    conn.commit()
+        finally:
+            self._detach()
+
+    def abort(self):
+        'discard buffered rows, roll back flushed rows, and stop buffering'
+        try:
+            self._clear()
+            if self._began:
+                conn = self._get_connection()
+                if conn is not None:
+                    conn.rollback()
+        finally:
+            self._detach()
+
+    def _detach(self):
+        if self.db._bulkWriter is self:
+            self.db._bulkWriter = None
+
+
 class SQLTableBase(object, UserDict.DictMixin):
     "Store information about an SQL table as dict keyed by primary key"
     _schemaModuleDict = _schemaModuleDict # default module list
     get_table_schema = get_table_schema
+    _bulkWriter = None # active BulkWriter, if any
 
     def __init__(self, name, cursor=None, itemClass=None, attrAlias=None,
                  clusterKey=None, createTable=None, graph=None, maxCache=None,
@@ -786,6 +975,7 @@ column!' % attr)
         sql, params = self._format_query('update %s set %s=%%s where %s=%%s'
                                          % (self.name, col, self.primary_key),
                                          (val, row_id))
+        self._flush_writes()
         self.cursor.execute(sql, params)
 
     def getID(self, t):
@@ -819,13 +1009,66 @@ column!' % attr)
         return self.select('where %s=%%s' % attr, (k, ))
 
     def limit_cache(self):
-        'APPLY maxCache LIMIT TO CACHE SIZE'
+        'APPLY maxCache LIMIT TO CACHE SIZE, EVICTING LEAST RECENTLY USED'
         try:
-            if self.maxCache<len(self._weakValueDict):
-                self._weakValueDict.clear()
-        except AttributeError:
+            limit_cache(self._weakValueDict, self.maxCache)
+        except AttributeError: # no maxCache
             pass
 
+    def cache_stats(self):
+        'dict of object cache size, hits, misses and evictions'
+        return cache_stats(self._weakValueDict)
+
+    def _max_query_params(self):
+        'get maximum number of parameters to pass in one query'
+        try:
+            return self.serverInfo.maxQueryParams
+        except AttributeError:
+            return DBServerInfo.maxQueryParams
+
+    def iter_columns(self, names, whereClause='', params=(), arraysize=None):
+        '''generate values of the named columns (or attribute aliases) for
+        rows matching whereClause, in chunks of up to arraysize rows.  Each
+        chunk is a list of tuples, one tuple of values per column.
+        Creates no row objects, and does not touch our cache.'''
+        selectCols = ','.join([self._attrSQL(name) for name in names])
+        if arraysize is None:
+            arraysize = self.arraysize
+        cursor = self.get_new_cursor()
+        if cursor is None: # must fetch all rows to ensure query isolation
+            self._select(whereClause, params, selectCols)
+            rows = self.cursor.fetchall()
+            return [zip(*rows[i:i + arraysize])
+                    for i in xrange(0, len(rows), arraysize)]
+        self._select(whereClause, params, selectCols, cursor=cursor)
+        return self._iter_column_chunks(cursor, arraysize,
+                                        CursorCloser(cursor))
+
+    def _iter_column_chunks(self, cursor, arraysize, cursorHolder):
+        'cursorHolder closes cursor if this iterator is deleted early'
+        while True:
+            rows = cursor.fetchmany(arraysize)
+            if not rows:
+                break
+            yield zip(*rows)
+
+    def columns(self, names, whereClause='', params=(), typecodes={}):
+        '''get the values of the named columns for all rows matching
+        whereClause, as a list of values for each column, or an
+        array.array for columns given a typecode in typecodes, e.g.
+        chroms, starts = db.columns(['chrom', 'txStart'],
+                                    typecodes=dict(txStart='l'))'''
+        result = []
+        for name in names:
+            try:
+                result.append(array.array(typecodes[name]))
+            except KeyError:
+                result.append([])
+        for chunk in self.iter_columns(names, whereClause, params):
+            for l, values in zip(result, chunk):
+                l.extend(values)
+        return result
+
     def get_new_cursor(self):
         """Return a new cursor object, or None if not possible """
         try:
@@ -875,14 +1118,40 @@ column!' % attr)
                 pass
         return l
 
-    def _insert(self, l):
+    def _insert(self, l, buffered=True):
         '''insert tuple into the database.  Note this uses the MySQL
-        extension REPLACE, which overwrites any duplicate key.'''
+        extension REPLACE, which overwrites any duplicate key.
+        Buffered in our bulk_writer(), if one is active and buffered.'''
         s = '%(REPLACE)s into ' + self.name + ' values (' \
             + ','.join(['%s']*len(l)) + ')'
+        if buffered and self._bulkWriter is not None:
+            self._bulkWriter.write(s, l)
+            return
+        self._flush_writes()
         sql, params = self._format_query(s, l)
         self.cursor.execute(sql, params)
 
+    def _flush_writes(self):
+        'save rows buffered by our bulk_writer() before an unbuffered write'
+        if self._bulkWriter is not None:
+            self._bulkWriter.flush() # keep writes in order
+
+    def bulk_writer(self, bufferSize=10000):
+        '''start buffering inserts to this table, and return the
+        BulkWriter holding them; call its close() method to save them
+        all and commit, e.g.
+        w = table.bulk_writer()
+        try:
+            for obj in objs:
+                table.insert(obj)
+        finally:
+            w.close()
+        or use it in a with statement.'''
+        if self._bulkWriter is not None:
+            raise ValueError('bulk_writer() already active on this table')
+        self._bulkWriter = BulkWriter(self, bufferSize)
+        return self._bulkWriter
+
     def insert(self, obj):
         '''insert new row by transforming obj to tuple of values'''
         l = self.tuple_from_obj(obj)
@@ -916,6 +1185,7 @@ column!' % attr)
         sql, params = self._format_query('delete from %s where %s=%%s'
                                          % (self.name, self.primary_key),
                                          (k, ))
+        self._flush_writes()
         self.cursor.execute(sql, params)
         try:
             del self._weakValueDict[k]
@@ -974,6 +1244,162 @@ def iter_keys(self, selectCols=None, orderBy='', map_f=iter,
             return iter(self.keys())
 
 
+def partition_bounds(db, npartitions, cursor=None):
+    '''get list of lower bounds that split the primary key values of db
+    into at most npartitions ranges of similar size'''
+    if cursor is None:
+        cursor = db.cursor
+    pk = db.primary_key
+    cursor.execute('select min(%s),max(%s),count(*) from %s'
+                   % (pk, pk, db.name))
+    lo, hi, n = cursor.fetchall()[0]
+    if not n:
+        return []
+    if isinstance(lo, (int, long)) and isinstance(hi, (int, long)):
+        step = (hi - lo + 1) / float(npartitions)
+        bounds = [lo + int(i * step) for i in range(npartitions)]
+    else: # sample the keys at evenly spaced positions
+        bounds = [lo]
+        for i in range(1, npartitions):
+            cursor.execute('select %s from %s order by %s limit 1 offset %d'
+                           % (pk, db.name, pk, i * n // npartitions))
+            bounds += [t[0] for t in cursor.fetchall()]
+    l = []
+    for b in bounds: # drop duplicates
+        if not l or b > l[-1]:
+            l.append(b)
+    return l
+
+
+class ParallelTableScan(object):
+    '''Reads all rows of table db by splitting its primary key range into
+    partitions, each read by a separate thread on its own connection,
+    using keyset pagination (WHERE pk>last ORDER BY pk LIMIT arraysize).
+    Connections come from db.serverInfo's pool if it has one, otherwise
+    from a temporary pool.  A launcher thread checks out connections in
+    partition order, so ordered iteration cannot deadlock on a small pool.
+    Iterating over this object generates lists of row tuples, either
+    in primary key order (ordered=True) or as soon as they arrive.'''
+    maxBlocks = 4 # blocks each partition may read ahead of the consumer
+
+    def __init__(self, db, npartitions=4, ordered=False, arraysize=None):
+        self.db = db
+        self.npartitions = npartitions
+        self.ordered = ordered
+        if arraysize is None:
+            arraysize = db.arraysize
+        self.arraysize = arraysize
+
+    def _get_pool(self, npartitions):
+        'return (pool, True if we must close it)'
+        serverInfo = self.db.serverInfo
+        if serverInfo is None:
+            raise ValueError('parallel scan requires a serverInfo')
+        if serverInfo.poolSize > 1: # our thread may be holding one
+            return serverInfo._get_pool(), False
+        return ConnectionPool(serverInfo._new_connection, npartitions), True
+
+    def __iter__(self):
+        bounds = partition_bounds(self.db, self.npartitions)
+        if not bounds:
+            return
+        nparts = len(bounds)
+        pool, closePool = self._get_pool(nparts)
+        stop = threading.Event()
+        if self.ordered:
+            queues = [Queue.Queue(self.maxBlocks) for i in range(nparts)]
+        else: # all partitions share one queue
+            queues = [Queue.Queue(self.maxBlocks * nparts)] * nparts
+        t = threading.Thread(target=self._launch,
+                             args=(pool, bounds, queues, stop))
+        t.setDaemon(True)
+        t.start()
+        try:
+            if self.ordered:
+                for q in queues:
+                    for rows in self._read_queue(q, 1):
+                        yield rows
+            else:
+                for rows in self._read_queue(queues[0], nparts):
+                    yield rows
+        finally: # tell threads to quit if we didn't finish
+            stop.set()
+            if closePool:
+                pool.close()
+
+    def _read_queue(self, queue, nparts):
+        'generate row blocks from queue until nparts partitions are done'
+        ndone = 0
+        while ndone < nparts:
+            rows, excInfo = queue.get()
+            if excInfo is not None: # re-raise worker's exception here
+                raise excInfo[0], excInfo[1], excInfo[2]
+            if rows is None: # a partition is done
+                ndone += 1
+            else:
+                yield rows
+
+    def _put(self, queue, item, stop):
+        'put item on queue unless we are told to stop'
+        while not stop.isSet():
+            try:
+                queue.put(item, True, 0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _launch(self, pool, bounds, queues, stop):
+        'start one thread per partition, in order, each with a connection'
+        for i in range(len(bounds)):
+            try:
+                conn = pool.checkout()
+            except Exception:
+                self._put(queues[i], (None, sys.exc_info()), stop)
+                return
+            if stop.isSet():
+                pool.checkin(conn)
+                return
+            t = threading.Thread(target=self._scan,
+                                 args=(pool, conn, bounds, i, queues[i], stop))
+            t.setDaemon(True)
+            t.start()
+
+    def _scan(self, pool, conn, bounds, ipart, queue, stop):
+        'read one partition, in blocks of arraysize rows'
+        db = self.db
+        cursor = None
+        try:
+            try:
+                cursor = conn.cursor()
+                fmt = copy.copy(db._format_query) # not thread-safe
+                head = 'select * from %s where %s' % (db.name, db.primary_key)
+                tail = ' order by %s limit %d' % (db.primary_key,
+                                                  self.arraysize)
+                if ipart + 1 < len(bounds): # upper bound
+                    tail = ' and %s<%%s' % db.primary_key + tail
+                    hi = [bounds[ipart + 1]]
+                else:
+                    hi = []
+                sql, params = head + '>=%s' + tail, [bounds[ipart]] + hi
+                while not stop.isSet():
+                    cursor.execute(*fmt(sql, params))
+                    rows = cursor.fetchall()
+                    if rows and not self._put(queue, (rows, None), stop):
+                        return
+                    if len(rows) < self.arraysize: # partition done
+                        break
+                    sql, params = head + '>%s' + tail, \
+                                  [db.getID(rows[-1])] + hi
+                self._put(queue, (None, None), stop)
+            except Exception:
+                self._put(queue, (None, sys.exc_info()), stop)
+        finally:
+            if cursor is not None:
+                cursor.close()
+            pool.checkin(conn)
+
+
 class SQLTable(SQLTableBase):
     """Provide on-the-fly access to rows in the database, caching
     the results in dict"""
@@ -1014,6 +1440,57 @@ class SQLTable(SQLTableBase):
             # Cache it in local dictionary.
             return self.cacheItem(l[0], self.itemClass)
 
+    def _fetch_many(self, keys):
+        """Get dict of {k: obj} for the keys found in our cache or in the
+        database, querying the database for all missing keys in as few
+        'where id in (...)' queries as the server's parameter limit allows.
+        """
+        found = {}
+        missing = []
+        for k in keys:
+            if k in found:
+                continue
+            try:
+                found[k] = self._weakValueDict[k]
+            except KeyError:
+                found[k] = None
+                missing.append(k)
+        for k in missing:
+            del found[k]
+        self.limit_cache()
+        chunk = self._max_query_params()
+        for i in range(0, len(missing), chunk):
+            l = missing[i:i + chunk]
+            sql, params = self._format_query('select * from %s where %s in \
+                                             (%s)' % (self.name,
+                                                      self.primary_key,
+                                                      ','.join(['%s'] * len(l))),
+                                             l)
+            self.cursor.execute(sql, params)
+            for t in self.cursor.fetchall():
+                k = self.getID(t)
+                if k not in found: # 1st row for this key
+                    found[k] = self.cacheItem(t, self.itemClass)
+                elif not self.allowNonUniqueID:
+                    raise KeyError('%s not unique in %s' % (str(k), self.name))
+        return found
+
+    def get_many(self, keys):
+        """Get list of the objects for a list of keys, in the same order,
+        retrieving those not in our cache with one query per chunk of
+        keys.  Raises KeyError if any key is not found."""
+        found = self._fetch_many(keys)
+        try:
+            return [found[k] for k in keys]
+        except KeyError, e:
+            raise KeyError('%s not found in %s' % (str(e.args[0]), self.name))
+
+    def prefetch(self, keys):
+        """Load the objects for keys into our cache in as few queries as
+        possible, ignoring keys that are not found.  Returns a list of
+        the objects; keep a reference to it to keep them in the cache."""
+        return self._fetch_many(keys).values()
+
     def __setitem__(self, k, v):
         if not self.writeable:
             raise ValueError('this database is read only!')
@@ -1053,6 +1530,19 @@ class SQLTable(SQLTableBase):
         'uses arraysize / maxCache and fetchmany() to manage data transfer'
         return iter_keys(self, selectCols='*', cache_f=None, get_f=self.values)
 
+    def parallel_scan(self, npartitions=4, ordered=False, rows=False):
+        '''iterate over all objects in the table (or row tuples, if rows
+        is True), reading npartitions primary key ranges in parallel.
+        Yields them in primary key order if ordered is True.'''
+        for l in ParallelTableScan(self, npartitions, ordered):
+            if rows:
+                for t in l:
+                    yield t
+            else:
+                self.limit_cache()
+                for t in l:
+                    yield self.cacheItem(t, self.itemClass)
+
 
 def getClusterKeys(self, queryOption=''):
     'uses db select; does not force load'
@@ -1062,13 +1552,145 @@ def getClusterKeys(self, queryOption=''):
     return [t[0] for t in self.cursor.fetchall()]
 
 
+class ClusterCache(object):
+    '''records which keys of a cache dict were loaded with each cluster,
+    so that the least recently used clusters can be dropped from the
+    cache dict once more than maxClusters are cached.  Also counts
+    cache hits, misses and evictions.'''
+
+    def __init__(self, maxClusters=None):
+        self.maxClusters = maxClusters
+        self.hits = self.misses = self.evictions = 0
+        self.clear()
+
+    def clear(self):
+        'forget all clusters; does not empty the cache dict itself'
+        self._members = {} # {cluster id: keys loaded with it}
+        self._clusters = {} # {key: cluster ids it was loaded with}
+        self._nrows = {} # {cluster id: number of rows}
+        self._lastUse = {} # {cluster id: clock value at last use}
+        self._clock = 0
+
+    def __contains__(self, clusterID):
+        return clusterID in self._members
+
+    def __len__(self):
+        return len(self._members)
+
+    def _use(self, clusterID):
+        self._clock += 1
+        self._lastUse[clusterID] = self._clock
+
+    def touch(self, clusterID):
+        'record a cache hit on cluster clusterID'
+        self.hits += 1
+        self._use(clusterID)
+
+    def touch_key(self, k):
+        'record a cache hit on key k, marking its clusters as recently used'
+        self.hits += 1
+        for clusterID in self._clusters.get(k, ()):
+            self._use(clusterID)
+
+    def members(self, clusterID):
+        'list of keys loaded with clusterID'
+        return self._members[clusterID]
+
+    def add(self, clusterID, keys, nrows=None):
+        '''record that keys were loaded into the cache dict with clusterID.
+        Call evict() afterwards to apply the maxClusters limit.'''
+        self.misses += 1
+        self._members[clusterID] = keys
+        if nrows is None:
+            nrows = len(keys)
+        self._nrows[clusterID] = nrows
+        for k in keys:
+            try:
+                self._clusters[k].append(clusterID)
+            except KeyError:
+                self._clusters[k] = [clusterID]
+        self._use(clusterID)
+
+    def evict(self, d):
+        'drop least recently used clusters from cache dict d, to maxClusters'
+        if self.maxClusters is None:
+            return
+        while len(self._members) > self.maxClusters:
+            oldest = min([(t, clusterID)
+                          for clusterID, t in self._lastUse.iteritems()])[1]
+            self.drop(d, oldest)
+
+    def drop(self, d, clusterID):
+        '''remove keys of clusterID from cache dict d.  Any other cluster
+        sharing a key with it is also dropped, since that key's cache entry
+        holds data from both.'''
+        stack = [clusterID]
+        while stack:
+            clusterID = stack.pop()
+            try:
+                keys = self._members.pop(clusterID)
+            except KeyError: # already dropped
+                continue
+            del self._lastUse[clusterID]
+            del self._nrows[clusterID]
+            self.evictions += 1
+            for k in keys:
+                try:
+                    del d[k]
+                except KeyError:
+                    pass
+                for other in self._clusters.pop(k, ()):
+                    if other != clusterID:
+                        stack.append(other)
+
+    def drop_incomplete(self, d):
+        'drop clusters some of whose keys are no longer in cache dict d'
+        for clusterID, keys in self._members.items():
+            for k in keys:
+                if k not in d:
+                    self.drop(d, clusterID)
+                    break
+
+    def stats(self):
+        'dict of cache statistics'
+        return dict(clusters=len(self._members), maxClusters=self.maxClusters,
+                    rows=sum(self._nrows.values()), hits=self.hits,
+                    misses=self.misses, evictions=self.evictions)
+
+
+def prefetch_cluster_rows(self, table, selectCols, ids):
+    '''fetch rows of table whose clusterKey is in ids (skipping clusters we
+    already cached), querying up to maxQueryParams ids at a time'''
+    seen = {}
+    l = []
+    for clusterID in ids:
+        if clusterID not in self._clusterCache and clusterID not in seen:
+            seen[clusterID] = None
+            l.append(clusterID)
+    n = table._max_query_params()
+    rows = []
+    for i in range(0, len(l), n):
+        chunk = l[i:i + n]
+        sql, params = table._format_query('select %s from %s where %s in (%s)'
+                                          % (selectCols, table.name,
+                                             table.clusterKey,
+                                             ','.join(['%s'] * len(chunk))),
+                                          chunk)
+        table.cursor.execute(sql, params)
+        rows += table.cursor.fetchall()
+    return rows
+
+
 class SQLTableClustered(SQLTable):
     '''use clusterKey to load a whole cluster of rows at once,
-       specifically, all rows that share the same clusterKey value.'''
+       specifically, all rows that share the same clusterKey value.
+       If maxClusters is given, keeps at most that many clusters cached,
+       dropping the least recently used.'''
 
     def __init__(self, *args, **kwargs):
         kwargs = kwargs.copy() # get a copy we can alter
         kwargs['autoGC'] = False # don't use WeakValueDictionary
+        self._clusterCache = ClusterCache(kwargs.pop('maxClusters', None))
         SQLTable.__init__(self, *args, **kwargs)
         if not self.orderBy: # add default ordering by clusterKey
             self.orderBy = 'ORDER BY %s,%s' % (self.clusterKey,
@@ -1078,12 +1700,51 @@ class SQLTableClustered(SQLTable):
             self.iterSQL = 'WHERE %s>%%s or (%s=%%s and %s>%%s)' \
                            % self.iterColumns
 
+    _pickleAttrs = SQLTable._pickleAttrs.copy()
+    _pickleAttrs.update(dict(maxClusters=0))
+
+    def _get_max_clusters(self):
+        return self._clusterCache.maxClusters
+
+    def _set_max_clusters(self, maxClusters):
+        self._clusterCache.maxClusters = maxClusters
+    maxClusters = property(_get_max_clusters, _set_max_clusters)
+
     def clusterkeys(self):
         return getClusterKeys(self, 'order by %s' % self.clusterKey)
 
+    def limit_cache(self):
+        'apply maxCache limit, and maxClusters limit to cached clusters'
+        n = len(self._weakValueDict)
+        SQLTable.limit_cache(self)
+        if len(self._weakValueDict) < n: # maxCache evicted some rows
+            self._clusterCache.drop_incomplete(self._weakValueDict)
+        self._clusterCache.evict(self._weakValueDict)
+
+    def clear_cache(self):
+        'empty the cache'
+        SQLTable.clear_cache(self)
+        self._clusterCache.clear()
+
+    def _cache_clusters(self, rows):
+        'cache rows and record which cluster each came from'
+        icol = self.data[self.clusterKey]
+        clusters = {}
+        for t in rows:
+            clusterID = t[icol]
+            if clusterID in self._clusterCache: # already cached
+                continue
+            o = self.cacheItem(t, self.itemClass)
+            try:
+                clusters[clusterID].append(o.id)
+            except KeyError:
+                clusters[clusterID] = [o.id]
+        for clusterID, keys in clusters.iteritems():
+            self._clusterCache.add(clusterID, keys)
+
     def __getitem__(self, k):
         try:
-            return self._weakValueDict[k] # DIRECTLY RETURN CACHED VALUE
+            o = self._weakValueDict[k] # DIRECTLY RETURN CACHED VALUE
         except KeyError: # NOT FOUND, SO TRY THE DATABASE
             sql, params = self._format_query('select t2.* from %s t1,%s t2 \
                                              where t1.%s=%%s and t1.%s=t2.%s'
@@ -1094,14 +1755,38 @@ class SQLTableClustered(SQLTable):
             self.cursor.execute(sql, params)
             l = self.cursor.fetchall()
             self.limit_cache()
-            for t in l: # LOAD THE ENTIRE CLUSTER INTO OUR LOCAL CACHE
-                self.cacheItem(t, self.itemClass)
-            return self._weakValueDict[k] # should be in cache, if row k exists
+            self._cache_clusters(l) # LOAD THE ENTIRE CLUSTER INTO OUR CACHE
+            try:
+                return self._weakValueDict[k] # in cache, if row k exists
+            finally:
+                self._clusterCache.evict(self._weakValueDict)
+        self._clusterCache.touch_key(k)
+        return o
 
     def itercluster(self, cluster_id):
         'iterate over all items from the specified cluster'
+        if cluster_id in self._clusterCache:
+            self._clusterCache.touch(cluster_id)
+            d = self._weakValueDict
+            return iter([d[k] for k in self._clusterCache.members(cluster_id)])
+        self.limit_cache()
+        l = list(self.select('where %s=%%s' % self.clusterKey, (cluster_id, )))
+        self._clusterCache.add(cluster_id, [o.id for o in l])
+        self._clusterCache.evict(self._weakValueDict)
+        return iter(l)
+
+    def prefetch_clusters(self, ids):
+        '''load all clusters whose clusterKey value is in ids into our
+        cache, using as few queries as possible'''
+        rows = prefetch_cluster_rows(self, self, '*', ids)
         self.limit_cache()
-        return self.select('where %s=%%s' % self.clusterKey, (cluster_id, ))
+        self._cache_clusters(rows)
+        self._clusterCache.evict(self._weakValueDict)
+
+    def cache_stats(self):
+        '''dict of cluster cache statistics: clusters and rows cached,
+        and cluster hits, misses and evictions'''
+        return self._clusterCache.stats()
 
 
 class SQLForeignRelation(object):
@@ -1230,12 +1915,11 @@ class SQLEdges(SQLTableMultiNoCache):
                                                self._attrSQL('target_id'),
                                                self._attrSQL('source_id'),
                                                self._attrSQL('target_id')))
-        l = [] # PREFETCH ALL ROWS, SINCE CURSOR MAY BE REUSED
-        for source_id, target_id, edge_id in self.cursor.fetchall():
-            l.append((self.graph.unpack_source(source_id),
-                      self.graph.unpack_target(target_id),
-                      self.graph.unpack_edge(edge_id)))
-        return l
+        # PREFETCH ALL ROWS, SINCE CURSOR MAY BE REUSED
+        l = self.cursor.fetchall()
+        return zip(self.graph.unpack_sources([t[0] for t in l]),
+                   self.graph.unpack_targets([t[1] for t in l]),
+                   self.graph.unpack_edges([t[2] for t in l]))
 
     __call__ = keys
 
@@ -1250,20 +1934,23 @@ class SQLEdges(SQLTableMultiNoCache):
                                             self._attrSQL(self._distinct_key)),
                                          (self.graph.pack_edge(edge), ))
         self.cursor.execute(sql, params)
-        l = [] # PREFETCH ALL ROWS, SINCE CURSOR MAY BE REUSED
-        for source_id, target_id in self.cursor.fetchall():
-            l.append((self.graph.unpack_source(source_id),
-                      self.graph.unpack_target(target_id)))
-        return l
+        # PREFETCH ALL ROWS, SINCE CURSOR MAY BE REUSED
+        l = self.cursor.fetchall()
+        return zip(self.graph.unpack_sources([t[0] for t in l]),
+                   self.graph.unpack_targets([t[1] for t in l]))
 
 
 class SQLEdgeDict(object):
-    '2nd level graph interface to SQL database'
+    '''2nd level graph interface to SQL database.  items, if not None,
+    is the list of (target, edge) already loaded for this node.'''
 
-    def __init__(self, fromNode, table):
+    def __init__(self, fromNode, table, items=None):
         self.fromNode = fromNode
         self.table = table
-        if not hasattr(self.table, 'allowMissingNodes'):
+        if items is not None: # loaded by SQLGraph.load_edges()
+            self._items = items
+        elif not hasattr(self.table, 'allowMissingNodes') \
+                 and self.table._bulkWriter is None: # node may be buffered
             sql, params = self.table._format_query('select %s from %s where \
                                                    %s=%%s limit 1'
                                                    % (self.table.sourceSQL,
@@ -1274,7 +1961,39 @@ class SQLEdgeDict(object):
             if len(self.table.cursor.fetchall())<1:
                 raise KeyError('node not in graph!')
 
+    def _loaded_targets(self):
+        """index the loaded (target, edge) items by packed target ID;
+        raise AttributeError if none were loaded"""
+        try:
+            return self._targets
+        except AttributeError:
+            pass
+        d = {}
+        pack_target = self.table.pack_target
+        for target, edge in self._items:
+            d.setdefault(pack_target(target), []).append(edge)
+        self._targets = d
+        return d
+
+    def _loaded_edge(self, target):
+        """get edge to target from the loaded items without a query;
+        raise AttributeError if none were loaded"""
+        l = self._loaded_targets().get(self.table.pack_target(target), ())
+        if len(l) != 1:
+            raise KeyError('either no edge from source to target \
+                           or not unique!')
+        return l[0]
+
+    def _unload(self):
+        'discard loaded edges, now out of date'
+        self.__dict__.pop('_items', None)
+        self.__dict__.pop('_targets', None)
+
     def __getitem__(self, target):
+        try:
+            return self._loaded_edge(target)
+        except AttributeError: # no edges loaded, so query for it
+            pass
         sql, params = self.table._format_query('select %s from %s where \
                                                %s=%%s and %s=%%s limit 2'
                                                % (self.table.edgeSQL,
@@ -1294,13 +2013,15 @@ class SQLEdgeDict(object):
             raise KeyError('no edge from node to target')
 
     def __setitem__(self, target, edge):
-        sql, params = self.table._format_query('replace into %s values \
-                                               (%%s,%%s,%%s)'
-                                               % self.table.name,
-                                               (self.fromNode,
-                                                self.table.pack_target(target),
-                                                self.table.pack_edge(edge)))
-        self.table.cursor.execute(sql, params)
+        s = '%%(REPLACE)s into %s values (%%s,%%s,%%s)' % self.table.name
+        row = (self.fromNode, self.table.pack_target(target),
+               self.table.pack_edge(edge))
+        if self.table._bulkWriter is not None:
+            self.table._bulkWriter.write(s, row)
+        else:
+            sql, params = self.table._format_query(s, row)
+            self.table.cursor.execute(sql, params)
+        self._unload()
         if not hasattr(self.table, 'sourceDB') or \
            (hasattr(self.table, 'targetDB') and
             self.table.sourceDB is self.table.targetDB):
@@ -1318,10 +2039,28 @@ class SQLEdgeDict(object):
                                                   self.table.targetSQL),
                                                (self.fromNode,
                                                self.table.pack_target(target)))
+        self.table._flush_writes()
         self.table.cursor.execute(sql, params)
+        self._unload()
         if self.table.cursor.rowcount < 1: # no rows deleted?
             raise KeyError('no edge from node to target')
 
+    def __contains__(self, target):
+        try:
+            return self.table.pack_target(target) in self._loaded_targets()
+        except AttributeError: # no edges loaded, so query for it
+            pass
+        sql, params = self.table._format_query('select %s from %s where \
+                                               %s=%%s and %s=%%s limit 1'
+                                               % (self.table.targetSQL,
+                                                  self.table.name,
+                                                  self.table.sourceSQL,
+                                                  self.table.targetSQL),
+                                               (self.fromNode,
+                                               self.table.pack_target(target)))
+        self.table.cursor.execute(sql, params)
+        return len(self.table.cursor.fetchall()) > 0
+
     def iterator_query(self):
         sql, params = self.table._format_query('select %s,%s from %s where \
                                                %s=%%s and %s is not null'
@@ -1335,23 +2074,33 @@ class SQLEdgeDict(object):
         return self.table.cursor.fetchall()
 
     def keys(self):
-        return [self.table.unpack_target(target_id)
-                for target_id, edge_id in self.iterator_query()]
+        try:
+            return [t[0] for t in self._items]
+        except AttributeError:
+            pass
+        return self.table.unpack_targets([target_id for target_id, edge_id
+                                          in self.iterator_query()])
 
     def values(self):
-        return [self.table.unpack_edge(edge_id)
-                for target_id, edge_id in self.iterator_query()]
+        try:
+            return [t[1] for t in self._items]
+        except AttributeError:
+            pass
+        return self.table.unpack_edges([edge_id for target_id, edge_id
+                                        in self.iterator_query()])
 
     def edges(self):
-        return [(self.table.unpack_source(self.fromNode),
-                 self.table.unpack_target(target_id),
-                 self.table.unpack_edge(edge_id))
-                for target_id, edge_id in self.iterator_query()]
+        source = self.table.unpack_source(self.fromNode)
+        return [(source, target, edge) for target, edge in self.items()]
 
     def items(self):
-        return [(self.table.unpack_target(target_id),
-                 self.table.unpack_edge(edge_id))
-                for target_id, edge_id in self.iterator_query()]
+        try:
+            return list(self._items)
+        except AttributeError:
+            pass
+        l = self.iterator_query()
+        return zip(self.table.unpack_targets([t[0] for t in l]),
+                   self.table.unpack_edges([t[1] for t in l]))
 
     def __iter__(self):
         return iter(self.keys())
@@ -1372,6 +2121,10 @@ class SQLEdgelessDict(SQLEdgeDict):
     'for SQLGraph tables that lack edge_id column'
 
     def __getitem__(self, target):
+        try:
+            return self._loaded_edge(target)
+        except AttributeError: # no edges loaded, so query for it
+            pass
         sql, params = self.table._format_query('select %s from %s where \
                                                %s=%%s and %s=%%s limit 2'
                                                % (self.table.targetSQL,
@@ -1506,14 +2259,18 @@ class SQLGraph(SQLTableMultiNoCache):
         return self._edgeClass(self.pack_source(k), self)
 
     def __iadd__(self, k):
-        sql, params = self._format_query('delete from %s where %s=%%s and %s \
-                                         is null' % (self.name, self.sourceSQL,
-                                                     self.targetSQL),
-                                         (self.pack_source(k), ))
+        deleteSQL = 'delete from %s where %s=%%s and %s is null' \
+                    % (self.name, self.sourceSQL, self.targetSQL)
+        insertSQL = 'insert %%(IGNORE)s into %s values (%%s,NULL,NULL)' \
+                    % self.name
+        row = (self.pack_source(k), )
+        if self._bulkWriter is not None: # buffer each node only once
+            self._bulkWriter.write(deleteSQL, row, unique=True)
+            self._bulkWriter.write(insertSQL, row, unique=True)
+            return self
+        sql, params = self._format_query(deleteSQL, row)
         self.cursor.execute(sql, params)
-        sql, params = self._format_query('insert %%(IGNORE)s into %s values \
-                                         (%%s,NULL,NULL)' % self.name,
-                                         (self.pack_source(k), ))
+        sql, params = self._format_query(insertSQL, row)
         self.cursor.execute(sql, params)
         return self # iadd MUST RETURN SELF!
 
@@ -1521,6 +2278,7 @@ class SQLGraph(SQLTableMultiNoCache):
         sql, params = self._format_query('delete from %s where %s=%%s'
                                          % (self.name, self.sourceSQL),
                                          (self.pack_source(k), ))
+        self._flush_writes()
         self.cursor.execute(sql, params)
         if self.cursor.rowcount == 0:
             raise KeyError('node not found in graph')
@@ -1553,26 +2311,92 @@ class SQLGraph(SQLTableMultiNoCache):
             self._inverse._inverse = self
             return self._inverse
 
-    def __iter__(self):
-        for k in SQLTableMultiNoCache.__iter__(self):
-            yield self.unpack_source(k)
+    def load_edges(self, ids):
+        '''get {source_id: [(target, edge), ...]} for the list of packed
+        source ids, with one query per chunk of ids.  Nodes with no edges
+        get an empty list; ids not in the graph are omitted.'''
+        if self.edgeSQL is None: # no edge column
+            edgeSQL = 'NULL'
+        else:
+            edgeSQL = self.edgeSQL
+        rows = []
+        chunk = self._max_query_params()
+        for i in range(0, len(ids), chunk):
+            l = ids[i:i + chunk]
+            sql, params = self._format_query('select %s,%s,%s from %s where \
+                                             %s in (%s)'
+                                             % (self.sourceSQL,
+                                                self.targetSQL, edgeSQL,
+                                                self.name, self.sourceSQL,
+                                                ','.join(['%s'] * len(l))),
+                                             l)
+            self.cursor.execute(sql, params)
+            rows += self.cursor.fetchall()
+        d = {}
+        for t in rows:
+            d[t[0]] = []
+        rows = [t for t in rows if t[1] is not None] # skip node-only rows
+        targets = self.unpack_targets([t[1] for t in rows])
+        edges = self.unpack_edges([t[2] for t in rows])
+        for t, target, edge in zip(rows, targets, edges):
+            d[t[0]].append((target, edge))
+        return d
 
-    def iteritems(self):
-        for k in SQLTableMultiNoCache.__iter__(self):
-            yield (self.unpack_source(k), self._edgeClass(k, self))
+    def neighbors_many(self, nodes):
+        '''get list of edge dicts for the list of source nodes, in the
+        same order, loading all their edges with one query per chunk of
+        nodes.  Raises KeyError if a node is not in the graph.'''
+        ids = [self.pack_source(k) for k in nodes]
+        d = self.load_edges(ids)
+        result = []
+        for k in ids:
+            try:
+                items = d[k]
+            except KeyError:
+                if not hasattr(self, 'allowMissingNodes'):
+                    raise KeyError('node not in graph!')
+                items = []
+            result.append(self._edgeClass(k, self, items))
+        return result
 
-    def itervalues(self):
-        for k in SQLTableMultiNoCache.__iter__(self):
-            yield self._edgeClass(k, self)
+    def __iter__(self):
+        for l in iter_chunks(SQLTableMultiNoCache.__iter__(self),
+                             self.arraysize):
+            for o in self.unpack_sources(l):
+                yield o
+
+    def iteritems(self, chunk=None):
+        '''generate (node, edgeDict) pairs.  If chunk is not None, the
+        edges of each chunk of nodes are loaded with load_edges()'''
+        for l in iter_chunks(SQLTableMultiNoCache.__iter__(self),
+                             chunk or self.arraysize):
+            if chunk:
+                d = self.load_edges(l)
+                for k, o in zip(l, self.unpack_sources(l)):
+                    yield (o, self._edgeClass(k, self, d.get(k, [])))
+            else:
+                for k, o in zip(l, self.unpack_sources(l)):
+                    yield (o, self._edgeClass(k, self))
+
+    def itervalues(self, chunk=None):
+        for l in iter_chunks(SQLTableMultiNoCache.__iter__(self),
+                             chunk or self.arraysize):
+            if chunk:
+                d = self.load_edges(l)
+                for k in l:
+                    yield self._edgeClass(k, self, d.get(k, []))
+            else:
+                for k in l:
+                    yield self._edgeClass(k, self)
 
     def keys(self):
-        return [self.unpack_source(k) for k in SQLTableMultiNoCache.keys(self)]
+        return self.unpack_sources(SQLTableMultiNoCache.keys(self))
 
     def values(self):
-        return list(self.itervalues())
+        return list(self.itervalues(self.arraysize))
 
     def items(self):
-        return list(self.iteritems())
+        return list(self.iteritems(self.arraysize))
 
     edges=SQLGraphEdgeDescriptor()
     update = update_graph
@@ -1655,11 +2479,14 @@ class SQLEdgesClusteredDescr(object):
 
 
 class SQLGraphClustered(object):
-    'SQL graph with clustered caching -- loads an entire cluster at a time'
+    '''SQL graph with clustered caching -- loads an entire cluster at a time.
+    If maxClusters is given, keeps at most that many clusters cached,
+    dropping the least recently used.'''
     _edgeDictClass = SQLEdgeDictClustered
 
     def __init__(self, table, source_id='source_id', target_id='target_id',
-                 edge_id='edge_id', clusterKey=None, **kwargs):
+                 edge_id='edge_id', clusterKey=None, maxClusters=None,
+                 **kwargs):
         import types
         if isinstance(table, types.StringType): # CREATE THE TABLE INTERFACE
             if clusterKey is None:
@@ -1678,36 +2505,92 @@ class SQLGraphClustered(object):
         self.target_id = target_id
         self.edge_id = edge_id
         self.d = {}
+        self._clusterCache = ClusterCache(maxClusters)
         save_graph_db_refs(self, **kwargs)
 
     _pickleAttrs = dict(table=0, source_id=0, target_id=0, edge_id=0,
-                        sourceDB=0, targetDB=0, edgeDB=0)
+                        sourceDB=0, targetDB=0, edgeDB=0, maxClusters=0)
 
     def __getstate__(self):
         state = standard_getstate(self)
         state['d'] = {} # UNPICKLE SHOULD RESTORE GRAPH WITH EMPTY CACHE
         return state
 
+    def __setstate__(self, state):
+        maxClusters = state.pop('maxClusters', None)
+        self.__dict__.update(state)
+        self._clusterCache = ClusterCache(maxClusters)
+
+    def _get_max_clusters(self):
+        return self._clusterCache.maxClusters
+
+    def _set_max_clusters(self, maxClusters):
+        self._clusterCache.maxClusters = maxClusters
+    maxClusters = property(_get_max_clusters, _set_max_clusters)
+
     def __getitem__(self, k):
         'get edgeDict for source node k, from cache or by loading its cluster'
         try: # GET DIRECTLY FROM CACHE
-            return self.d[k]
+            d = self.d[k]
         except KeyError:
             if hasattr(self, '_isLoaded'):
                 raise # ENTIRE GRAPH LOADED, SO k REALLY NOT IN THIS GRAPH
+        else:
+            self._clusterCache.touch_key(k)
+            return d
         # HAVE TO LOAD THE ENTIRE CLUSTER CONTAINING THIS NODE
-        sql, params = self.table._format_query('select t2.%s,t2.%s,t2.%s \
-               from %s t1,%s t2 where t1.%s=%%s and t1.%s=t2.%s group by t2.%s'
-                                  % (self.source_id, self.target_id,
-                                     self.edge_id, self.table.name,
-                                     self.table.name, self.source_id,
-                                     self.table.clusterKey,
-                                     self.table.clusterKey,
-                                     self.table.primary_key),
+        sql, params = self.table._format_query('select distinct %s \
+               from %s t1,%s t2 where t1.%s=%%s and t1.%s=t2.%s'
+                                  % (self._cluster_columns('t2.'),
+                                     self.table.name, self.table.name,
+                                     self.source_id, self.table.clusterKey,
+                                     self.table.clusterKey),
                                   (self.pack_source(k), ))
         self.table.cursor.execute(sql, params)
-        self.load(self.table.cursor.fetchall()) # CACHE THIS CLUSTER
-        return self.d[k] # RETURN EDGE DICT FOR THIS NODE
+        self._load_clusters(self.table.cursor.fetchall()) # CACHE THIS CLUSTER
+        try:
+            return self.d[k] # RETURN EDGE DICT FOR THIS NODE
+        finally:
+            self._clusterCache.evict(self.d)
+
+    def _cluster_columns(self, prefix=''):
+        return ','.join([prefix + c for c in (self.source_id, self.target_id,
+                                              self.edge_id,
+                                              self.table.clusterKey)])
+
+    def _load_clusters(self, rows):
+        '''cache rows of (source, target, edge, clusterKey), recording
+        which nodes were loaded with each cluster'''
+        rows = [t for t in rows if t[3] not in self._clusterCache]
+        clusters = {}
+        for t in zip(self.unpack_sources([t[0] for t in rows]),
+                     self.unpack_targets([t[1] for t in rows]),
+                     self.unpack_edges([t[2] for t in rows]),
+                     [t[3] for t in rows]):
+            try:
+                clusters[t[3]].append(t[:3])
+            except KeyError:
+                clusters[t[3]] = [t[:3]]
+        for clusterID, l in clusters.iteritems():
+            self.load(l, unpack=False)
+            self._clusterCache.add(clusterID,
+                                   dict.fromkeys([t[0] for t in l]).keys(),
+                                   len(l))
+
+    def prefetch_clusters(self, ids):
+        '''load all clusters whose clusterKey value is in ids into our
+        cache, using as few queries as possible'''
+        if hasattr(self, '_isLoaded'):
+            return # ENTIRE GRAPH ALREADY LOADED
+        self._load_clusters(prefetch_cluster_rows(self, self.table,
+                                                  self._cluster_columns(),
+                                                  ids))
+        self._clusterCache.evict(self.d)
+
+    def cache_stats(self):
+        '''dict of cluster cache statistics: clusters and edges (rows)
+        cached, and cluster hits, misses and evictions'''
+        return self._clusterCache.stats()
 
     def load(self, l=None, unpack=True):
         'load the specified rows (or all, if None provided) into local cache'
@@ -1723,11 +2606,12 @@ class SQLGraphClustered(object):
             self._isLoaded = True
             # Clear our cache as load() will replicate everything.
             self.d.clear()
+            self._clusterCache.clear() # whole graph stays cached
+        if unpack:
+            l = zip(self.unpack_sources([t[0] for t in l]),
+                    self.unpack_targets([t[1] for t in l]),
+                    self.unpack_edges([t[2] for t in l]))
         for source, target, edge in l: # SAVE TO OUR CACHE
-            if unpack:
-                source = self.unpack_source(source)
-                target = self.unpack_target(target)
-                edge = self.unpack_edge(edge)
             try:
                 self.d[source] += [(target, edge)]
             except KeyError:
@@ -1744,6 +2628,7 @@ class SQLGraphClustered(object):
         # JUST CREATE INTERFACE WITH SWAPPED TARGET & SOURCE
         self._inverse = SQLGraphClustered(self.table, self.target_id,
                                           self.source_id, self.edge_id,
+                                          maxClusters=self.maxClusters,
                                           **graph_db_inverse_refs(self))
         self._inverse._inverse = self
         for source, d in self.d.iteritems(): # INVERT OUR CACHE
@@ -1763,8 +2648,8 @@ class SQLGraphClustered(object):
         'uses db select; does not force load'
         self.table.cursor.execute('select distinct(%s) from %s'
                                   % (self.source_id, self.table.name))
-        return [self.unpack_source(t[0])
-                for t in self.table.cursor.fetchall()]
+        return self.unpack_sources([t[0]
+                                    for t in self.table.cursor.fetchall()])
 
     methodFactory(['iteritems', 'items', 'itervalues', 'values'],
                   'lambda self: (self.load(), self.d.%s())[1]', locals())
@@ -1791,13 +2676,12 @@ class SQLEdgesClustered(SQLGraphClustered):
 
     def keys(self):
         self.load()
-        result = []
-        for edge_id, l in self.d.iteritems():
-            for source_id, target_id in l:
-                result.append((self.graph.unpack_source(source_id),
-                               self.graph.unpack_target(target_id),
-                               self.graph.unpack_edge(edge_id)))
-        return result
+        l = [(source_id, target_id, edge_id)
+             for edge_id, ids in self.d.iteritems()
+             for source_id, target_id in ids]
+        return zip(self.graph.unpack_sources([t[0] for t in l]),
+                   self.graph.unpack_targets([t[1] for t in l]),
+                   self.graph.unpack_edges([t[2] for t in l]))
 
 
 class ForeignKeyInverse(object):
@@ -2112,8 +2996,186 @@ def sqlite_connect(*args, **kwargs):
     return connection, cursor
 
 
+def connection_alive(conn):
+    'test whether a DB API connection still works'
+    try:
+        try:
+            conn.ping() # MySQLdb
+        except AttributeError: # generic test
+            cursor = conn.cursor()
+            cursor.execute('select 1')
+            cursor.fetchall()
+            cursor.close()
+    except Exception:
+        return False
+    return True
+
+
+def close_connection(conn):
+    'close connection, ignoring errors since it may be broken already'
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool(object):
+    '''thread-safe pool of up to maxSize connections made by calling
+    connect().  checkout() blocks while all of them are in use,
+    and replaces dead connections with new ones.'''
+
+    def __init__(self, connect, maxSize):
+        self.connect = connect
+        self.maxSize = maxSize
+        self.nconnections = 0 # number of idle plus checked out connections
+        self._idle = []
+        self._lock = threading.Condition()
+        self.closed = False
+
+    def checkout(self):
+        'get a working connection for exclusive use until checkin()'
+        self._lock.acquire()
+        try:
+            if self.closed:
+                raise ValueError('connection pool is closed')
+            while not self._idle and self.nconnections >= self.maxSize:
+                self._lock.wait()
+            if self._idle:
+                conn = self._idle.pop()
+            else: # reserve a slot for a new connection
+                conn = None
+                self.nconnections += 1
+        finally:
+            self._lock.release()
+        if conn is not None and not connection_alive(conn):
+            close_connection(conn) # just reuse its slot for a new one
+            conn = None
+        if conn is None:
+            try:
+                conn = self.connect()
+            except:
+                self._release_slot()
+                raise
+        return conn
+
+    def _release_slot(self):
+        self._lock.acquire()
+        try:
+            self.nconnections -= 1
+            self._lock.notify()
+        finally:
+            self._lock.release()
+
+    def checkin(self, conn):
+        '''return a connection obtained from checkout(), rolling back
+        any transaction it left open, so it holds no locks while idle'''
+        try:
+            conn.rollback()
+        except Exception: # connection is broken, so don't reuse it
+            self.discard(conn)
+            return
+        self._lock.acquire()
+        try:
+            if not self.closed:
+                self._idle.append(conn)
+                self._lock.notify()
+                return
+        finally:
+            self._lock.release()
+        close_connection(conn)
+        self._release_slot()
+
+    def discard(self, conn):
+        'close a checked out connection instead of returning it to the pool'
+        close_connection(conn)
+        self._release_slot()
+
+    def close(self):
+        'close idle connections; close the others when checked in'
+        self._lock.acquire()
+        try:
+            self.closed = True
+            idle, self._idle = self._idle, []
+            self.nconnections -= len(idle)
+        finally:
+            self._lock.release()
+        for conn in idle:
+            close_connection(conn)
+
+
+class PoolCheckout(object):
+    'a connection and cursor checked out from a pool, returned when deleted'
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.connection = None
+        self.connection = pool.checkout()
+        self.cursor = self.connection.cursor()
+
+    def reconnect(self):
+        'replace our dead connection with a new one'
+        self.pool.discard(self.connection)
+        self.connection = None
+        self.connection = self.pool.checkout()
+        self.cursor = self.connection.cursor()
+
+    def __del__(self):
+        if self.connection is not None:
+            try:
+                self.cursor.close()
+            except Exception:
+                pass
+            self.pool.checkin(self.connection)
+            self.connection = None
+
+
+class PooledCursor(object):
+    '''cursor shared by all tables using a pooled DBServerInfo.  Each
+    thread's calls go to a cursor on its own pooled connection.'''
+
+    def __init__(self, serverInfo):
+        self.__dict__['serverInfo'] = serverInfo
+
+    def get_cursor(self):
+        'get the DB API cursor for the calling thread'
+        return self.serverInfo._thread_checkout().cursor
+
+    def execute(self, *args):
+        checkout = self.serverInfo._thread_checkout()
+        try:
+            return checkout.cursor.execute(*args)
+        except Exception:
+            if connection_alive(checkout.connection): # error was in query
+                raise
+        checkout.reconnect() # connection failed, so retry with a new one
+        return checkout.cursor.execute(*args)
+
+    def executemany(self, *args):
+        checkout = self.serverInfo._thread_checkout()
+        try:
+            return checkout.cursor.executemany(*args)
+        except Exception:
+            if connection_alive(checkout.connection): # error was in query
+                raise
+        checkout.reconnect()
+        return checkout.cursor.executemany(*args)
+
+    def __getattr__(self, attr):
+        return getattr(self.serverInfo._thread_checkout().cursor, attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.serverInfo._thread_checkout().cursor, attr, value)
+
+
+_poolLock = threading.Lock()
+
+
 class DBServerInfo(object):
-    'picklable reference to a database server'
+    '''picklable reference to a database server.  If poolSize is given,
+    each thread gets its own connection from a pool of at most poolSize
+    connections.'''
+    maxQueryParams = 999 # SQLite's default limit; safe for other servers
+    poolSize = None
 
     def __init__(self, moduleName='MySQLdb', serverSideCursors=False,
                  blockIterators=True, *args, **kwargs):
@@ -2122,6 +3184,7 @@ class DBServerInfo(object):
         except KeyError:
             raise ValueError('Module name not found in _DBServerModuleDict: '\
                              + moduleName)
+        self.poolSize = kwargs.pop('poolSize', None)
         self.moduleName = moduleName
         self.args = args  # connection arguments
         self.kwargs = kwargs
@@ -2135,6 +3198,9 @@ class DBServerInfo(object):
 
     def cursor(self):
         """returns cursor associated with the DB server info (reused)"""
+        if self.poolSize:
+            self._get_pool()
+            return self._pooledCursor
         try:
             return self._cursor
         except AttributeError:
@@ -2143,15 +3209,71 @@ class DBServerInfo(object):
 
     def new_cursor(self, arraysize=None):
         """returns a NEW cursor; you must close it yourself! """
-        if not hasattr(self, '_connection'):
-            self._start_connection()
-        cursor = self._connection.cursor()
+        if self.poolSize: # use this thread's connection
+            cursor = self._thread_checkout().connection.cursor()
+        else:
+            if not hasattr(self, '_connection'):
+                self._start_connection()
+            cursor = self._connection.cursor()
         if arraysize is not None:
             cursor.arraysize = arraysize
         return cursor
 
+    def _get_pool(self):
+        'get our connection pool, creating it if needed'
+        try:
+            return self._pool
+        except AttributeError:
+            pass
+        _poolLock.acquire()
+        try:
+            if not hasattr(self, '_pool'):
+                self._local = threading.local()
+                self._pooledCursor = PooledCursor(self)
+                self._pool = ConnectionPool(self._new_connection,
+                                            self.poolSize)
+            return self._pool
+        finally:
+            _poolLock.release()
+
+    def _thread_checkout(self):
+        'get the calling thread\'s PoolCheckout, checking out if needed'
+        pool = self._get_pool()
+        try:
+            return self._local.checkout
+        except AttributeError:
+            self._local.checkout = PoolCheckout(pool)
+            return self._local.checkout
+
+    def checkout(self):
+        '''get a connection from our pool, for exclusive use by the caller
+        until returned by checkin()'''
+        return self._get_pool().checkout()
+
+    def checkin(self, conn):
+        'return a connection obtained from checkout()'
+        self._get_pool().checkin(conn)
+
+    def release(self):
+        '''return the calling thread's pooled connection to the pool; the
+        thread will get a connection again on its next query'''
+        try:
+            del self._local.checkout
+        except AttributeError:
+            pass
+
     def close(self):
         """Close file containing this database"""
+        if self.poolSize:
+            try:
+                pool = self._pool
+            except AttributeError:
+                return
+            pool.close()
+            del self._pool
+            del self._local # returns this thread's connection to closed pool
+            del self._pooledCursor
+            return
         self._cursor.close()
         self._connection.close()
         del self._cursor
@@ -2159,33 +3281,46 @@ class DBServerInfo(object):
 
     def __getstate__(self):
         """return all picklable arguments"""
-        return dict(args=self.args, kwargs=self.kwargs,
-                    moduleName=self.moduleName,
-                    serverSideCursors=self.serverSideCursors,
-                    custom_iter_keys=self.custom_iter_keys)
+        d = dict(args=self.args, kwargs=self.kwargs,
+                 moduleName=self.moduleName,
+                 serverSideCursors=self.serverSideCursors,
+                 custom_iter_keys=self.custom_iter_keys)
+        if self.poolSize:
+            d['poolSize'] = self.poolSize
+        return d
 
 
 class MySQLServerInfo(DBServerInfo):
     'customized for MySQLdb SSCursor support via new_cursor()'
     _serverType = 'mysql'
+    maxQueryParams = 10000 # MySQL only limits total query size
+    multiRowValues = True # BulkWriter can insert many rows per statement
 
     def _start_connection(self):
         self._connection, self._cursor = mysql_connect(*self.args,
                                                        **self.kwargs)
 
+    def _new_connection(self):
+        return mysql_connect(*self.args, **self.kwargs)[0]
+
     def new_cursor(self, arraysize=None):
         'provide streaming cursor support'
         if not self.serverSideCursors: # use regular MySQLdb cursor
             return DBServerInfo.new_cursor(self, arraysize)
+        if self.poolSize: # each thread needs its own streaming connection
+            self._get_pool()
+            holder = self._local
+        else:
+            holder = self
         try:
-            conn = self._conn_sscursor
+            conn = holder._conn_sscursor
             #logger.info("Using SSCursor")
         except AttributeError:
-            self._conn_sscursor, cursor = mysql_connect(useStreaming=True,
-                                                        *self.args,
-                                                        **self.kwargs)
+            holder._conn_sscursor, cursor = mysql_connect(useStreaming=True,
+                                                          *self.args,
+                                                          **self.kwargs)
         else:
-            cursor = self._conn_sscursor.cursor()
+            cursor = holder._conn_sscursor.cursor()
         if arraysize is not None:
             #logger.info("arraysize = %s" % arraysize)
             cursor.arraysize = arraysize
@@ -2293,12 +3428,196 @@ class SQLiteServerInfo(DBServerInfo):
         self._connection, self._cursor = sqlite_connect(*self.args,
                                                         **self.kwargs)
 
+    def _new_connection(self):
+        '''pooled connections may be checked in by one thread, out by
+        another.  They run in autocommit mode, so each write is saved
+        (and its lock released) at once, unless a BulkWriter begins an
+        explicit transaction'''
+        database = self.kwargs.get('database', False) or self.args[0]
+        if database == ':memory:':
+            raise ValueError('SQLite in-memory database cannot be pooled!')
+        kwargs = self.kwargs.copy()
+        kwargs['check_same_thread'] = False
+        kwargs.setdefault('isolation_level', None)
+        return sqlite_connect(*self.args, **kwargs)[0]
+
     def __getstate__(self):
         database = self.kwargs.get('database', False) or self.args[0]
         if database == ':memory:':
             raise ValueError('SQLite in-memory database is not picklable!')
         return DBServerInfo.__getstate__(self)
 
+
+def sqlite_column_type(columnType):
+    'get SQLite column type for a column type reported by another server'
+    t = str(columnType).lower()
+    if 'int' in t:
+        return 'INTEGER'
+    for s, sqliteType in (('char', 'TEXT'), ('text', 'TEXT'),
+                          ('enum', 'TEXT'), ('set(', 'TEXT'),
+                          ('blob', 'BLOB'), ('binary', 'BLOB'),
+                          ('real', 'REAL'), ('float', 'REAL'),
+                          ('double', 'REAL'), ('decimal', 'NUMERIC'),
+                          ('numeric', 'NUMERIC')):
+        if t.startswith(s) or s in t:
+            return sqliteType
+    return '' # no type affinity: store values as given
+
+
+class CachedServerInfo(SQLiteServerInfo):
+    '''picklable reference to a remote database server, whose tables are
+    mirrored on first use into a local sqlite database.  All queries on a
+    mirrored table, including repeat reads, are served from the local
+    copy.  If maxAge is given, a copy older than maxAge seconds is
+    refreshed from the remote server when a table object is next opened.
+    Writes only change the local copy.'''
+    _mirrorCatalog = 'pygr_mirror' # records what we mirrored, and when
+
+    def __init__(self, remoteServer, database, maxAge=None, *args, **kwargs):
+        cls = self.__class__
+        SQLiteServerInfo.__init__(self, database, *args, **kwargs)
+        self.__class__ = cls # base constructor sets class from moduleName
+        self.remoteServer = remoteServer
+        self.maxAge = maxAge
+
+    def _start_connection(self):
+        SQLiteServerInfo._start_connection(self)
+        self._init_connection(self._connection)
+
+    def _new_connection(self):
+        connection = SQLiteServerInfo._new_connection(self)
+        self._init_connection(connection)
+        return connection
+
+    def _init_connection(self, connection):
+        'create our catalog if needed, and attach mirrored databases'
+        cursor = connection.cursor()
+        try:
+            cursor.execute('create table if not exists %s (name text \
+                           primary key, whereClause text, params text, \
+                           mirrored real)' % self._mirrorCatalog)
+            cursor.execute('select name from %s' % self._mirrorCatalog)
+            for prefix in set([split_schema_name(t[0])[0]
+                               for t in cursor.fetchall()]):
+                if prefix:
+                    self._attach(cursor, prefix[:-1])
+        finally:
+            cursor.close()
+
+    def _attach(self, cursor, dbName):
+        '''store tables of remote database dbName in a separate local
+        file, attached under the same name so that queries on dbName.table
+        work unchanged'''
+        cursor.execute('PRAGMA database_list')
+        if dbName in [t[1] for t in cursor.fetchall()]:
+            return # already attached
+        database = self.kwargs.get('database', False) or self.args[0]
+        if database != ':memory:':
+            database = '%s.%s' % (database, dbName)
+        cursor.connection.commit() # sqlite cannot attach within transaction
+        cursor.execute('ATTACH DATABASE ? AS "%s"' % dbName, (database, ))
+
+    def mirror_info(self, name):
+        '''return (whereClause, params, time mirrored) for table name,
+        or None if it has not been mirrored'''
+        cursor = self.cursor()
+        cursor.execute('select whereClause, params, mirrored from %s \
+                       where name=?' % self._mirrorCatalog, (name, ))
+        l = cursor.fetchall()
+        if not l:
+            return None
+        whereClause, params, mirrored = l[0]
+        return whereClause, pickle.loads(str(params)), mirrored
+
+    def _local_table_exists(self, name):
+        prefix, tableName = split_schema_name(name)
+        cursor = self.cursor()
+        try:
+            cursor.execute('select name from %ssqlite_master where \
+                           type="table" and name=?' % prefix, (tableName, ))
+        except import_sqlite().OperationalError: # database not attached
+            return False
+        return len(cursor.fetchall()) > 0
+
+    def mirror_table(self, name, whereClause='', params=(), arraysize=1024):
+        '''copy remote table name to our local database, replacing any
+        existing copy.  To copy only part of the table, give a whereClause
+        with %s placeholders for params, e.g. ("where chrom=%s", ["chr1"])'''
+        remoteTable = SQLTableNoCache(name, serverInfo=self.remoteServer)
+        prefix, tableName = split_schema_name(name)
+        columns = []
+        for col in remoteTable.columnName:
+            columnSQL = '%s %s' % (col, sqlite_column_type(
+                remoteTable.columnType[col]))
+            if col == remoteTable.primary_key:
+                columnSQL += ' PRIMARY KEY'
+            columns.append(columnSQL)
+        if isinstance(remoteTable.primary_key, (list, tuple)):
+            columns.append('PRIMARY KEY (%s)'
+                           % ','.join(remoteTable.primary_key))
+        cursor = self.new_cursor()
+        try:
+            if prefix:
+                self._attach(cursor, prefix[:-1])
+            cursor.execute('drop table if exists %s' % name)
+            cursor.execute('create table %s (%s)' % (name, ','.join(columns)))
+            insertSQL = 'insert into %s values (%s)' \
+                        % (name, ','.join(['?'] * len(remoteTable.columnName)))
+            sql, qparams = remoteTable._format_query('select %s from %s %s'
+                % (','.join(remoteTable.columnName), name, whereClause),
+                                                     params)
+            remoteCursor = self.remoteServer.new_cursor(arraysize)
+            try:
+                remoteCursor.execute(sql, qparams)
+                while True:
+                    rows = remoteCursor.fetchmany(arraysize)
+                    if not rows:
+                        break
+                    cursor.executemany(insertSQL, rows)
+            finally:
+                remoteCursor.close()
+            for col in remoteTable.indexed: # index after loading the data
+                if col in remoteTable.columnType and \
+                       col != remoteTable.primary_key:
+                    cursor.execute('create index %s%s_%s on %s (%s)'
+                                   % (prefix, tableName, col, tableName, col))
+            cursor.execute('insert or replace into %s values (?,?,?,?)'
+                           % self._mirrorCatalog,
+                           (name, whereClause, pickle.dumps(params),
+                            time.time()))
+            cursor.connection.commit()
+        finally:
+            cursor.close()
+
+    def refresh(self, name):
+        'copy table name from the remote server again, using same whereClause'
+        info = self.mirror_info(name)
+        if info is None:
+            self.mirror_table(name)
+        else:
+            self.mirror_table(name, info[0], info[1])
+
+    def update_mirror(self, name):
+        '''mirror table name if it is not yet mirrored, or refresh it if
+        older than maxAge.  Tables created locally are left unchanged.'''
+        info = self.mirror_info(name)
+        if info is None:
+            if not self._local_table_exists(name):
+                self.mirror_table(name)
+        elif self.maxAge is not None and time.time() - info[2] > self.maxAge:
+            self.mirror_table(name, info[0], info[1])
+
+    def get_table_schema(self, owner, analyzeSchema=True):
+        'mirror owner\'s table if needed, then get its local schema'
+        if analyzeSchema:
+            self.update_mirror(owner.name)
+        sqlite_table_schema(owner, analyzeSchema)
+
+    def __getstate__(self):
+        d = SQLiteServerInfo.__getstate__(self)
+        d.update(remoteServer=self.remoteServer, maxAge=self.maxAge)
+        return d
+
 # IGB code: Used by GenericServerInfo to support mysql/sqlite query format                                                                                                        
 _formatMacrosDict = {'mysql':_mysqlMacros,
                      'sqlite':_sqliteMacros}
@@ -2328,6 +3647,7 @@ class GenericServerInfo(DBServerInfo):
             self._serverType = 'mysql'
         
         DBServerInfo.__init__(self, 'sqlalchemy', *args, **kwargs) # IGB
+        kwargs.pop('poolSize', None)
 
         self.args = args
         self.kwargs = kwargs
@@ -2393,6 +3713,9 @@ class GenericServerInfo(DBServerInfo):
         except AttributeError:
             self._cursor = self._connection.cursor()
 
+    def _new_connection(self):
+        return self._get_engine().raw_connection()
+
     ## ORIGINAL IGB CODE
     # def new_cursor(self, *args, **kwargs):
     #     #logger.info("GenericServerInfo: %s, %s" %(args, kwargs))
@@ -2782,19 +4105,19 @@ class GraphViewEdgeDict(UserDict.DictMixin):
         return len(self.targets)
 
     def __iter__(self):
-        for k in self.targets:
-            yield self.g.targetDB[k]
+        return iter(self.keys())
 
     def keys(self):
-        return list(self)
+        return get_many(self.g.targetDB, self.targets)
 
     def iteritems(self):
+        targets = self.keys()
         if self.g.edgeDB is not None: # save with edge info
-            for k in self.targets:
-                yield (self.g.targetDB[k], self.g.edgeDB[self.targetDict[k]])
+            edges = get_many(self.g.edgeDB,
+                             [self.targetDict[k] for k in self.targets])
         else: # just save the list of targets, no edge info
-            for k in self.targets:
-                yield (self.g.targetDB[k], None)
+            edges = [None] * len(targets)
+        return iter(zip(targets, edges))
 
     def __getitem__(self, o, exitIfFound=False):
         'for the specified target object, return its associated edge object'
@@ -2840,16 +4163,50 @@ class GraphView(MapView):
     _pickleAttrs.update(dict(edgeDB=0))
 
 
+class SQLSequenceCacheHint(object):
+    """cacheHint() method for a table of SQLSequence objects: reads the
+    chunks covering each hinted interval {id: (start, stop)}, one query
+    per sequence.  If owner has a cache_reference() method, it is given
+    each sequence so the owner keeps its cached chunks alive."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __call__(self, ivalDict, owner=None):
+        for seqID, ival in ivalDict.items():
+            start, stop = ival[0], ival[1]
+            if start < 0: # force into positive orientation
+                start, stop = -stop, -start
+            try:
+                seq = self.db[seqID]
+            except KeyError:
+                continue
+            seq.cache_interval(start, stop)
+            try: # does owner want to reference this cached seq?
+                save_f = owner.cache_reference
+            except AttributeError:
+                pass
+            else:
+                save_f(seq)
+
+
 class SQLSequence(SQLRow, SequenceBase):
     """Transparent access to a DB row representing a sequence.
-    Does not cache the sequence string in memory -- uses SQL queries to
-    retrieve just the desired slice as needed.
+    Does not cache the whole sequence string in memory -- uses SQL queries
+    to retrieve fixed-size chunks of chunkSize letters as needed, keeping
+    the maxChunks most recently used chunks of each sequence, and reading
+    prefetchChunks extra chunks ahead when slices are accessed in order.
+    Set chunkSize to 0 to query each slice separately.
     By default expects a column named 'length' to provide sequence length;
     use attrAlias to remap to an SQL expression if needed.
     """
+    chunkSize = 65536
+    maxChunks = 16
+    prefetchChunks = 4
 
     def _init_subclass(cls, db, **kwargs):
         db.seqInfoDict = db # db will act as its own seqInfoDict
+        db.cacheHint = SQLSequenceCacheHint(db)
         SQLRow._init_subclass(db=db, **kwargs)
     _init_subclass = classmethod(_init_subclass)
 
@@ -2860,12 +4217,70 @@ class SQLSequence(SQLRow, SequenceBase):
     def __len__(self):
         return self.length
 
-    def strslice(self, start, end):
-        "Efficient access to slice of a sequence, useful for huge contigs"
+    def _substring(self, start, end):
+        'query the database for the slice [start:end]'
         return self._select('%%(SUBSTRING)s(%s %%(SUBSTR_FROM)s %d \
                             %%(SUBSTR_FOR)s %d)' % (self.db._attrSQL('seq'),
                                                     start + 1, end - start))
 
+    def strslice(self, start, end, useCache=True):
+        "Efficient access to slice of a sequence, useful for huge contigs"
+        chunkSize = self.chunkSize
+        if not useCache or not chunkSize or end <= start:
+            return self._substring(start, end)
+        first = start // chunkSize
+        stop = (end - 1) // chunkSize + 1
+        if stop - first > self.maxChunks: # too big to cache
+            return self._substring(start, end)
+        offset = first * chunkSize
+        return ''.join(self._get_chunks(first, stop))[start - offset:
+                                                      end - offset]
+
+    def cache_interval(self, start, end):
+        'read the chunks covering [start:end] into our cache, in one query'
+        chunkSize = self.chunkSize
+        if chunkSize and start < end:
+            first = start // chunkSize
+            stop = min((end - 1) // chunkSize + 1, first + self.maxChunks)
+            self._get_chunks(first, stop, False)
+
+    def _get_chunks(self, first, stop, readAhead=True):
+        """get list of chunks first .. stop - 1, reading all missing ones
+        (plus prefetchChunks more, if continuing from the last access)
+        in one query"""
+        try:
+            chunks = self._chunks
+        except AttributeError:
+            chunks = self._chunks = {}
+            self._chunkQueue = [] # chunk numbers, least recently used first
+            self._lastChunk = None
+        queue = self._chunkQueue
+        missing = [i for i in range(first, stop) if i not in chunks]
+        if missing:
+            readStop = stop
+            if readAhead and self._lastChunk is not None and \
+                   self._lastChunk <= first <= self._lastChunk + 1:
+                readStop = min(stop + self.prefetchChunks,
+                               missing[0] + self.maxChunks)
+            chunkSize = self.chunkSize
+            s = self._substring(missing[0] * chunkSize, readStop * chunkSize)
+            for i in range(missing[0], readStop):
+                if i not in chunks:
+                    offset = (i - missing[0]) * chunkSize
+                    chunks[i] = s[offset:offset + chunkSize]
+                    queue.append(i)
+        l = []
+        for i in range(first, stop): # mark as most recently used
+            l.append(chunks[i])
+            if queue[-1] != i:
+                queue.remove(i)
+                queue.append(i)
+        if readAhead:
+            self._lastChunk = stop - 1
+        while len(queue) > self.maxChunks: # drop least recently used chunks
+            del chunks[queue.pop(0)]
+        return l
+
 
 class DNASQLSequence(SQLSequence):
     _seqtype=DNA_SEQTYPE
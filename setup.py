@@ -78,6 +78,8 @@ cdict_src = [os.path.join('pygr', 'cgraph.c'),
 nested_src = [os.path.join('pygr', 'intervaldb.c'),
               os.path.join('pygr', 'cnestedlist.%s' % ext),
               os.path.join('pygr', 'apps', 'maf2nclist.c')]
+graphquery_src = [os.path.join('pygr', 'graphmatch.c'),
+                  os.path.join('pygr', 'cgraphquery.%s' % ext)]
 
 
 def main():
@@ -99,6 +101,7 @@ def main():
             Extension('pygr.seqfmt', seqfmt_src),
             Extension('pygr.cdict', cdict_src),
             Extension('pygr.cnestedlist', nested_src),
+            Extension('pygr.cgraphquery', graphquery_src),
         ],
 
         cmdclass = cmdclass,
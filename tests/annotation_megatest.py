@@ -0,0 +1,94 @@
+"""
+Micro-benchmarks of AnnotationDB annotation object construction.
+"""
+
+import time
+import unittest
+
+from testlib import testutil, PygrTestProgram
+from pygr import logger
+from pygr import classutil
+from pygr.annotation import AnnotationDB, ArrayAnnotationDB
+from pygr.sequence import Sequence
+
+
+class SlowAnnotationDB(AnnotationDB):
+    'overriding getSliceAttr() disables the compiled sliceInfo getters'
+
+    def getSliceAttr(self, sliceInfo, attr):
+        return AnnotationDB.getSliceAttr(self, sliceInfo, attr)
+
+
+class AnnotationBenchmark_Test(unittest.TestCase):
+    nrows = 100000
+
+    def setUp(self):
+        self.seqDB = dict([('chr%d' % i, Sequence('ATGC' * 1000, 'chr%d' % i))
+                           for i in range(10)])
+        self.sliceDB = dict([(i, ('chr%d' % (i % 10), i % 3000,
+                                  i % 3000 + 100, 1 - 2 * (i % 2)))
+                             for i in xrange(self.nrows)])
+        self.attrs = dict(id=0, start=1, stop=2, orientation=3)
+
+    def time_build(self, db, bulk):
+        'return annotations built per second, bypassing the object cache'
+        keys = self.sliceDB.keys()
+        db.clear_cache()
+        start = time.time()
+        if bulk:
+            l = db.get_many(keys)
+        else:
+            l = [db[k] for k in keys]
+        return self.nrows / (time.time() - start), l
+
+    def test_get_many(self):
+        'AnnotationDB construction throughput'
+        db = AnnotationDB(self.sliceDB, self.seqDB, sliceAttrDict=self.attrs,
+                          autoGC=False)
+        slowDB = SlowAnnotationDB(self.sliceDB, self.seqDB,
+                                  sliceAttrDict=self.attrs, autoGC=False)
+        slow, l1 = self.time_build(slowDB, False)
+        fast, l2 = self.time_build(db, False)
+        bulk, l3 = self.time_build(db, True)
+        for a, b, c in zip(l1, l2, l3):
+            assert (a.id, a.sequence) == (b.id, b.sequence) == \
+                   (c.id, c.sequence)
+        logger.info('AnnotationDB: %d/sec with getSliceAttr(), %d/sec with \
+compiled getters, %d/sec with get_many()' % (slow, fast, bulk))
+
+    def time_iteration(self, sliceDB):
+        'return sliceInfo items iterated per second'
+        start = time.time()
+        n = 0
+        for k, sliceInfo in sliceDB.iteritems():
+            n += 1
+        assert n == self.nrows
+        return n / (time.time() - start)
+
+    def test_array_storage(self):
+        'shelve versus ArrayAnnotationDB sliceDB iteration'
+        shelf = classutil.open_shelve(testutil.tempdatafile('bench_shelve'),
+                                      'n')
+        arrayDB = ArrayAnnotationDB(testutil.tempdatafile('bench_array'), 'w',
+                                    sliceAttrDict=self.attrs)
+        for k, t in self.sliceDB.iteritems():
+            shelf[str(k)] = t
+            arrayDB[k] = t
+        shelf.close()
+        arrayDB.close()
+        shelf = classutil.open_shelve(testutil.tempdatafile('bench_shelve',
+                                                            False), 'r')
+        arrayDB = ArrayAnnotationDB(testutil.tempdatafile('bench_array',
+                                                          False))
+        try:
+            shelveRate = self.time_iteration(shelf)
+            arrayRate = self.time_iteration(arrayDB)
+        finally:
+            shelf.close()
+            arrayDB.close()
+        logger.info('sliceDB iteration: %d/sec from shelve, %d/sec from \
+ArrayAnnotationDB' % (shelveRate, arrayRate))
+
+
+if __name__ == '__main__':
+    PygrTestProgram(verbosity=2)
@@ -1,6 +1,8 @@
+import gc
+import threading
 import unittest
-from testlib import testutil, PygrTestProgram
-from pygr import sequence, seqdb, sequtil, annotation
+from testlib import testutil, PygrTestProgram, SkipTest
+from pygr import sequence, seqdb, sequtil, annotation, coordinator
 from pygr.sequence import Sequence
 from pygr.annotation import AnnotationDB
 
@@ -202,6 +204,61 @@ class AnnotationDB_Test(unittest.TestCase):
         y = db.sliceAnnotation(key, db.sliceDB[key])
         assert x == y
 
+    def test_get_many(self):
+        "AnnotationDB get_many"
+        db = self.db
+        a1 = db['annot1']
+        l = db.get_many(['annot2', 'annot1', 'annot2'])
+        assert l[1] is a1 # from cache
+        assert l[0] is l[2] and l[0] is db['annot2']
+        assert repr(l[0].sequence) == 'seq[5:9]'
+        try:
+            db.get_many(['annot1', 'foo'])
+            assert 0, 'should raise KeyError'
+        except KeyError:
+            pass
+
+    def test_max_cache(self):
+        "AnnotationDB maxCache evicts least recently used"
+        slicedb = dict([('a%02d' % i, ('seq', i, i + 2)) for i in range(12)])
+        sequence_dict = dict(seq = Sequence('ATGGGGCCGATTG', 'seq'))
+        db = AnnotationDB(slicedb, sequence_dict, maxCache=10,
+                          sliceAttrDict=dict(id=0, start=1, stop=2))
+        keys = sorted(slicedb)
+        l = [db[k] for k in keys[:10]]
+        assert db[keys[0]] is l[0] # now most recently used
+        db[keys[10]]
+        cache = db._weakValueDict
+        assert keys[0] in cache and keys[10] in cache
+        assert keys[1] not in cache and keys[2] not in cache
+        assert len(cache) == 9
+        stats = db.cache_stats()
+        assert stats['evictions'] == 2 and stats['hits'] == 1
+        assert stats['misses'] == 11
+
+    def test_slice_getters(self):
+        "AnnotationDB compiled sliceInfo getters"
+
+        class Annotation(object):
+
+            def __init__(self, *args):
+                self.args = args
+                self.name = args[0]
+
+            def __getitem__(self, i):
+                return self.args[i]
+
+        slicedb = dict(a=Annotation('seq', 2, 5, -1), b=Annotation('seq', 1, 4))
+        sequence_dict = dict(seq = Sequence('ATGGGGCCGATTG', 'seq'))
+        db = AnnotationDB(slicedb, sequence_dict,
+                          sliceAttrDict=dict(id='name', start=1, stop=2,
+                                             orientation=3))
+        assert repr(db['a'].sequence) == '-seq[2:5]'
+        assert repr(db['b'].sequence) == 'seq[1:4]' # no orientation
+        db.sliceAttrDict = dict(id='name', start=1, stop=2)
+        db.clear_cache()
+        assert repr(db['a'].sequence) == 'seq[2:5]' # getters recompiled
+
     def test_bad_seqdict(self):
         "AnnotationDB bad seqdict"
 
@@ -220,6 +277,401 @@ class AnnotationDB_Test(unittest.TestCase):
             pass
 
 
+class BulkLoad_Test(unittest.TestCase):
+    'AnnotationDB.bulk_load into dict, shelve and SQL sliceDBs'
+
+    def setUp(self):
+        self.seqDict = dict(seq=Sequence('ATGGGGCCGATTG', 'seq'))
+        self.items = [('a', ('seq', 0, 10, 1)), ('b', ('seq', 5, 9, -1)),
+                      ('c', ('seq', 4, 4, 1)), ('d', ('foo', 2, 4, 1))]
+        self.attrs = dict(id=0, start=1, stop=2, orientation=3)
+
+    def check_db(self, db, keys):
+        l = [(k, repr(db[k].sequence)) for k in keys]
+        assert l == [('a', 'seq[0:10]'), ('b', '-seq[5:9]')][:len(l)]
+
+    def test_dict(self):
+        'bulk_load into a dict'
+        db = AnnotationDB({}, self.seqDict, sliceAttrDict=self.attrs)
+        assert db.bulk_load(self.items, skipInvalid=True, bufferSize=1) == 2
+        assert len(db._weakValueDict) == 0 # nothing cached
+        assert sorted(db.keys()) == ['a', 'b']
+        self.check_db(db, 'ab')
+        assert db.bulk_load(self.items) == 4 # same as new_annotation()
+        assert db['c'] is None
+
+    def test_shelve(self):
+        'bulk_load into a shelve, building the interval index'
+        path = testutil.tempdatafile('bulkshelve')
+        db = AnnotationDB(None, self.seqDict, sliceAttrDict=self.attrs,
+                          filename=path, mode='cw')
+        db.bulk_load(self.items[:2], buildIndex=True)
+        assert [a.id for a in db.find('seq', 8, 9)] == ['a', 'b']
+        db.close()
+        db = AnnotationDB(None, self.seqDict, sliceAttrDict=self.attrs,
+                          filename=path, mode='r')
+        self.check_db(db, 'ab')
+        db.close()
+
+    def test_sql(self):
+        'bulk_load into an SQL table in one transaction'
+        if not testutil.sqlite_enabled():
+            raise SkipTest
+        from pygr.sqlgraph import SQLTable, SQLiteServerInfo
+
+        class SliceInfo(object):
+
+            def __init__(self, chrom, chromStart, chromEnd, strand):
+                self.chrom = chrom
+                self.chromStart = chromStart
+                self.chromEnd = chromEnd
+                self.strand = strand
+
+        serverInfo = SQLiteServerInfo(':memory:')
+        try:
+            sliceDB = SQLTable('annots', serverInfo=serverInfo,
+                               writeable=True, createTable='''\
+            CREATE TABLE annots (k VARCHAR(10) PRIMARY KEY, chrom VARCHAR(10),
+                  chromStart INTEGER, chromEnd INTEGER, strand INTEGER)''')
+            db = AnnotationDB(sliceDB, self.seqDict,
+                              sliceAttrDict=dict(id='chrom', start='chromStart',
+                                                 stop='chromEnd',
+                                                 orientation='strand'))
+            items = [(k, SliceInfo(*t)) for (k, t) in self.items]
+            assert db.bulk_load(items, skipInvalid=True) == 2
+            assert len(sliceDB) == 2
+            self.check_db(db, 'ab')
+            # tuple sliceInfo has no attributes to map onto the columns
+            db2 = AnnotationDB(sliceDB, self.seqDict, checkFirstID=False,
+                               sliceAttrDict=self.attrs)
+            self.assertRaises(ValueError, db2.bulk_load,
+                              [('e', ('seq', 1, 3, 1))])
+            assert len(sliceDB) == 2 and 'e' not in sliceDB
+        finally:
+            serverInfo.close()
+
+
+class SeqIDResolver_Test(unittest.TestCase):
+    'bounded caches of SeqIDResolver'
+
+    def test_bounds(self):
+        'evict least recently used IDs, and do not keep sequences alive'
+
+        class SeqFactory(object):
+
+            def __getitem__(self, k):
+                return Sequence('ATGGGGCCGATTG', k)
+
+        class Resolver(annotation.SeqIDResolver):
+            maxCache = 3
+
+        resolver = Resolver(SeqFactory())
+        for seq_id in ('1', u'seq', 2.0, 'seq2'):
+            resolver.key(seq_id)
+        assert resolver.key('1') == 1 # evicted, so normalized again
+        assert len(resolver.keys) == 3 and resolver.keys.evictions == 2
+        assert resolver.key('seq2') == 'seq2' and resolver.keys.hits == 1
+        seq = resolver['seq']
+        assert resolver['seq'] is seq
+        resolver['a'] # not kept alive
+        gc.collect() # a Sequence is its own path, a reference cycle
+        assert resolver.seqs.keys() == ['seq']
+        del seq
+        gc.collect()
+        assert len(resolver.seqs) == 0
+
+
+class AnnotationIndex_Test(unittest.TestCase):
+    'interval index queries on AnnotationDB'
+
+    def setUp(self):
+        self.sliceDB = dict(a=('seq', 0, 10, 1), b=('seq', 5, 9, -1),
+                            c=('seq', 2, 4, 1), d=('seq2', 3, 8, 1))
+        self.seqDict = dict(seq=Sequence('ATGGGGCCGATTG', 'seq'),
+                            seq2=Sequence('ATGGGGCCGATTG', 'seq2'))
+        self.attrs = dict(id=0, start=1, stop=2, orientation=3)
+
+    def test_find(self):
+        'find() and overlapping() use the interval index'
+        db = AnnotationDB(self.sliceDB, self.seqDict,
+                          sliceAttrDict=self.attrs)
+        assert [a.id for a in db.find('seq', 3, 6)] == ['a', 'c', 'b']
+        assert [a.id for a in db.find('seq', 9, 13)] == ['a']
+        assert db.find('seq', 10, 13) == []
+        assert db.find('seq3', 0, 10) == []
+        a = db.find('seq', 0, 1)[0]
+        assert a is db['a'] # uses the annotation cache
+        assert [a.id for a in db.overlapping(self.seqDict['seq2'][:4])] \
+               == ['d']
+        assert [a.id for a in db.overlapping(-self.seqDict['seq'][8:9])] \
+               == ['a', 'b']
+
+    def test_new_annotation(self):
+        'new annotations are added to the index incrementally'
+        db = AnnotationDB(self.sliceDB, self.seqDict,
+                          sliceAttrDict=self.attrs)
+        index = db.build_interval_index()
+        index.maxPending = 2
+        db.new_annotation('e', ('seq', 11, 12, 1))
+        db.new_annotation('f', ('seq3', 0, 5, 1)) # seq3 is not in seqDict
+        assert [a.id for a in db.find('seq', 9, 13)] == ['a', 'e']
+        assert index._pending['seq']
+        db.new_annotation('g', ('seq', 1, 2, -1))
+        db.new_annotation('h', ('seq', 6, 7, 1))
+        assert 'seq' not in index._pending # merged into nested list
+        assert [a.id for a in db.find('seq', 1, 7)] == ['a', 'g', 'c', 'b',
+                                                         'h']
+
+    def test_replace(self):
+        'a re-added annotation is only found at its new interval'
+        path = testutil.tempdatafile('annotindex-replace')
+        db = AnnotationDB(self.sliceDB, self.seqDict,
+                          sliceAttrDict=self.attrs, indexPath=path)
+        index = db.build_interval_index()
+        index.maxPending = 1
+        db.new_annotation('a', ('seq', 11, 13, 1))
+        assert [a.id for a in db.find('seq', 3, 6)] == ['c', 'b']
+        assert [a.id for a in db.find('seq', 11, 12)] == ['a']
+        db.new_annotation('e', ('seq', 0, 1, 1))
+        db.new_annotation('a', ('seq2', 0, 2, 1)) # merged nested list
+        assert 'seq' not in index._pending
+        assert [a.id for a in db.find('seq', 0, 13)] == ['e', 'c', 'b']
+        assert [a.id for a in db.find('seq2', 0, 4)] == ['a', 'd']
+        db.close()
+        index = db.build_interval_index() # reopen the saved index
+        assert None in index.annotIDs # replaced entries: not rebuilt
+        assert index.find('seq', 0, 13) == ['e', 'c', 'b']
+        assert index.find('seq2', 0, 4) == ['a', 'd']
+        db.close()
+
+    def test_merge_levels(self):
+        'merging pending intervals keeps a few nested list levels'
+        self.seqDict['seq'] = Sequence('ATGC' * 30, 'seq')
+        db = AnnotationDB(self.sliceDB, self.seqDict,
+                          sliceAttrDict=self.attrs)
+        index = db.build_interval_index()
+        index.maxPending = 1
+        for i in range(100):
+            db.new_annotation(i, ('seq', i, i + 2, 1))
+        assert len(index._sizes['seq']) <= 8
+        assert sum(index._sizes['seq']) + len(index._pending.get('seq', ())) \
+               == 103
+        assert [a.id for a in db.find('seq', 9, 11)] == ['a', 8, 9, 10]
+        assert [a.id for a in db.find('seq', 99, 120)] == [98, 99]
+
+    def test_overlapping_prefix(self):
+        'overlapping() gets the seqDB key of a PrefixUnionDict sequence'
+        seqDB = seqdb.SequenceFileDB(testutil.datafile('dnaseq.fasta'))
+        try:
+            pud = seqdb.PrefixUnionDict({'dna': seqDB})
+            sliceDB = dict(a=('dna.seq1', 0, 10, 1), b=('dna.seq2', 5, 9, 1))
+            db = AnnotationDB(sliceDB, pud, sliceAttrDict=self.attrs)
+            assert [a.id for a in db.overlapping(pud['dna.seq2'][:6])] \
+                   == ['b']
+            assert [a.id for a in db.overlapping(-seqDB['seq1'][8:20])] \
+                   == ['a']
+        finally:
+            seqDB.close()
+
+    def test_index_file(self):
+        'save the interval index to disk and reopen it'
+        path = testutil.tempdatafile('annotindex')
+        db = AnnotationDB(self.sliceDB, self.seqDict,
+                          sliceAttrDict=self.attrs, indexPath=path)
+        assert [a.id for a in db.find('seq', 3, 6)] == ['a', 'c', 'b']
+        db.new_annotation('e', ('seq2', 0, 5, 1))
+        db.close()
+        index = db.build_interval_index() # reopen the saved index
+        assert index._pending['seq2'] # not rebuilt from sliceDB
+        assert index.find('seq2', 4, 5) == ['e', 'd']
+        assert index.find('seq', 0, 1) == ['a']
+        db.close()
+
+    def test_stale_index_file(self):
+        'a saved index is rebuilt if sliceDB has changed'
+        path = testutil.tempdatafile('annotindex-stale')
+        db = AnnotationDB(self.sliceDB, self.seqDict,
+                          sliceAttrDict=self.attrs, indexPath=path)
+        db.new_annotation('e', ('seq2', 0, 5, 1))
+        db.close()
+        del db.sliceDB['a'] # fewer annotations
+        index = db.build_interval_index()
+        assert 'seq2' not in index._pending # rebuilt from sliceDB
+        assert index.find('seq', 0, 1) == []
+        assert index.find('seq2', 4, 5) == ['e', 'd']
+        k = [k for k in index.annotIDs if k is not None][-1]
+        db.close()
+        del db.sliceDB[k] # same number, but the last one indexed is gone
+        db.sliceDB['f'] = ('seq', 0, 1, 1)
+        index = db.build_interval_index()
+        assert index.find('seq', 0, 1) == ['f']
+        assert k not in index.annotIDs
+        db.close()
+
+
+class ArrayAnnotationDB_Test(unittest.TestCase):
+    'ArrayAnnotationDB binary sliceDB storage'
+
+    def setUp(self):
+        self.path = testutil.tempdatafile('annotarray', False)
+        self.seqDict = dict(seq=Sequence('ATGGGGCCGATTG', 'seq'),
+                            seq2=Sequence('ATGGGGCCGATTG', 'seq2'))
+        self.attrs = dict(id=0, start=1, stop=2, orientation=3, name=4)
+        sliceDB = annotation.ArrayAnnotationDB(self.path, 'w', ('name', ),
+                                               self.attrs, chunkSize=2)
+        db = AnnotationDB(sliceDB, self.seqDict, sliceAttrDict=self.attrs)
+        for k, t in (('a', ('seq', 0, 10, 1, 'gene a')),
+                     ('b', ('seq', 5, 9, -1, 'gene b')),
+                     ('c', ('seq2', 2, 4, 1, 'gene c'))):
+            db.new_annotation(k, t)
+        assert db['b'].name == 'gene b'
+        assert db.close() # saved to disk
+
+    def test_reopen(self):
+        'reopen ArrayAnnotationDB from disk'
+        sliceDB = annotation.ArrayAnnotationDB(self.path, chunkSize=2)
+        db = AnnotationDB(sliceDB, self.seqDict, sliceAttrDict=self.attrs)
+        assert len(db) == 3 and 'c' in db and 'd' not in db
+        assert repr(db['b'].sequence) == '-seq[5:9]'
+        assert db['c'].name == 'gene c'
+        l = [(k, repr(a.sequence), a.name) for (k, a) in db.iteritems()]
+        assert l == [('a', 'seq[0:10]', 'gene a'), ('b', '-seq[5:9]', 'gene b'),
+                     ('c', 'seq2[2:4]', 'gene c')]
+        chunks = [[list(c) for c in chunk] for chunk in sliceDB.iter_arrays()]
+        assert chunks == [[['a', 'b'], ['seq', 'seq'], [0, 5], [10, 9],
+                           [1, -1]], [['c'], ['seq2'], [2], [4], [1]]]
+        try:
+            sliceDB['d'] = ('seq', 1, 2)
+            assert 0, 'should raise ValueError'
+        except ValueError:
+            pass
+        sliceDB.close()
+
+    def test_pickle(self):
+        'pickle ArrayAnnotationDB'
+        import pickle
+        sliceDB = annotation.ArrayAnnotationDB(self.path)
+        db = AnnotationDB(sliceDB, self.seqDict)
+        db2 = pickle.loads(pickle.dumps(db)) # also works without aliases
+        assert db2.sliceDB.filestem == self.path
+        assert repr(db2['a'].sequence) == 'seq[0:10]'
+        db2.sliceDB.close()
+        sliceDB.close()
+
+    def test_attr_order(self):
+        'several extra attrs keep their own values'
+        attrs = dict(id=0, start=1, stop=2, name=3, type=4, score=5)
+        sliceDB = annotation.ArrayAnnotationDB(self.path, 'w',
+                                               ('name', 'type', 'score'),
+                                               attrs)
+        db = AnnotationDB(sliceDB, self.seqDict, sliceAttrDict=attrs)
+        db.new_annotation('a', ('seq', 0, 10, 'gene a', 'exon', 7))
+        db.new_annotation('b', ('seq2', 2, 4, 'gene b', 'intron', 3))
+        db.new_annotation('a', ('seq', 0, 8, 'gene a2', 'utr', 5))
+        assert db.close()
+        sliceDB = annotation.ArrayAnnotationDB(self.path)
+        db = AnnotationDB(sliceDB, self.seqDict, sliceAttrDict=attrs)
+        l = [(a.name, a.type, a.score) for a in db.itervalues()]
+        assert l == [('gene a2', 'utr', 5), ('gene b', 'intron', 3)]
+        sliceDB.close()
+
+
+class AnnotationServer_Test(unittest.TestCase):
+    'AnnotationServer with an SQL sliceDB'
+
+    def setUp(self):
+        if not testutil.sqlite_enabled():
+            raise SkipTest
+        from pygr.sqlgraph import SQLTable, SQLiteServerInfo
+        self.serverInfo = SQLiteServerInfo(':memory:')
+        self.sliceDB = SQLTable('annots', serverInfo=self.serverInfo,
+                                writeable=True, createTable='''\
+        CREATE TABLE annots (k VARCHAR(10) PRIMARY KEY, chrom VARCHAR(10),
+              chromStart INTEGER, chromEnd INTEGER, strand INTEGER)''')
+        for k, start, stop, strand in (('a', 0, 10, 1), ('b', 5, 9, -1),
+                                       ('c', 2, 4, 1)):
+            self.sliceDB.new(id=k, chrom='seq', chromStart=start,
+                             chromEnd=stop, strand=strand)
+        self.seqDict = dict(seq=Sequence('ATGGGGCCGATTG', 'seq'))
+
+    def tearDown(self):
+        self.serverInfo.close()
+
+    def test_slice_items(self):
+        'get_slice_items() matches get_slice_tuple()'
+        for attrs, b in ((dict(orientation='strand'), ('seq', -9, -5)),
+                         ({}, ('seq', 5, 9))): # no orientation column
+            attrs.update(id='chrom', start='chromStart', stop='chromEnd')
+            db = annotation.AnnotationServer(self.sliceDB, self.seqDict,
+                                             sliceAttrDict=attrs)
+            l = db.get_slice_items()
+            l.sort()
+            assert l == [(k, db.get_slice_tuple(k)) for k in 'abc']
+            assert l[1] == ('b', b)
+
+
+class AnnotationClient_Test(unittest.TestCase):
+    'batched AnnotationClient access to an AnnotationServer over XMLRPC'
+
+    def setUp(self):
+        sliceDB = dict([('a%02d' % i, ('seq', i, i + 3, 'gene%d' % i))
+                        for i in range(25)])
+        seqDict = dict(seq=Sequence('ATGGGGCCGATTGATGGGGCCGATTGATGGGG', 'seq'))
+        self.annodb = annotation.AnnotationServer(sliceDB, seqDict,
+                             sliceAttrDict=dict(id=0, start=1, stop=2, name=3))
+        self.server = coordinator.XMLRPCServerBase('test', host='localhost',
+                                                   port=0)
+        self.server['annots'] = self.annodb
+        self.thread = threading.Thread(target=self.server.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://localhost:%d' % self.server.port
+        self.db = annotation.AnnotationClient(self.url, 'annots', seqDict,
+                                              batchSize=10)
+        self.calls = []
+        for name in ('get_slice_tuples', 'get_annotation_attrs',
+                     'iter_slice_items'):
+            self.record_calls(name)
+
+    def record_calls(self, name):
+        'record how many calls to the named server method we make'
+        m = getattr(self.db.server, name)
+        def f(*args):
+            self.calls.append(name)
+            return m(*args)
+        setattr(self.db.server, name, f)
+
+    def tearDown(self):
+        self.server.server.shutdown()
+        self.thread.join()
+        self.server.server.server_close()
+        del coordinator.get_connection[self.url]
+
+    def test_iteritems(self):
+        'AnnotationClient iteration in pages'
+        l = [(k, a.sequence.start) for (k, a) in self.db.iteritems()]
+        l.sort()
+        assert l == [('a%02d' % i, i) for i in range(25)]
+        assert self.calls == ['iter_slice_items'] * 3
+        l = self.annodb.iter_slice_items(20, 10) # new scan from offset
+        assert l == self.annodb.get_slice_items()[20:]
+
+    def test_getitem(self):
+        'AnnotationClient coalesces sliceInfo and attribute misses'
+        keys = self.db.keys()
+        names = [self.db[k].name for k in keys]
+        assert names == [self.annodb[k].name for k in keys]
+        assert self.calls == ['get_slice_tuples', 'get_annotation_attrs'] * 3
+        self.db.clear_cache()
+        self.db.prefetch(keys[:5], ['name'])
+        assert self.db[keys[4]].name == self.annodb[keys[4]].name
+        assert len(self.calls) == 8
+        try:
+            self.db['foo']
+            assert 0, 'should raise KeyError'
+        except KeyError:
+            pass
+
+
 class Translation_Test(unittest.TestCase):
 
     def setUp(self):
@@ -233,6 +685,26 @@ class Translation_Test(unittest.TestCase):
         assert sequtil.translate_orf(str(db['methionine'])) == 'M'
         assert sequtil.translate_orf(str(db['flim'])) == 'FLIM'
 
+    def test_translate_codes(self):
+        'lower case, RNA, degenerate and partial codons'
+        assert sequtil.translate_orf('atgttu') == 'MF'
+        assert sequtil.translate_orf('GGNTTYCTNTAA') == 'GFL*'
+        assert sequtil.translate_orf('ATGNNNTTTA') == 'MXFX'
+        assert sequtil.translate_orf('AT') == 'X'
+        assert sequtil.translate_orf('A-GTTT') == 'XF'
+        assert sequtil.translate_orf('') == ''
+
+    def test_reverse_complement(self):
+        assert sequtil.reverse_complement('AACGTN') == 'NACGTT'
+        assert sequtil.reverse_complement('acgu') == 'acgt'
+        assert str(-self.FLIM) == 'CATAATTAGAAA'
+
+    def test_guess_seqtype(self):
+        assert sequtil.guess_seqtype('ATGCNNatgc') == sequtil.DNA_SEQTYPE
+        assert sequtil.guess_seqtype('MKLVFLIM') == sequtil.PROTEIN_SEQTYPE
+        assert sequtil.guess_seqtype(buffer('ACGUACGU')) == \
+               sequtil.RNA_SEQTYPE
+
     def test_translation_db(self):
         aa_db = annotation.AnnotationDB({}, self.db,
                           itemClass=annotation.TranslationAnnot,
@@ -3,6 +3,8 @@ Test some of the basics underpinning the graph system.
 """
 
 import os
+import pickle
+import sys
 import unittest
 
 from testlib import testutil, PygrTestProgram, SkipTest
@@ -84,6 +86,19 @@ class Query_Test(unittest.TestCase):
         result.sort()
         for i in range(len(l)):
             assert l[i] == result[i], 'incorrect result'
+        l = [d.copy() for d in graphquery.GraphQuery(datagraph, querygraph,
+                                                     stats=True)]
+        l.sort()
+        assert l == result, 'incorrect result from planned query'
+        try: # COMPILED MATCHER MUST FIND THE SAME MATCHES
+            from pygr import cgraphquery
+        except ImportError:
+            return
+        gq = graphquery.GraphQuery(datagraph, querygraph)
+        compiled = gq.compile(compilerClass=graphquery.GraphQueryVF2)
+        l = list(compiled.run(datagraph))
+        l.sort()
+        assert l == result, 'incorrect compiled result'
 
     def test_basicquery_test(self):
         "Basic query"
@@ -159,6 +174,319 @@ class Query_Test(unittest.TestCase):
         self.dqcmp(datagraph, querygraph, result)
 
 
+class GraphQueryPlan_Test(unittest.TestCase):
+    'query planning and the compiled query cache'
+
+    def setUp(self):
+        self.datagraph = dict([(i, dict([(j, j % 10) for j in range(20)
+                                          if j != i]))
+                               for i in range(20)])
+
+    def test_plan(self):
+        'selective filters and closures go first'
+        querygraph = {0: {1: None, 2: dict(filter=lambda edge, **kw:
+                                               edge == 3)},
+                      1: {2: None}, 2: {}}
+        gq = graphquery.GraphQuery(self.datagraph, querygraph)
+        assert [(g.fromNode, g.queryNode) for g in gq.q] == \
+               [(None, 0), (0, 1), (0, 2), (1, 2)]
+        l1 = [d.copy() for d in gq]
+        stats = graphquery.GraphStats(self.datagraph, sampleSize=10)
+        assert stats.nodeCount == 20 and stats.avgDegree == 19.
+        gq = graphquery.GraphQuery(self.datagraph, querygraph, stats=stats)
+        assert [(g.fromNode, g.queryNode) for g in gq.q] == \
+               [(None, 0), (0, 2), (0, 1), (1, 2)]
+        l2 = [d.copy() for d in gq]
+        l1.sort()
+        l2.sort()
+        assert len(l1) == 684 and l1 == l2
+
+    def test_compiled_cache(self):
+        'compilers of the same query structure share one function'
+        cache = graphquery.compiledQueries
+        querygraph = {0: {1: None}, 1: {}}
+        gq = graphquery.GraphQuery(self.datagraph, querygraph)
+        c1 = gq.compile()
+        l1 = [dict(d.items()) for d in c1.run(self.datagraph)]
+        hits = cache.hits
+        c2 = graphquery.GraphQuery(self.datagraph, querygraph).compile()
+        l2 = [dict(d.items()) for d in c2.run(self.datagraph)]
+        assert cache.hits == hits + 1
+        assert c1._compiled[c1.name] is c2._compiled[c2.name]
+        assert len(l1) == 380 and l1 == l2
+        c3 = gq.compile(globals={}) # COMPILED IN USER'S NAMESPACE
+        c3.compile()
+        assert cache.hits == hits + 1
+        assert c3._compiled[c3.name] is not c1._compiled[c1.name]
+
+    def test_cache_lru(self):
+        'least recently used functions are evicted'
+        cache = graphquery.CompiledQueryCache(maxSize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        assert cache['a'] == 1
+        cache['c'] = 3
+        assert 'b' not in cache and 'a' in cache and 'c' in cache
+        self.assertRaises(KeyError, cache.__getitem__, 'b')
+        assert cache.stats() == dict(size=2, hits=1, misses=1, evictions=1)
+
+
+class GraphQueryParallel_Test(unittest.TestCase):
+    'run_parallel() in forked worker processes'
+
+    def setUp(self):
+        if not hasattr(os, 'fork'):
+            raise SkipTest('os.fork() not available')
+        nodes = [Node(i) for i in range(12)]
+        self.datagraph = dict([(a, dict([(b, (a.id, b.id)) for b in nodes
+                                         if (b.id - a.id) % 12 in (1, 2, 3)]))
+                               for a in nodes])
+        self.querygraph = {0: {1: None, 2: None}, 1: {2: None}, 2: {}}
+        gq = graphquery.GraphQuery(self.datagraph, self.querygraph)
+        self.result = self.sort_matches([d.copy() for d in gq])
+        assert len(self.result) == 36
+
+    def sort_matches(self, l):
+        'sort by node IDs, since Node objects are not ordered'
+        l = [(sorted([(k, v.id) for (k, v) in d.items() if k in (0, 1, 2)]),
+              d) for d in l]
+        l.sort()
+        return [d for (k, d) in l]
+
+    def check_matches(self, l, sameEdges):
+        'same nodes (not copies) as the data graph'
+        l = self.sort_matches(l)
+        assert len(l) == len(self.result)
+        for d1, d2 in zip(l, self.result):
+            for k in (0, 1, 2):
+                assert d1[k] is d2[k]
+            for k in ((0, 1), (0, 2), (1, 2)):
+                assert d1[k] == d2[k]
+                assert (d1[k] is d2[k]) == sameEdges
+
+    def test_parallel(self):
+        'parallel GraphQuery iterator'
+        gq = graphquery.GraphQuery(self.datagraph, self.querygraph)
+        self.check_matches(gq.run_parallel(3, batchSize=5), False)
+        self.check_matches(gq.run_parallel(1), True) # NOT FORKED
+
+    def test_compiled(self):
+        'parallel GraphQueryVF2'
+        try:
+            from pygr import cgraphquery
+        except ImportError:
+            raise SkipTest('cgraphquery extension not built')
+        gq = graphquery.GraphQuery(self.datagraph, self.querygraph)
+        self.check_matches(gq.run_parallel(4, batchSize=5, compiled=True),
+                           True)
+
+    def test_errors(self):
+        'worker exceptions are raised; closing stops the workers'
+
+        def bad_filter(toNode, **kwargs):
+            if toNode.id == 7:
+                raise ZeroDivisionError
+            return True
+        querygraph = {0: {1: dict(filter=bad_filter)}, 1: {}}
+        gq = graphquery.GraphQuery(self.datagraph, querygraph)
+        self.assertRaises(ZeroDivisionError, list, gq.run_parallel(2))
+        gq = graphquery.GraphQuery(self.datagraph, self.querygraph)
+        it = gq.run_parallel(2, batchSize=1)
+        it.next()
+        it.close()
+
+
+class GraphQueryVF2_Test(unittest.TestCase):
+    'compiled matcher on graph snapshots'
+
+    def setUp(self):
+        try:
+            from pygr import cgraphquery
+        except ImportError:
+            raise SkipTest('cgraphquery extension not built')
+        self.datagraph = {'a': {'b': 1, 'c': 2}, 'b': {'c': 3, 'b': 4},
+                          'c': {'a': 5}}
+
+    def run_query(self, querygraph, **kwargs):
+        gq = graphquery.GraphQuery(self.datagraph, querygraph)
+        compiled = gq.compile(compilerClass=graphquery.GraphQueryVF2,
+                              **kwargs)
+        snapshot = mapping.CSRGraph(self.datagraph)
+        l = list(compiled.run(snapshot))
+        l.sort()
+        return l
+
+    def test_snapshot(self):
+        'snapshot arrays'
+        snapshot = mapping.CSRGraph(self.datagraph)
+        assert len(snapshot) == 3
+        for node, targets in self.datagraph.items():
+            i = snapshot.nodeIndex[node]
+            l = [(snapshot.nodes[snapshot.outTarget[j]],
+                  snapshot.edge_value(j))
+                 for j in range(snapshot.outStart[i], snapshot.outStart[i + 1])]
+            assert sorted(l) == sorted(targets.items())
+            l = [snapshot.nodes[snapshot.inSource[j]]
+                 for j in range(snapshot.inStart[i], snapshot.inStart[i + 1])]
+            assert sorted(l) == sorted([k for (k, d) in
+                                        self.datagraph.items() if node in d])
+
+    def test_edges(self):
+        'edge values, self loops and triangles'
+        assert self.run_query({0: {0: None}}) == [{0: 'b', (0, 0): 4}]
+        l = self.run_query({0: {1: None}, 1: {2: None}, 2: {0: None}})
+        assert len(l) == 3
+        assert {0: 'a', 1: 'b', 2: 'c', (0, 1): 1, (1, 2): 3,
+                (2, 0): 5} in l
+        # ORDER DOES NOT CHANGE THE MATCHES
+        assert self.run_query({0: {1: None}, 1: {2: None}, 2: {0: None}},
+                              order=[2, 0, 1]) == l
+
+    def test_filter(self):
+        'filter callbacks see the partial queryMatch'
+        seen = []
+
+        def edge_filter(toNode, fromNode, edge, queryMatch, gqi):
+            seen.append(queryMatch[gqi.fromNode] == fromNode)
+            return edge > 1
+        l = self.run_query({0: {1: dict(filter=edge_filter)}, 1: {}})
+        assert [(d[0], d[1]) for d in l] == [('a', 'c'), ('b', 'c'),
+                                             ('c', 'a')]
+        assert seen and False not in seen
+
+        def bad_filter(**kwargs):
+            raise ZeroDivisionError
+        self.assertRaises(ZeroDivisionError, self.run_query,
+                          {0: {1: dict(filter=bad_filter)}, 1: {}})
+
+    def test_unsupported(self):
+        'attr queries are not supported'
+        self.assertRaises(ValueError, self.run_query,
+                          {0: {1: dict(attr='x')}, 1: {}})
+
+    def test_matcher_lifetime(self):
+        'CSRGraph cannot be closed or saved while a matcher uses it'
+        import gc
+        tmp = testutil.TempDir('csrgraph-matcher-test')
+        filestem = tmp.subfile('graph')
+        snapshot = mapping.CSRGraph(self.datagraph)
+        gq = graphquery.GraphQuery(self.datagraph, {0: {1: None}, 1: {}})
+        compiled = gq.compile(compilerClass=graphquery.GraphQueryVF2)
+        matcher = compiled.matcher(snapshot)
+        self.assertRaises(ValueError, snapshot.save, filestem)
+        del matcher
+        gc.collect()
+        snapshot.save(filestem)
+        matcher = compiled.matcher(~snapshot) # SHARES OUR MMAP
+        self.assertRaises(ValueError, snapshot.close)
+        self.assertRaises(ValueError, snapshot.save, filestem)
+        n = len(list(matcher))
+        del matcher
+        gc.collect()
+        snapshot.save(filestem) # REPLACES THE FILE WE HAVE MAPPED
+        assert len(list(compiled.run(snapshot))) == n == 4
+        snapshot.close()
+
+
+class CSRGraph_Test(Query_Test):
+    "Run queries on CSRGraph, and test its mapping interface"
+
+    def update_graph(self, datagraph):
+        return mapping.CSRGraph(datagraph)
+
+    def setUp(self):
+        self.graph = {'a': {'b': 1, 'c': 2}, 'b': {'c': 3, 'b': 4},
+                      'c': {'a': 5}, 'd': {}}
+
+    def check_graph(self, g, graph):
+        assert len(g) == len(graph)
+        assert sorted(g) == sorted(graph)
+        assert g == graph
+        for node, d in graph.items():
+            assert node in g
+            assert sorted(g[node].items()) == sorted(d.items())
+            assert len(g[node]) == len(d)
+            for target, edge in d.items():
+                assert target in g[node]
+                assert g[node][target] == edge
+            assert 'z' not in g[node]
+            self.assertRaises(KeyError, g[node].__getitem__, 'z')
+        assert 'z' not in g
+        self.assertRaises(KeyError, g.__getitem__, 'z')
+        l = [(source, target, edge) for (source, d) in graph.items()
+             for (target, edge) in d.items()]
+        assert sorted(g.edges()) == sorted(l)
+
+    def test_mapping(self):
+        'read-only mapping interface and edge value packing'
+        g = mapping.CSRGraph(self.graph)
+        self.check_graph(g, self.graph)
+        assert g.edgeValues.typecode == 'i'
+        g = mapping.CSRGraph(self.graph, edgeValues=False)
+        assert g.edgeValues is None
+        assert g['a']['b'] is None
+        graph = {'a': {'b': 'x', 'c': None}, 'b': {}, 'c': {'c': 1.5}}
+        g = mapping.CSRGraph(graph)
+        assert isinstance(g.edgeValues, list)
+        self.check_graph(g, graph)
+        graph = {'a': {'b': 0.5, 'c': 2.5}, 'b': {}, 'c': {}}
+        assert mapping.CSRGraph(graph).edgeValues.typecode == 'd'
+        graph = {'a': {'b': 1, 'c': 2.5}, 'b': {}, 'c': {}} # NOT ALL FLOAT
+        g = mapping.CSRGraph(graph)
+        assert isinstance(g.edgeValues, list)
+        assert repr(g['a']['b']) == '1'
+        big = sys.maxint
+        graph = {'a': {'b': big, 'c': 1}, 'b': {}, 'c': {}} # NOT C int
+        g = mapping.CSRGraph(graph)
+        assert g['a']['b'] == big and type(g['a']['b']) is int
+        assert g['a']['b'] == graph['a']['b']
+        self.check_graph(g, graph)
+
+    def test_build(self):
+        'build from dictGraph and Graph'
+        for graph in (mapping.dictGraph(), mapping.Graph()):
+            for node, d in self.graph.items():
+                graph += node
+                for target, edge in d.items():
+                    graph[node][target] = edge
+            self.check_graph(mapping.CSRGraph(graph), self.graph)
+
+    def test_invert(self):
+        'inverse graph shares our arrays'
+        g = mapping.CSRGraph(self.graph)
+        inverse = {}
+        for node, d in self.graph.items():
+            inverse.setdefault(node, {})
+            for target, edge in d.items():
+                inverse.setdefault(target, {})[node] = edge
+        self.check_graph(~g, inverse)
+        assert ~g is ~g
+        assert ~~g is g
+
+    def test_save(self):
+        'save to disk, open via mmap, and pickle'
+        tmp = testutil.TempDir('csrgraph-test')
+        filestem = tmp.subfile('graph')
+        g = mapping.CSRGraph(self.graph)
+        self.assertRaises(ValueError, pickle.dumps, g)
+        g.save(filestem)
+        assert isinstance(g.outTarget, mapping.MappedArray)
+        self.check_graph(g, self.graph)
+        g2 = mapping.CSRGraph(filestem=filestem)
+        self.check_graph(g2, self.graph)
+        g3 = pickle.loads(pickle.dumps(g2))
+        self.check_graph(g3, self.graph)
+        (~g3).save(filestem + 'inv') # SAVE INVERSE AS A NEW GRAPH
+        g4 = mapping.CSRGraph(filestem=filestem + 'inv')
+        assert ~g4 == g3
+        graph = {'a': {'b': 'x', 'c': None}, 'b': {}, 'c': {'c': 1.5}}
+        g = mapping.CSRGraph(graph)
+        g.save(filestem)
+        self.check_graph(mapping.CSRGraph(filestem=filestem), graph)
+        for g in (g, g2, g3, g4):
+            g.close()
+
+
 class Mapping_Test(Query_Test):
     "Tests mappings"
 
@@ -318,7 +646,89 @@ class SQLGraph_DB_Test(Mapping_Test):
         self.datagraph.cursor.execute('drop table if exists %s' % self.dbname)
 
 
-class SQLiteGraph_Test(testutil.SQLite_Mixin, Mapping_Test):
+class SQLGraphBatch_Mixin(object):
+    'tests of batched edge loading, for SQLGraph test classes'
+
+    def test_neighbors_many(self):
+        'neighbors_many, load_edges and chunked iteritems'
+        datagraph = self.datagraph
+        graphvals = self.node_graph({1: {2: None, 3: None}, 2: {3: None},
+                                     3: {}, 4: {1: None}})
+        for i in graphvals:
+            datagraph += i
+            for n in graphvals[i]:
+                datagraph[i] += n
+        nodes = [self.get_node(i) for i in (4, 1, 3)]
+        l = datagraph.neighbors_many(nodes)
+        assert len(l) == len(nodes)
+        for node, d in zip(nodes, l):
+            assert d == datagraph[node]
+            assert d.keys() == datagraph[node].keys()
+        cursor = datagraph.cursor
+        datagraph.cursor = None # loaded edges are looked up without a query
+        try:
+            d = l[1] # edges of node 1
+            assert d[self.get_node(2)] is None
+            assert self.get_node(3) in d and self.get_node(4) not in d
+            try:
+                d[self.get_node(4)]
+                raise AssertionError('failed to raise KeyError')
+            except KeyError:
+                pass
+        finally:
+            datagraph.cursor = cursor
+        d = datagraph[self.get_node(1)] # no edges loaded, so query
+        assert self.get_node(3) in d and self.get_node(4) not in d
+        ids = [datagraph.pack_source(self.get_node(i)) for i in (1, 3)]
+        d = datagraph.load_edges(ids)
+        assert set([t for t, e in d[ids[0]]]) == set(self.node_list([2, 3]))
+        assert d[ids[1]] == []
+        assert dict(datagraph.iteritems(chunk=2)) == graphvals
+        assert len(list(datagraph.itervalues(chunk=3))) == 4
+        try:
+            datagraph.neighbors_many([self.get_node(5)])
+            raise AssertionError('failed to raise KeyError')
+        except KeyError:
+            pass
+
+
+    def test_bulk_writer(self):
+        'buffered node and edge writes'
+        datagraph = self.datagraph
+        graphvals = self.node_graph({1: {2: None, 3: None}, 2: {3: None},
+                                     3: {}, 4: {1: None}})
+        w = datagraph.bulk_writer()
+        try:
+            for i in graphvals:
+                datagraph += i
+                datagraph += i # must not duplicate the node
+                for n in graphvals[i]:
+                    datagraph[i] += n
+            assert len(datagraph) == 0 # nothing saved yet
+        finally:
+            w.close()
+        assert len(datagraph) == 4
+        assert datagraph == graphvals
+
+    def test_bulk_writer_delete(self):
+        'deletes see the edges and nodes buffered before them'
+        datagraph = self.datagraph
+        a, b, c = self.node_list([1, 2, 3])
+        w = datagraph.bulk_writer()
+        try:
+            datagraph += a
+            datagraph[a][b] = None
+            del datagraph[a][b] # must not raise KeyError
+            datagraph[a][c] = None
+            datagraph += b
+            datagraph -= b
+        finally:
+            w.close()
+        assert datagraph == self.node_graph({1: {3: None}, 3: {}})
+
+
+class SQLiteGraph_Test(testutil.SQLite_Mixin, SQLGraphBatch_Mixin,
+                       Mapping_Test):
     'run same tests on mapping.SQLGraph class using sqlite'
 
     def sqlite_load(self):
@@ -329,7 +739,8 @@ class SQLiteGraph_Test(testutil.SQLite_Mixin, Mapping_Test):
                                            createTable=createOpts)
 
 
-class SQLiteGraph_DB_Test(testutil.SQLite_Mixin, Mapping_Test):
+class SQLiteGraph_DB_Test(testutil.SQLite_Mixin, SQLGraphBatch_Mixin,
+                          Mapping_Test):
     'run same tests on mapping.SQLGraph class using sqlite'
 
     def sqlite_load(self):
@@ -342,6 +753,54 @@ class SQLiteGraph_DB_Test(testutil.SQLite_Mixin, Mapping_Test):
                                            sourceDB=self.nodeDB,
                                            targetDB=self.nodeDB)
 
+class SQLiteGraphClustered_Test(testutil.SQLite_Mixin, unittest.TestCase):
+    'cluster caching in SQLGraphClustered'
+
+    def sqlite_load(self):
+        cursor = self.serverInfo.cursor()
+        cursor.execute('create table testgraph (id INTEGER PRIMARY KEY, \
+                       source_id int, target_id int, edge_id int, cluster int)')
+        for i, t in enumerate([(1, 2, 1), (1, 3, 1), (2, 3, 1), (4, 5, 2),
+                               (6, 7, 3), (7, 6, 3)]):
+            cursor.execute('insert into testgraph values (?,?,?,?,?)',
+                           (i, t[0], t[1], i, t[2]))
+        self.datagraph = sqlgraph.SQLIDGraphClustered('testgraph',
+                                                      clusterKey='cluster',
+                                                      serverInfo=self.serverInfo,
+                                                      maxClusters=2)
+
+    def test_max_clusters(self):
+        'LRU eviction of clusters'
+        g = self.datagraph
+        assert sorted(g[1].keys()) == [2, 3]
+        stats = g.cache_stats()
+        assert (stats['clusters'], stats['rows'], stats['misses']) == (1, 3, 1)
+        assert g[2].keys() == [3] # loaded with node 1
+        assert g.cache_stats()['hits'] == 1
+        assert g[4].keys() == [5]
+        g[1] # cluster 1 is now more recently used than cluster 2
+        assert g[6].keys() == [7]
+        assert 4 not in g.d # cluster 2 dropped
+        assert 1 in g.d and 7 in g.d
+        stats = g.cache_stats()
+        assert (stats['clusters'], stats['evictions']) == (2, 1)
+        assert g[4].keys() == [5]
+        assert 1 not in g.d and 2 not in g.d
+
+    def test_prefetch_clusters(self):
+        'load several clusters in one query'
+        g = self.datagraph
+        g.maxClusters = None
+        g.prefetch_clusters([1, 3, 1])
+        stats = g.cache_stats()
+        assert (stats['clusters'], stats['rows']) == (2, 5)
+        assert sorted(g.d.keys()) == [1, 2, 6, 7]
+        assert g[7].keys() == [6]
+        assert g.cache_stats()['misses'] == 2
+        g.prefetch_clusters([2, 3]) # only cluster 2 is loaded
+        assert g.cache_stats()['rows'] == 6
+        assert g[4].keys() == [5]
+
 # test currently unused, requires access to leelab data
 ## from pygr import worldbase
 ## class Splicegraph_Test(unittest.TestCase):
@@ -0,0 +1,139 @@
+"""
+Benchmark of the compiled graph matcher against GraphQuery, and of
+CSRGraph against dictGraph.
+"""
+
+import random
+import sys
+import time
+import unittest
+
+from testlib import testutil, PygrTestProgram, SkipTest
+from pygr import logger
+from pygr.graphquery import GraphQuery, GraphQueryVF2
+from pygr.mapping import dictGraph, CSRGraph
+
+
+class GraphQueryBenchmark_Test(unittest.TestCase):
+    ngenes = 2000
+    nexons = 20
+
+    def setUp(self):
+        try:
+            from pygr import cgraphquery
+        except ImportError:
+            raise SkipTest('cgraphquery extension not built')
+        random.seed(1)
+        g = dictGraph() # SPLICE GRAPH: CHAINS OF EXONS, WITH SOME SKIPS
+        for gene in range(self.ngenes):
+            exons = [(gene, i) for i in range(self.nexons)]
+            for i in range(self.nexons - 1):
+                g += exons[i]
+                g[exons[i]][exons[i + 1]] = None
+                if random.random() < 0.2:
+                    g[exons[i]][exons[min(i + 2, self.nexons - 1)]] = None
+            g += exons[-1]
+        self.datagraph = g
+
+    def test_exon_skip(self):
+        'exon skip query: GraphQuery vs. GraphQueryVF2'
+        querygraph = {0: {1: None, 2: None}, 1: {2: None}, 2: {}}
+        start = time.time()
+        l1 = [d.copy() for d in GraphQuery(self.datagraph, querygraph)]
+        t1 = time.time() - start
+        start = time.time()
+        snapshot = CSRGraph(self.datagraph)
+        t2 = time.time() - start
+        compiled = GraphQuery(self.datagraph, querygraph) \
+                   .compile(compilerClass=GraphQueryVF2)
+        start = time.time()
+        l2 = list(compiled.run(snapshot))
+        t3 = time.time() - start
+        l1.sort()
+        l2.sort()
+        assert l1 == l2
+        logger.info('exon skip query, %d matches: GraphQuery %.3f sec, \
+CSRGraph %.3f sec, GraphQueryVF2 %.3f sec (%.1fx)'
+                    % (len(l1), t1, t2, t3, t1 / t3))
+
+    def test_parallel(self):
+        'exon skip query: serial vs. run_parallel()'
+        querygraph = {0: {1: None, 2: None}, 1: {2: None}, 2: {}}
+        gq = GraphQuery(self.datagraph, querygraph)
+        start = time.time()
+        n1 = len([d.copy() for d in gq])
+        t1 = time.time() - start
+        start = time.time()
+        n2 = len(list(gq.run_parallel(4)))
+        t2 = time.time() - start
+        start = time.time()
+        n3 = len(list(gq.run_parallel(4, compiled=True)))
+        t3 = time.time() - start
+        assert n1 == n2 == n3
+        logger.info('exon skip query, %d matches: serial %.3f sec, \
+4 workers %.3f sec, 4 compiled workers %.3f sec' % (n1, t1, t2, t3))
+
+    def test_plan(self):
+        'query with a selective filter: BFS order vs. planned order'
+        isFifth = lambda toNode, **kwargs: toNode[1] == 5
+        querygraph = {0: {1: None, 2: dict(filter=isFifth)}, 1: {3: None},
+                      2: {}, 3: {}}
+        start = time.time()
+        l1 = [d.copy() for d in GraphQuery(self.datagraph, querygraph)]
+        t1 = time.time() - start
+        start = time.time()
+        gq = GraphQuery(self.datagraph, querygraph, stats=True)
+        l2 = [d.copy() for d in gq]
+        t2 = time.time() - start
+        l1.sort()
+        l2.sort()
+        assert l1 == l2
+        logger.info('filtered query, %d matches: BFS order %.3f sec, \
+planned order %.3f sec' % (len(l1), t1, t2))
+
+    def test_compiled_cache(self):
+        'compiling the same query repeatedly'
+        querygraph = {0: {1: None, 2: None}, 1: {2: None}, 2: {}}
+        gq = GraphQuery(self.datagraph, querygraph)
+        start = time.time()
+        for i in range(100):
+            gq.compile(globals={}).compile() # NOT CACHED
+        t1 = time.time() - start
+        start = time.time()
+        for i in range(100):
+            gq.compile().compile()
+        t2 = time.time() - start
+        logger.info('100 compilations: %.3f sec, %.3f sec with \
+compiledQueries cache' % (t1, t2))
+
+    def test_csr_graph(self):
+        'CSRGraph vs. dictGraph: memory use, edge iteration and lookup'
+        dictSize = sys.getsizeof(self.datagraph)
+        for d in self.datagraph.itervalues():
+            dictSize += sys.getsizeof(d)
+        start = time.time()
+        g = CSRGraph(self.datagraph)
+        t0 = time.time() - start
+        tmp = testutil.TempDir('csrgraph-megatest')
+        g.save(tmp.subfile('graph'))
+        csrSize = sum([a.itemsize * len(a) for a in
+                       (g.outStart, g.outTarget, g.inStart, g.inSource,
+                        g.inEdge)])
+        times = []
+        for graph in (self.datagraph, g):
+            start = time.time()
+            n = len(list(graph.edges()))
+            for node in graph:
+                for target in graph[node]:
+                    graph[node][target]
+            times.append(time.time() - start)
+        assert n == len(list(self.datagraph.edges()))
+        g.close()
+        logger.info('%d edges: dictGraph %d bytes (excluding nodes), \
+CSRGraph arrays %d bytes, built in %.3f sec; edge iteration + lookup: \
+dictGraph %.3f sec, mmap CSRGraph %.3f sec'
+                    % (n, dictSize, csrSize, t0, times[0], times[1]))
+
+
+if __name__ == '__main__':
+    PygrTestProgram(verbosity=2)
@@ -3,11 +3,15 @@ Tests for the pygr.seqdb module.
 """
 
 import os
+import threading
 import unittest
 
 from testlib import testutil, PygrTestProgram
 from pygr.seqdb import SequenceDB, SequenceFileDB, PrefixUnionDict, \
-     AnnotationDB, SeqPrefixUnionDict
+     AnnotationDB, SeqPrefixUnionDict, BGZFSequenceFileDB, BlastDBXMLRPC, \
+     XMLRPCSequenceDB
+from pygr import bgzf, coordinator
+from pygr.mapping import KeepUniqueDict
 from pygr.sequence import Sequence
 from pygr.cnestedlist import NLMSA
 import gc
@@ -360,6 +364,126 @@ class SequenceFileDB_Creation_Test(unittest.TestCase):
             pass                        # ValueError is expected
 
 
+class BGZFSequenceFileDB_Test(unittest.TestCase):
+    """
+    Test BGZFSequenceFileDB against SequenceFileDB on the same FASTA file.
+    """
+
+    def setUp(self):
+        self.dbfile = testutil.datafile('partial-yeast.fasta')
+        self.gzfile = testutil.tempdatafile('partial-yeast.fasta.gz', False)
+        bgzf.bgzip_file(self.dbfile, self.gzfile)
+        for path in (self.gzfile + '.fai', ):
+            if os.path.exists(path):
+                os.unlink(path)
+        self.db = BGZFSequenceFileDB(self.gzfile, blockCacheSize=2)
+        self.refdb = SequenceFileDB(self.dbfile)
+
+    def tearDown(self):
+        self.db.close()
+        self.refdb.close()
+
+    def test_keys(self):
+        "BGZFSequenceFileDB keys and lengths"
+        k = self.db.keys()
+        k.sort()
+        assert k == ['chr01', 'chr02', 'chr03']
+        for k in self.refdb:
+            assert len(self.db[k]) == len(self.refdb[k])
+            assert self.db.seqInfoDict[k].length == len(self.refdb[k])
+
+    def test_fai_index(self):
+        "BGZFSequenceFileDB index file format"
+        ifile = file(self.gzfile + '.fai')
+        try:
+            line = ifile.readline()
+        finally:
+            ifile.close()
+        assert line == 'chr01\t230208\t101\t60\t61\n', line
+
+    def test_strslice(self):
+        "BGZFSequenceFileDB slices match SequenceFileDB"
+        for k in self.refdb:
+            s = str(self.refdb[k])
+            assert str(self.db[k]) == s
+            for start, stop in ((0, 1), (59, 61), (60, 61), (1000, 70000),
+                                (64000, 64300), (len(s) - 100, len(s))):
+                assert str(self.db[k][start:stop]) == s[start:stop]
+            assert str(-self.db[k][7:900]) == str(-self.refdb[k][7:900])
+
+    def test_block_cache(self):
+        "BGZFSequenceFileDB only keeps blockCacheSize blocks"
+        s = self.db['chr02']
+        str(s[:200000])
+        assert len(self.db._reader._blockCache) == 2
+
+    def test_reopen(self):
+        "BGZFSequenceFileDB re-uses existing index files"
+        assert os.path.exists(self.gzfile + '.gzi')
+        db = BGZFSequenceFileDB(self.gzfile)
+        try:
+            assert str(db['chr03'][:50]) == str(self.refdb['chr03'][:50])
+        finally:
+            db.close()
+
+
+class XMLRPCSequenceDB_Test(unittest.TestCase):
+    """
+    Test XMLRPCSequenceDB batched access, using a BlastDBXMLRPC served
+    from a thread in this process.
+    """
+
+    def setUp(self):
+        self.refdb = BlastDBXMLRPC(testutil.datafile('dnaseq.fasta'))
+        self.server = coordinator.XMLRPCServerBase('test', host='localhost',
+                                                   port=0)
+        self.server['seqs'] = self.refdb
+        self.thread = threading.Thread(target=self.server.server.serve_forever)
+        self.thread.start()
+        url = 'http://localhost:%d' % self.server.port
+        self.db = XMLRPCSequenceDB(url, 'seqs', batchSize=2)
+        self.calls = []
+        m = self.db.server.get_strslices
+        def get_strslices(slices): # record how many server calls we make
+            self.calls.append(slices)
+            return m(slices)
+        self.db.server.get_strslices = get_strslices
+
+    def tearDown(self):
+        self.server.server.shutdown()
+        self.thread.join()
+        self.server.server.server_close()
+        del coordinator.get_connection[self.db.url]
+        self.refdb.close()
+
+    def test_seqlens(self):
+        "XMLRPCSequenceDB length table"
+        self.db.load_seqlens()
+        assert self.db._seqLens == dict(seq1=78, seq2=26)
+        assert len(self.db['seq1']) == 78
+        assert 'seq2' in self.db
+        assert 'foo' not in self.db
+        self.db.load_seqlens(['seq1', 'bar'])
+        assert self.db._seqLens['bar'] == -1
+
+    def test_strslices(self):
+        "XMLRPCSequenceDB batched strslices"
+        s1, s2 = str(self.refdb['seq1']), str(self.refdb['seq2'])
+        slices = [('seq1', 0, 10), ('seq2', 5, 20), ('seq1', 0, 10),
+                  ('seq1', 30, 78), ('seq2', 0, 5)]
+        result = self.db.strslices(slices)
+        assert result == [s1[:10], s2[5:20], s1[:10], s1[30:], s2[:5]]
+        assert len(self.calls) == 2 # four distinct slices, two per call
+        assert self.db.strslices([('seq2', 0, 20), ('seq1', 40, 50)]) == \
+               [s2[:20], s1[40:50]]
+        assert len(self.calls) == 2 # all in slice cache
+        assert str(self.db['seq1'][35:70]) == s1[35:70] # use slice cache
+        assert str(-self.db['seq2'][2:12]) == str(-self.refdb['seq2'][2:12])
+        assert self.db.strslices([('seq2', -12, -2)]) == \
+               [self.refdb.get_strslice('seq2', -12, -2)]
+        assert len(self.calls) == 3
+
+
 def close_pud_dicts(pud):
     """Close all seq dbs indexed in a PrefixUnionDict """
     for db in pud.dicts:
@@ -567,6 +691,38 @@ class PrefixUnionDict_Test(unittest.TestCase):
         name = self.db.getName(seq1)
         assert name == 'prefix.seq1'
 
+    def test_resolve_many(self):
+        "PrefixUnionDict resolve_many"
+        seqs = self.db.resolve_many(['prefix.seq2', 'prefix.seq1',
+                                     'prefix.seq2'])
+        assert [s.id for s in seqs] == ['seq2', 'seq1', 'seq2']
+        assert seqs[0] is self.db['prefix.seq2']
+        assert self.db._keyTypes == {'prefix': str}
+        try:
+            self.db.resolve_many(['prefix.seq1', 'prefix.foo'])
+            assert 0, "should not get here"
+        except KeyError:
+            pass
+        try:
+            self.db.resolve_many(['foo'])
+            assert 0, "should not get here"
+        except KeyError:
+            pass
+
+    def test_int_keys(self):
+        "PrefixUnionDict int key type"
+        seqdb = self.db.prefixDict['prefix']
+        a = KeepUniqueDict()
+        a[1] = seqdb['seq1']
+        b = KeepUniqueDict()
+        b['1'] = seqdb['seq2']
+        pud = PrefixUnionDict({'a': a, 'b': b})
+        assert pud['a.1'].id == 'seq1'
+        assert pud['b.1'].id == 'seq2'
+        assert pud._keyTypes == {'a': int, 'b': str}
+        assert [s.id for s in pud.resolve_many(['b.1', 'a.1'])] == \
+               ['seq2', 'seq1']
+
     def test_items(self):
         "PrefixUnionDict items"
         i = [k for (k, v) in self.db.items()]
@@ -876,8 +1032,8 @@ class SeqDBCache_Test(unittest.TestCase):
             # get seq1
             seq1 = db['seq1']
 
-            # _cache is only created on first cache attempt
-            assert not hasattr(db, '_cache')
+            # _rangeCache is only created on first cache attempt
+            assert not hasattr(db, '_rangeCache')
 
             # build an 'owner' object
             class AnonymousOwner(object):
@@ -889,20 +1045,22 @@ class SeqDBCache_Test(unittest.TestCase):
             cacheHint(cacheDict, owner)
             del cacheDict                   # 'owner' now holds reference
 
-            # peek into _cache and assert that only the ival coordinates
-            # are stored
-            v = db._cache.values()[0]
-            assert len(v['seq1']) == 2
-            del v
+            # peek into _rangeCache and assert that only the ival
+            # coordinates are stored
+            assert [t[:2] for t in db._rangeCache._hints['seq1']] == \
+                   [(seq1.start, seq1.stop)]
+            assert db._rangeCache.nbytes == 0
 
             # force a cache access & check that now we've stored actual string
             ival = str(seq1[5:10])
-            v = db._cache.values()[0]
             # ...check that we've stored actual string
-            assert len(v['seq1']) == 3
+            assert db._rangeCache.nbytes == len(seq1)
+            assert db._rangeCache.bytesRead == len(seq1)
 
             # again force cache access, this time to the stored sequence string
             ival = str(seq1[5:10])
+            assert db._rangeCache.hits == 1
+            assert db._rangeCache.bytesRead == len(seq1)
 
             # now, eliminate all references to the cache proxy dict
             del owner
@@ -912,9 +1070,136 @@ class SeqDBCache_Test(unittest.TestCase):
             # deallocated, but that's implementation dependent.
             gc.collect()
 
-            # ok, cached values should now be gone.
-            v = db._cache.values()
-            assert len(v) == 0
+            # ok, cache hints should now be gone.
+            assert not db._rangeCache._ownerIDs
+            assert not db._rangeCache._hints
+            db._rangeCache.clear()
+            try: # no hint, so this must not come from the cache
+                db.strsliceCache(seq1, 20, 30)
+                assert 0, 'should not reach this point'
+            except IndexError:
+                pass
+        finally:
+            db.close()
+
+    def test_coalesce(self):
+        "Overlapping cache hints are read once"
+
+        dnaseq = testutil.datafile('dnaseq.fasta')
+        db = SequenceFileDB(dnaseq)
+
+        class AnonymousOwner(object):
+            pass
+
+        try:
+            seq1 = db['seq1']
+            s = str(seq1)
+            owners = [AnonymousOwner() for i in range(4)]
+            db.cacheHint({'seq1': (0, 20)}, owners[0])
+            db.cacheHint({'seq1': (15, 35)}, owners[1])
+            db.cacheHint({'seq1': (30, 40)}, owners[2])
+            db.cacheHint({'seq1': (60, 70)}, owners[3])
+            rangeCache = db._rangeCache
+
+            assert str(seq1[17:22]) == s[17:22]
+            assert rangeCache.bytesRead == 40 # (0, 40) in one read
+            assert str(seq1[0:5]) == s[0:5]
+            assert str(seq1[35:40]) == s[35:40]
+            assert rangeCache.bytesRead == 40
+            assert rangeCache.hits == 2
+
+            assert str(seq1[62:65]) == s[62:65] # separate range
+            assert rangeCache.bytesRead == 50
+            assert str(seq1[45:65]) == s[45:65] # no hint: not cached
+            assert rangeCache.bytesRead == 50
+
+            # a new hint overlapping cached ranges only reads the gap
+            db.cacheHint({'seq1': (35, 70)}, owners[0])
+            assert str(seq1[45:65]) == s[45:65]
+            assert rangeCache.bytesRead == 70
+            assert len(rangeCache._ranges['seq1']) == 1
+            assert rangeCache.nbytes == 70
+        finally:
+            db.close()
+
+    def test_merge_earlier(self):
+        "Merging with an earlier cached range keeps slices aligned"
+
+        dnaseq = testutil.datafile('dnaseq.fasta')
+        db = SequenceFileDB(dnaseq)
+
+        class AnonymousOwner(object):
+            pass
+
+        try:
+            seq1 = db['seq1']
+            s = str(seq1)
+            owner = AnonymousOwner()
+            db.cacheHint({'seq1': (0, 20)}, owner)
+            assert str(seq1[5:10]) == s[5:10]
+            del owner # its cached string stays
+            gc.collect()
+            owner = AnonymousOwner()
+            db.cacheHint({'seq1': (10, 40)}, owner)
+            assert db.strsliceCache(seq1, 30, 35) == s[30:35]
+            assert str(seq1[12:38]) == s[12:38]
+            assert db._rangeCache.bytesRead == 40
+            assert len(db._rangeCache._ranges['seq1']) == 1
+        finally:
+            db.close()
+
+    def test_cache_limit(self):
+        "Cached sequence strings are limited to _cache_max_bytes"
+
+        dnaseq = testutil.datafile('dnaseq.fasta')
+        db = SequenceFileDB(dnaseq)
+
+        class AnonymousOwner(object):
+            pass
+
+        try:
+            db._cache_max_bytes = 50
+            seq1, seq2 = db['seq1'], db['seq2']
+            owner = AnonymousOwner()
+            db.cacheHint({'seq1': (0, 30), 'seq2': (0, 25)}, owner)
+            rangeCache = db._rangeCache
+            str(seq1[:10])
+            str(seq2[:10])
+            assert rangeCache.nbytes == 25
+            assert rangeCache.evictions == 1
+            assert 'seq1' not in rangeCache._starts or \
+                   not rangeCache._starts['seq1']
+            assert str(seq2[5:20]) == str(seq2)[5:20]
+            assert rangeCache.hits == 1
+        finally:
+            db.close()
+
+    def test_cache_lru(self):
+        "The least recently used sequence string is dropped first"
+
+        dnaseq = testutil.datafile('dnaseq.fasta')
+        db = SequenceFileDB(dnaseq)
+
+        class AnonymousOwner(object):
+            pass
+
+        try:
+            db._cache_max_bytes = 50
+            seq1, seq2 = db['seq1'], db['seq2']
+            owner = AnonymousOwner()
+            db.cacheHint({'seq1': (0, 20)}, owner)
+            db.cacheHint({'seq1': (25, 40)}, owner)
+            db.cacheHint({'seq2': (0, 20)}, owner)
+            rangeCache = db._rangeCache
+            str(seq1[:5])
+            str(seq1[30:35])
+            str(seq1[2:4]) # now more recently used than seq1[25:40]
+            str(seq2[:5])
+            assert rangeCache.evictions == 1
+            assert rangeCache._starts['seq1'] == [0]
+            assert rangeCache.nbytes == 40
+            assert str(seq1[5:15]) == str(seq1)[5:15]
+            assert rangeCache.hits == 2
         finally:
             db.close()
 
@@ -939,28 +1224,24 @@ class SeqDBCache_Test(unittest.TestCase):
             mymap.build()
 
             # check: no cache
-            assert not hasattr(db, '_cache'), 'should be no cache yet'
+            assert not hasattr(db, '_rangeCache'), 'should be no cache yet'
 
             seq1, seq2 = db['seq1'], db['seq2'] # re-retrieve
             # now retrieve a NLMSASlice, forcing entry of seq into cache
             ival = seq1[5:10]
             x = mymap[ival]
 
-            assert len(db._cache.values()) != 0
-
-            n1 = len(db._cache)
-            assert n1 == 1, "should be exactly one cache entry, not %d" % \
+            n1 = len(db._rangeCache._ownerIDs)
+            assert n1 == 1, "should be exactly one cache owner, not %d" % \
                     (n1, )
 
             # ok, now trash referencing arguments & make sure of cleanup
             del x
             gc.collect()
 
-            assert len(db._cache.values()) == 0
-
-
-            n2 = len(db._cache)
-            assert n2 == 0, '%d objects remain; cache memory leak!' % n2
+            n2 = len(db._rangeCache._ownerIDs)
+            assert n2 == 0, '%d owners remain; cache memory leak!' % n2
+            assert not db._rangeCache._hints
             # FAIL because of __dealloc__ error in cnestedlist.NLMSASlice.
 
             # Drop our references, the cache should empty.
@@ -63,6 +63,38 @@ CACCCTGCCCCATCTCCCCAGCCTGGCCCCTCGTGTCTCAGAACCCTCGGGGGGAGGCACAGAAGCCTTCGGGG')"""
         "Testing slices"
         self.EQ(self.row2.strslice(3, 10), 'AGAAAGA')
 
+    def test_chunks(self):
+        "Testing chunked slices, read-ahead and cacheHint"
+        seq = self.row2
+        seq.chunkSize, seq.maxChunks, seq.prefetchChunks = 8, 3, 1
+        s = seq.strslice(0, 44, useCache=False)
+        queries = []
+        substring = seq._substring
+
+        def count_substring(start, end):
+            queries.append((start, end))
+            return substring(start, end)
+        seq._substring = count_substring
+        self.EQ(seq.strslice(3, 10), s[3:10]) # chunk 0 and 1
+        self.EQ(seq.strslice(12, 15), s[12:15]) # already cached
+        self.EQ(queries, [(0, 16)])
+        self.EQ(seq.strslice(17, 20), s[17:20]) # sequential: read ahead
+        self.EQ(queries[-1], (16, 32))
+        self.EQ(seq.strslice(25, 30), s[25:30])
+        self.EQ(len(queries), 2)
+        self.EQ(sorted(seq._chunks.keys()), [1, 2, 3]) # chunk 0 dropped
+        self.EQ(seq.strslice(0, 44), s) # too big for our cache
+        self.EQ(queries[-1], (0, 44))
+        self.EQ(seq.strslice(40, 44), s[40:44])
+        self.EQ(seq.strslice(2, 6, useCache=False), s[2:6])
+        queries[:] = []
+        seq._chunks.clear()
+        del seq._chunkQueue[:]
+        self.db.cacheHint({seq.id: (-20, -4)}, None)
+        self.EQ(queries, [(0, 24)])
+        self.EQ(seq.strslice(4, 20), s[4:20])
+        self.EQ(len(queries), 1)
+
     def init_subclass_test(self):
         "Testing subclassing"
         self.row2._init_subclass(self.db)
@@ -71,6 +103,9 @@ class SQLSeqCached_Test(SQLSequence_Test):
     _dbClass = sqlgraph.SQLTable
     _rowClass = sqlgraph.DNASQLSequenceCached
 
+    def test_chunks(self): # caches the whole sequence instead
+        pass
+
 
 class SQLiteSequence_Test(testutil.SQLite_Mixin, SQLSequence_Test):
     def sqlite_load(self):
@@ -80,6 +115,9 @@ class SQLiteSeqCached_Test(SQLiteSequence_Test):
     _dbClass = sqlgraph.SQLTable
     _rowClass = sqlgraph.DNASQLSequenceCached
 
+    def test_chunks(self): # caches the whole sequence instead
+        pass
+
 
 def get_suite():
     "Returns the testsuite"
@@ -0,0 +1,58 @@
+"""
+Micro-benchmarks of SQLTable point lookups, using sqlite.
+"""
+
+import time
+import unittest
+
+from testlib import testutil, PygrTestProgram
+from pygr import logger
+from pygr.sqlgraph import SQLTable, SQLTableNoCache
+
+
+class SQLTableBenchmark_Test(testutil.SQLite_Mixin, unittest.TestCase):
+    nrows = 10000
+    passes = 3
+
+    def sqlite_load(self):
+        cursor = self.serverInfo.cursor()
+        cursor.execute('create table bench (id INTEGER PRIMARY KEY, \
+                       name TEXT, length INTEGER)')
+        cursor.executemany('insert into bench values (?,?,?)',
+                           [(i, 'seq%d' % i, i * 10)
+                            for i in xrange(self.nrows)])
+        self.serverInfo._connection.commit()
+
+    def time_lookups(self, t):
+        'return lookups per second of t[k], bypassing its object cache'
+        start = time.time()
+        for i in xrange(self.passes):
+            for k in xrange(self.nrows):
+                t.clear_cache()
+                t[k]
+        return self.passes * self.nrows / (time.time() - start)
+
+    def compare_templates(self, tableClass):
+        'time lookups with and without memoized SQL templates'
+        t = tableClass('bench', serverInfo=self.serverInfo)
+        assert t[7].name == 'seq7'
+        t._format_query.maxTemplates = 0 # no memoization
+        t._format_query._templates.clear()
+        uncached = self.time_lookups(t)
+        t._format_query.maxTemplates = 1000
+        cached = self.time_lookups(t)
+        assert len(t._format_query._templates) > 0
+        logger.info('%s.__getitem__: %d/sec without template cache, \
+%d/sec with template cache' % (tableClass.__name__, uncached, cached))
+
+    def test_getitem(self):
+        'SQLTable.__getitem__ throughput'
+        self.compare_templates(SQLTable)
+
+    def test_getitem_nocache(self):
+        'SQLTableNoCache.__getitem__ throughput'
+        self.compare_templates(SQLTableNoCache)
+
+
+if __name__ == '__main__':
+    PygrTestProgram(verbosity=2)
@@ -1,11 +1,13 @@
 import os
+import pickle
 import random
 import string
+import threading
 import unittest
 
 from testlib import testutil, PygrTestProgram, SkipTest
 from pygr.sqlgraph import SQLTable, SQLTableNoCache, SQLTableClustered,\
-     MapView, GraphView, DBServerInfo, import_sqlite
+     MapView, GraphView, DBServerInfo, import_sqlite, CachedServerInfo
 from pygr import logger
 
 
@@ -278,6 +280,80 @@ class SQLTable_Test(SQLTable_Setup):
         bl = [val.letter for val in byLetter.itervalues()]
         assert sortedBL == bl
 
+    def test_format_templates(self):
+        'transformed SQL templates are memoized, up to maxTemplates'
+        fq = self.db._format_query
+        sql = 'select * from %s where %s=%%s' % (self.tableName,
+                                                 self.db.primary_key)
+        assert fq(sql, (1, ))[0] == fq(sql, (2, ))[0]
+        assert sql in fq._templates
+        l = [fq('%s %d' % (sql, i), (i, ))[0] for i in range(fq.maxTemplates)]
+        assert len(fq._templates) <= fq.maxTemplates
+        assert l[-1] == fq('%s %d' % (sql, fq.maxTemplates - 1), (0, ))[0]
+
+    def test_max_cache(self):
+        'maxCache evicts least recently used objects'
+        t = self.targetDB
+        t.clear_cache()
+        t.maxCache = 2 # applied before caching each new object
+        try:
+            l = [t[k] for k in (99, 6, 8)]
+            assert t[99] is l[0] # now most recently used
+            t[7]
+            assert 99 in t._weakValueDict and 8 in t._weakValueDict
+            assert 6 not in t._weakValueDict
+            stats = t.cache_stats()
+            assert (stats['size'], stats['evictions']) == (3, 1)
+        finally:
+            del t.maxCache
+
+    def test_get_many(self):
+        'test get_many and prefetch'
+        self.db.catchIter = self.targetDB.catchIter = True
+        l = self.db.get_many([2, 1, 2])
+        assert l == [self.db[2], self.db[1], self.db[2]]
+        assert l[0] is l[2]
+        try:
+            self.db.get_many([1, 3])
+            raise AssertionError('failed to trap missing key')
+        except KeyError:
+            pass
+        self.serverInfo.maxQueryParams = 2 # force multiple queries
+        l = self.targetDB.get_many([99, 6, 8, 7])
+        assert [o.id for o in l] == [99, 6, 8, 7]
+        l = self.sourceDB.prefetch([4, 5, 2])
+        assert len(l) == 2
+        for o in l:
+            assert self.sourceDB._weakValueDict[o.id] is o
+
+    def test_parallel_scan(self):
+        'test parallel_scan in order and unordered'
+        self.targetDB.arraysize = 1 # force keyset pagination
+        l = [o.id for o in self.targetDB.parallel_scan(3, ordered=True)]
+        assert l == [6, 7, 8, 99]
+        assert l[0] is not None and self.targetDB[6].other_id == 'seq4'
+        l = [t for t in self.targetDB.parallel_scan(2, rows=True)]
+        l.sort()
+        assert l == [(6, 'seq4'), (7, 'seq2'), (8, 'seq4'), (99, 'seq3')]
+        l = list(self.sourceDB.parallel_scan(8, ordered=True))
+        assert [o.id for o in l] == [2, 3, 4]
+        assert l[1] is self.sourceDB[3] # cached like any other query
+
+    def test_columns(self):
+        'test columnar fetch without row objects'
+        self.targetDB.catchIter = True # no iter expected in this test
+        n = len(self.targetDB._weakValueDict)
+        ids, others = self.targetDB.columns(['id', 'other_id'],
+                                            'where other_id=%s', ('seq4', ))
+        assert sorted(ids) == [6, 8] and others == ['seq4', 'seq4']
+        assert len(self.targetDB._weakValueDict) == n # nothing cached
+        l = list(self.targetDB.iter_columns(['id'], arraysize=3))
+        assert [len(chunk[0]) for chunk in l] == [3, 1]
+        starts, seqIDs = self.db.columns(['start', 'sequence_id'],
+                                         typecodes=dict(start='l'))
+        assert starts.typecode == 'l' and sorted(starts) == [0, 5]
+        assert sorted(seqIDs) == ['seq1', 'seq2']
+
     def test_attraliases(self):
         'test aliases defined with attrAlias'
         self.db[1].sequence_id
@@ -428,9 +504,176 @@ class SQLiteTable_Test(SQLiteBase, SQLTable_Test):
 ##                                         serverInfo=self.serverInfo)
 
 
+class SQLitePooled_Test(SQLiteTable_Test):
+    'same tests, with each thread using its own pooled connection'
+    serverKwargs = dict(poolSize=3)
+
+    def test_threads(self):
+        'check concurrent queries from several threads'
+        self.db.catchIter = True # no iter expected in this test
+        errors = []
+
+        def run_queries(seq_id):
+            try:
+                for i in range(20):
+                    self.db.clear_cache()
+                    assert self.db[1].seq_id == 'seq1'
+                    l = [o.seq_id for o in self.db.get_many([2, 1])]
+                    assert l == ['seq2', 'seq1']
+                    assert self.targetDB[6].other_id == 'seq4'
+            except Exception, e:
+                errors.append(e)
+            self.serverInfo.release() # return connection to the pool
+        threads = [threading.Thread(target=run_queries, args=(i, ))
+                   for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+        pool = self.serverInfo._pool
+        assert pool.nconnections <= 3
+        assert len(pool._idle) == pool.nconnections - 1 # all but ours
+
+    def test_thread_writes(self):
+        'writes from threads taking turns on pooled connections'
+        db = SQLTable(self.tableName, serverInfo=self.serverInfo,
+                      writeable=True)
+        n = len(db)
+        errors = []
+
+        def write_row(i):
+            try:
+                db.new(id=100 + i, seq_id='thread%d' % i, start=i,
+                       stop=2 * i)
+            except Exception, e:
+                errors.append(e)
+            self.serverInfo.release() # return connection to the pool
+        for i in range(3):
+            t = threading.Thread(target=write_row, args=(i, ))
+            t.start()
+            t.join()
+        assert errors == []
+        assert len(db) == n + 3
+        db.clear_cache()
+        assert [db[100 + i].seq_id for i in range(3)] \
+               == ['thread0', 'thread1', 'thread2']
+
+    def test_itervalues_long(self):
+        'pooled connections autocommit, so insert its rows in one transaction'
+        self.db.cursor.execute('BEGIN')
+        try:
+            SQLiteTable_Test.test_itervalues_long(self)
+        finally:
+            self.db.cursor.execute('COMMIT')
+
+    def test_pickle(self):
+        'pooled serverInfo stays picklable'
+        serverInfo = pickle.loads(pickle.dumps(self.serverInfo))
+        assert serverInfo.poolSize == 3
+        t = SQLTable(self.tableName, serverInfo=serverInfo)
+        assert t[2].seq_id == 'seq2'
+        serverInfo.close()
+
+
+class SQLiteCached_Test(SQLiteBase, SQLTable_Setup):
+    'mirror tables from one sqlite database into another'
+    writeable = False
+
+    def setUp(self):
+        SQLiteBase.setUp(self)
+        self.cache_file = testutil.tempdatafile('test_cache.db', False)
+        self.remove_cache_files()
+        self.cache = CachedServerInfo(self.serverInfo, self.cache_file)
+
+    def remove_cache_files(self):
+        for path in (self.cache_file, self.cache_file + '.other'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def tearDown(self, closeConnection=True):
+        if closeConnection:
+            self.cache.close()
+            self.remove_cache_files()
+        SQLiteBase.tearDown(self, closeConnection)
+
+    def test_mirror(self):
+        'table is copied on first use, then read locally'
+        t = SQLTable(self.tableName, serverInfo=self.cache)
+        assert t.primary_key == 'primary_id'
+        assert t.columnName == self.db.columnName
+        assert t[2].seq_id == 'seq2'
+        assert len(t) == 2
+        assert self.cache.mirror_info(self.tableName)[:2] == ('', ())
+        self.db.cursor.execute('delete from %s' % self.tableName)
+        t = SQLTable(self.tableName, serverInfo=self.cache)
+        assert len(t) == 2 # still reading our copy
+        self.cache.refresh(self.tableName)
+        assert len(SQLTable(self.tableName, serverInfo=self.cache)) == 0
+
+    def test_where(self):
+        'mirror only part of a table'
+        self.cache.mirror_table(self.joinTable2, 'where other_id=%s',
+                                ('seq4', ))
+        t = SQLTable(self.joinTable2, serverInfo=self.cache)
+        assert t.keys() == [6, 8]
+        self.db.cursor.execute("insert into %s values (9, 'seq4')"
+                               % self.joinTable2)
+        self.cache.refresh(self.joinTable2) # same where clause
+        assert t.keys() == [6, 8, 9]
+
+    def test_maxage(self):
+        'stale copies are refreshed'
+        self.cache.maxAge = 0
+        assert len(SQLTable(self.joinTable1, serverInfo=self.cache)) == 3
+        self.db.cursor.execute('delete from %s where my_id=2'
+                               % self.joinTable1)
+        assert len(SQLTable(self.joinTable1, serverInfo=self.cache)) == 2
+
+    def test_attached(self):
+        'tables of another database are mirrored to a separate file'
+        otherFile = testutil.tempdatafile('test_other.db', False)
+        cursor = self.db.cursor
+        cursor.execute('ATTACH DATABASE ? AS other', (otherFile, ))
+        try:
+            cursor.execute('create table other.foo (id INTEGER PRIMARY KEY, \
+                           name TEXT)')
+            cursor.execute("insert into other.foo values (1, 'bar')")
+            t = SQLTable('other.foo', serverInfo=self.cache)
+            assert t[1].name == 'bar'
+            assert os.path.exists(self.cache_file + '.other')
+            self.cache.close() # attached again on reconnecting
+            t = SQLTable('other.foo', serverInfo=self.cache)
+            assert t[1].name == 'bar'
+        finally:
+            self.serverInfo._connection.commit()
+            cursor.execute('DETACH DATABASE other')
+            os.remove(otherFile)
+
+    def test_pickle(self):
+        'cached serverInfo is picklable'
+        SQLTable(self.tableName, serverInfo=self.cache)
+        cache = pickle.loads(pickle.dumps(self.cache))
+        assert isinstance(cache, CachedServerInfo)
+        t = SQLTable(self.tableName, serverInfo=cache)
+        assert t[1].seq_id == 'seq1'
+        cache.close()
+
+
 class SQLTable_NoCache_Test(SQLTable_Test):
     tableClass = SQLTableNoCacheCatcher
 
+    def test_get_many(self): # SQLTableNoCache has no get_many()
+        pass
+
+    def test_parallel_scan(self): # nor parallel_scan()
+        pass
+
+    def test_max_cache(self): # nor maxCache
+        pass
+
 
 class SQLTableClustered_Test(SQLTable_Test):
     tableClass = SQLTableClusteredCatcher
@@ -444,12 +687,45 @@ class SQLTableClustered_Test(SQLTable_Test):
     def test_orderby_random(self):
         pass
 
+    def test_max_cache(self): # loads whole clusters; see test_max_clusters
+        pass
+
+    def test_max_clusters(self):
+        'LRU cluster cache, prefetch_clusters and cache_stats'
+        t = self.targetDB
+        t.clear_cache()
+        t.maxClusters = 1
+        assert t[6].other_id == 'seq4'
+        assert 8 in t._weakValueDict # loaded with its cluster
+        assert sorted([o.id for o in t.itercluster('seq4')]) == [6, 8]
+        stats = t.cache_stats()
+        assert (stats['hits'], stats['misses']) == (1, 1)
+        assert (stats['clusters'], stats['rows']) == (1, 2)
+        assert t[7].other_id == 'seq2'
+        assert 6 not in t._weakValueDict # cluster seq4 dropped
+        assert t.cache_stats()['evictions'] == 1
+        t.maxClusters = None
+        t.prefetch_clusters(['seq3', 'seq4', 'seq2'])
+        stats = t.cache_stats()
+        assert (stats['clusters'], stats['rows'], stats['misses']) == (3, 4, 4)
+        assert t[99].other_id == 'seq3'
+        assert t.cache_stats()['hits'] == 2
+
 class SQLiteClustered_Test(SQLiteBase, SQLTableClustered_Test):
     pass
 
 class SQLiteTable_NoCache_Test(SQLiteTable_Test):
     tableClass = SQLTableNoCache
 
+    def test_get_many(self): # SQLTableNoCache has no get_many()
+        pass
+
+    def test_parallel_scan(self): # nor parallel_scan()
+        pass
+
+    def test_max_cache(self): # nor maxCache
+        pass
+
 
 class SQLTableRW_Test(SQLTable_Setup):
     'test write operations'
@@ -482,6 +758,54 @@ class SQLTableRW_Test(SQLTable_Setup):
         assert result.seq_id == 'jeff' and result.start==3000 \
                and result.stop==4500
 
+    def test_bulk_writer(self):
+        'check buffered row creation'
+        self.db.catchIter = True # no iter expected in this test
+        n = len(self.db)
+        w = self.db.bulk_writer(bufferSize=4)
+        try:
+            for i in range(10, 16):
+                self.db.new(id=i, seq_id='bulk%d' % i, start=i, stop=2 * i)
+            assert len(self.db) == n + 4 # only first buffer flushed
+            o = self.db.new(seq_id='auto', start=0, stop=1) # not buffered
+            assert len(self.db) == n + 7
+        finally:
+            w.close()
+        assert len(self.db) == n + 7
+        t = self.tableClass(self.tableName,
+                            serverInfo=self.serverInfo) # requery the db
+        t.catchIter = True # no iter expected in this test
+        result = t[15]
+        assert result.seq_id == 'bulk15' and result.stop == 30
+        assert t[o.id].seq_id == 'auto'
+        w = self.db.bulk_writer()
+        try:
+            self.db.new(id=20, seq_id='lost', start=0, stop=1)
+            raise ValueError
+        except ValueError:
+            w.abort()
+        assert len(self.db) == n + 7
+
+    def test_bulk_writer_delete(self):
+        'deletes and updates see the rows buffered before them'
+        self.db.catchIter = True # no iter expected in this test
+        n = len(self.db)
+        w = self.db.bulk_writer()
+        try:
+            self.db.new(id=30, seq_id='gone', start=0, stop=1)
+            del self.db[30] # must delete the buffered row
+            o = self.db.new(id=31, seq_id='old', start=0, stop=1)
+            o.seq_id = 'new' # must update the buffered row
+            self.db.new(id=32, seq_id='kept', start=0, stop=1)
+        finally:
+            w.close()
+        assert len(self.db) == n + 2
+        t = self.tableClass(self.tableName,
+                            serverInfo=self.serverInfo) # requery the db
+        t.catchIter = True # no iter expected in this test
+        assert 30 not in t
+        assert t[31].seq_id == 'new' and t[32].seq_id == 'kept'
+
     def test_attr(self):
         'test changing an attr value'
         self.db.catchIter = True # no iter expected in this test
@@ -295,6 +295,7 @@ def sqlite_enabled():
 
 class SQLite_Mixin(object):
     'use this as a base for any test'
+    serverKwargs = {} # extra args for SQLiteServerInfo
 
     def setUp(self):
         from pygr.sqlgraph import SQLiteServerInfo
@@ -302,7 +303,8 @@ class SQLite_Mixin(object):
             raise SkipTest
         self.sqlite_file = tempdatafile('test_sqlite.db', False)
         self.tearDown(False) # delete the file if it exists
-        self.serverInfo = SQLiteServerInfo(self.sqlite_file)
+        self.serverInfo = SQLiteServerInfo(self.sqlite_file,
+                                           **self.serverKwargs)
         self.sqlite_load() # load data provided by subclass method
 
     def tearDown(self, closeConnection=True):